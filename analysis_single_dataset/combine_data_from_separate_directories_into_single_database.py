@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 import pandas as pd
 from pathlib import Path
 
@@ -7,25 +8,28 @@ from pathlib import Path
 script_dir = Path(__file__).resolve().parent
 repo_dir = script_dir.parent
 
+sys.path.insert(0, str(repo_dir))
+from sipm_analysis.tables import find_table, read_table, write_table
+
 data_dir = repo_dir / 'generated_peak_data_results'
 output_dir = repo_dir / 'results-from-generated-data'
 output_dir.mkdir(exist_ok=True)
 
-# Output files go into 'results-from-generated-data'
-combined_output = output_dir / 'results_combined_peak_data.csv'
-summary_output = output_dir / 'results_first_peaks_summary.csv'
+# Output files go into 'results-from-generated-data' (Parquet, SIPM_TABLE_FORMATS=parquet,csv for CSV too)
+combined_output = output_dir / 'results_combined_peak_data'
+summary_output = output_dir / 'results_first_peaks_summary'
 
 print(f"Loading data from: {data_dir}")
 print(f"Saving results into: {output_dir}")
 
 # --- Regex for file parsing ---
-pattern = re.compile(r'peak_data_(CH\d+)_gain_(\d+\.\d+)_pulse_(\d+\.\d+)\.csv')
+pattern = re.compile(r'peak_data_(CH\d+)_gain_(\d+\.\d+)V?_pulse_(\d+\.\d+)V?\.(csv|parquet|arrow)$')
 
 # --- Collect data ---
 all_data = []
 
-for file in os.listdir(data_dir):
-    if file.endswith('.csv'):
+for file in sorted(os.listdir(data_dir)):
+    if file.endswith(('.csv', '.parquet', '.arrow')):
         match = pattern.search(file)
         if match:
             channel = match.group(1)
@@ -33,10 +37,9 @@ for file in os.listdir(data_dir):
             pulse_height = float(match.group(3))
 
             file_path = data_dir / file
-            df = pd.read_csv(file_path)
-
-            # Clean up columns just in case
-            df.columns = df.columns.str.strip()
+            if find_table(file_path) != file_path:
+                continue  # a Parquet copy of the same table is read instead
+            df = read_table(file_path)
 
             # Add metadata
             df['Channel (from filename)'] = channel
@@ -63,8 +66,8 @@ if all_data:
     else:
         combined_df = combined_df.sort_values(by=sort_cols).reset_index(drop=True)
 
-    combined_df.to_csv(combined_output, index=False)
-    print(f"✅ Combined data saved to: {combined_output}")
+    for out in write_table(combined_df, combined_output):
+        print(f"✅ Combined data saved to: {out}")
 
     # --- Summary CSV with first peak only ---
     group_cols = [
@@ -76,13 +79,13 @@ if all_data:
 
     summary_cols = [
         'Timestamp', 'Channel (from filename)', 'Gain Voltage (from filename)',
-        'Pulse Height (from filename)', 'Peak Number', 'Peak Index', 'Peak Counts'
+        'Pulse Height (from filename)', 'Peak Number', 'Peak Index', 'Peak Counts', 'Peak Width'
     ]
     simplified_df = summary_df[[col for col in summary_cols if col in summary_df.columns]]
 
     simplified_df = simplified_df.sort_values(by=group_cols).reset_index(drop=True)
-    simplified_df.to_csv(summary_output, index=False)
-    print(f"✅ First peaks summary saved to: {summary_output}")
+    for out in write_table(simplified_df, summary_output):
+        print(f"✅ First peaks summary saved to: {out}")
 
 else:
     print("⚠️ No data matched the pattern — no files saved.")
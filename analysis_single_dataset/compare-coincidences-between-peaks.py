@@ -7,11 +7,12 @@ import matplotlib
 matplotlib.use('TkAgg')  # For PyCharm interactivity
 
 from pathlib import Path
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-crop_start_amount = 100
-crop_end_amount = 3000
+crop_start_amount = 'auto'  # or a number of bins (sipm_analysis.roi)
+crop_end_amount = 'auto'
 
 # === USER CONFIGURATION ===
 data_folder_name = "20250507_more_peaks_compare_coicdence"
@@ -19,6 +20,10 @@ data_folder_name2 = "20250507_baseline_data_for_coic_comparison"
 
 # === PATH SETUP ===
 repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repo_root))
+from sipm_analysis.peaks import crop
+from sipm_analysis.roi import resolve_crop
+
 data_dir1 = repo_root / "data-photon-counts-SiPM" / data_folder_name
 data_dir2 = repo_root / "data-photon-counts-SiPM" / data_folder_name2
 
@@ -40,55 +45,33 @@ for subdir in raw_subdirs:
         if fname.startswith("CH0@"): plot_groups["CH0_original"].append(file)
         elif fname.startswith("CH1@"): plot_groups["CH1_original"].append(file)
 
-# === PLOT CH0 ===
-plt.figure(figsize=(10, 6))
-
-for file in plot_groups["CH0_filtered"]:
-    print(f"Loading CH0_filtered: {file.name}")
-    data = np.loadtxt(file)
-    data_cropped = data[crop_start_amount:-crop_end_amount]
-    indices = np.arange(len(data_cropped))
-    plt.plot(indices, data_cropped, lw=2, label=f"CH0 Filtered: {file.name}")
-
-for file in plot_groups["CH0_original"]:
-    print(f"Loading CH0_original: {file.name}")
-    data = np.loadtxt(file)
-    data_cropped = data[crop_start_amount:-crop_end_amount]
-    indices = np.arange(len(data_cropped))
-    plt.plot(indices, data_cropped, lw=2, linestyle='dashed', label=f"CH0 Original: {file.name}")
-
-plt.xlabel("Index")
-plt.ylabel("Value")
-plt.title("CH0: Filtered and Original Data")
-plt.grid(True)
-plt.legend(fontsize=8)
-plt.tight_layout()
-plt.show()
-
-# === PLOT CH1 ===
-plt.figure(figsize=(10, 6))
+# === LOAD, ONE CROP FOR EVERY SPECTRUM OF BOTH CHANNELS ===
+spectra = {}
+for group, files in plot_groups.items():
+    for file in files:
+        print(f"Loading {group}: {file.name}")
+        spectra.setdefault(group, []).append((file, np.loadtxt(file)))
+crop_start, crop_end = resolve_crop([data for loaded in spectra.values() for _, data in loaded],
+                                    crop_start_amount, crop_end_amount)
+print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
 
-for file in plot_groups["CH1_filtered"]:
-    print(f"Loading CH1_filtered: {file.name}")
-    data = np.loadtxt(file)
-    data_cropped = data[crop_start_amount:-crop_end_amount]
-    indices = np.arange(len(data_cropped))
-    plt.plot(indices, data_cropped, lw=2, label=f"CH1 Filtered: {file.name}")
+# === PLOT CH0, CH1 ===
+for ch in ("CH0", "CH1"):
+    plt.figure(figsize=(10, 6))
 
-for file in plot_groups["CH1_original"]:
-    print(f"Loading CH1_original: {file.name}")
-    data = np.loadtxt(file)
-    data_cropped = data[crop_start_amount:-crop_end_amount]
-    indices = np.arange(len(data_cropped))
-    plt.plot(indices, data_cropped, lw=2, linestyle='dashed', label=f"CH1 Original: {file.name}")
+    for state, linestyle in (("filtered", 'solid'), ("original", 'dashed')):
+        for file, data in spectra.get(f"{ch}_{state}", []):
+            indices = crop(np.arange(len(data)), crop_start, crop_end)
+            plt.plot(indices, crop(data, crop_start, crop_end), lw=2, linestyle=linestyle,
+                     label=f"{ch} {state.capitalize()}: {file.name}")
 
-plt.xlabel("Index")
-plt.ylabel("Value")
-plt.title("CH1: Filtered and Original Data")
-plt.grid(True)
-plt.legend(fontsize=8)
-plt.tight_layout()
-plt.show()
+    plt.xlabel("Index")
+    plt.ylabel("Value")
+    plt.title(f"{ch}: Filtered and Original Data")
+    plt.grid(True)
+    plt.legend(fontsize=8)
+    plt.tight_layout()
+    plt.show()
 
 
 
@@ -4,6 +4,8 @@ matplotlib.use('TkAgg')  # For PyCharm interactivity
 
 import os
 import re
+import sys
+from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import defaultdict
@@ -12,6 +14,10 @@ import math
 from scipy.ndimage import gaussian_filter1d
 import csv
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sipm_analysis.peaks import crop
+from sipm_analysis.roi import resolve_crop
+
 #========================================
 #         Parameters
 #========================================
@@ -25,8 +31,8 @@ print(f"Looking for data files in: {os.path.abspath(root_dir)}")
 #crop_off_start = 0
 #crop_off_end = 3800
 # newer lsb settings
-crop_off_start = 200
-crop_off_end = 3250
+crop_off_start = 'auto'  # or a number of bins (sipm_analysis.roi)
+crop_off_end = 'auto'
 vertical_lines = False
 counts_threshold = 100
 peak_spacing_threshold = 15
@@ -125,7 +131,7 @@ def write_peak_data_to_file(peaks, data_cropped, filename, gain_voltage, pulse_v
 # Function to find and label peaks
 def find_and_label_peaks(data, ax, label, crop_off_start,crop_off_end, color, style, vertical_lines=False,
                          print_peaks=False, channel=None, gain_voltage=None, pulse_voltage=None, output_file=None):
-    data_cropped = data[crop_off_start:-crop_off_end]
+    data_cropped = crop(data, crop_off_start, crop_off_end)
     smoothed_data = smooth_data(data_cropped)  # Apply smoothing here
     x = np.arange(len(smoothed_data))
     peaks, _ = find_peaks(smoothed_data, height=counts_threshold, distance=peak_spacing_threshold)
@@ -160,6 +166,12 @@ def find_and_label_peaks(data, ax, label, crop_off_start,crop_off_end, color, st
 #========================================
 output_file = "peak_data.csv"  # specify the file path where you want to store the data
 
+# One crop for light and dark of every channel and gain, so their Peak Index values line up
+crop_start, crop_end = resolve_crop([data for voltages in data_by_channel.values()
+                                     for spectra in voltages.values() for data in spectra.values()],
+                                    crop_off_start, crop_off_end)
+print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
+
 for channel, channel_data in data_by_channel.items():
     voltages_sorted = sorted(channel_data.keys())
     n_voltages = len(voltages_sorted)
@@ -182,8 +194,8 @@ for channel, channel_data in data_by_channel.items():
                     voltage_data[ld_type],
                     ax,
                     label=label,
-                    crop_off_start=crop_off_start,
-                    crop_off_end=crop_off_end,
+                    crop_off_start=crop_start,
+                    crop_off_end=crop_end,
                     color=color,
                     style=style,
                     vertical_lines=vertical_lines,
@@ -5,6 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 import re
+import sys
 import matplotlib.ticker as ticker
 
 #==============================================================================
@@ -15,8 +16,8 @@ import matplotlib.ticker as ticker
 
 # === CONFIGURATION ===
 exclude_peak_numbers = ["3","5", "7", "9"]  # Peaks to exclude
-crop_start_amount = 100  # How much to crop from start of signal
-crop_end_amount = 3000  # How much to crop from end of signal
+crop_start_amount = 'auto'  # How much to crop from start of signal (or a number of bins)
+crop_end_amount = 'auto'  # How much to crop from end of signal
 font_size = 20  # Font size for plots
 
 # change this to compare overlay with smaller peak heights
@@ -24,6 +25,10 @@ baseline_multiplier_cap = 2  # Max allowed scaling of baseline overlay
 
 # Paths to data directories
 repo_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(repo_root))
+from sipm_analysis.peaks import crop
+from sipm_analysis.roi import resolve_crop
+
 coic_data_dir = repo_root / "data-photon-counts-SiPM" / "20250507_more_peaks_compare_coicdence"
 baseline_data_dir = repo_root / "data-photon-counts-SiPM" / "20250507_baseline_data_for_coic_comparison" / "65_7_gain_1_6_pulse_60s"
 
@@ -56,11 +61,9 @@ for file_path in baseline_data_dir.glob("*.txt"):
         continue
     try:
         data = np.loadtxt(file_path)
-        indices_cropped = np.arange(len(data))[crop_start_amount:-crop_end_amount]
-        data_cropped = data[crop_start_amount:-crop_end_amount]
         channel = "CH0" if "CH0@" in filename else "CH1"
         label = f"Baseline ({channel})"
-        baseline_store[channel].append((indices_cropped, data_cropped, label))
+        baseline_store[channel].append((data, label))  # cropped once everything is loaded
         print(f"[LOADED] Baseline for {channel} from {filename}")
     except Exception as e:
         print(f"[ERROR] Could not load baseline {file_path}: {e}")
@@ -104,8 +107,6 @@ for subfolder in sorted(coic_data_dir.iterdir()):
 
         try:
             data = np.loadtxt(file_path)
-            indices = np.arange(len(data))[crop_start_amount:-crop_end_amount]
-            data_cropped = data[crop_start_amount:-crop_end_amount]
 
             ch = "CH0" if "CH0@" in fname else "CH1"
             filter_state = "AB Filtered" if fname.startswith("0@AddBack") else base_filter_state
@@ -118,12 +119,23 @@ for subfolder in sorted(coic_data_dir.iterdir()):
             if label_counts[legend_key] > 1:
                 plot_label += f" ({label_counts[legend_key]})"
 
-            data_store[filter_state][ch].append((indices, data_cropped, plot_label))
+            data_store[filter_state][ch].append((data, plot_label))
 
         except Exception as e:
             print(f"[ERROR] Could not load {file_path}: {e}")
 
 
+# === ONE CROP FOR THE BASELINE AND EVERY COINCIDENCE SPECTRUM ===
+stores = [baseline_store] + list(data_store.values())
+crop_start, crop_end = resolve_crop([data for store in stores for entries in store.values() for data, _ in entries],
+                                    crop_start_amount, crop_end_amount)
+print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
+for store in stores:
+    for ch, entries in store.items():
+        store[ch] = [(crop(np.arange(len(data)), crop_start, crop_end), crop(data, crop_start, crop_end), label)
+                     for data, label in entries]
+
+
 # === SCALE BASELINE TO MATCH SIGNAL ===
 def get_scaling_factor(baseline, curves):
     if not curves:
@@ -2,11 +2,12 @@ import matplotlib
 matplotlib.use('TkAgg')  # For PyCharm interactivity
 
 from pathlib import Path
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-crop_start_amount = 100
-crop_end_amount = 3000
+crop_start_amount = 'auto'  # or a number of bins (sipm_analysis.roi)
+crop_end_amount = 'auto'
 
 # === USER CONFIGURATION ===
 coic_data_folder_name = "20250507_more_peaks_compare_coicdence"
@@ -25,6 +26,10 @@ filenames = [
 
 # === PATH SETUP ===
 repo_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(repo_root))
+from sipm_analysis.peaks import crop
+from sipm_analysis.roi import resolve_crop
+
 coic_directory = repo_root / "data-photon-counts-SiPM" / coic_data_folder_name / coic_baseline_data
 peaks_to_compare_data_directory = repo_root / "data-photon-counts-SiPM" / peak_baseline_data_folder_name / peak_baseline_data
 
@@ -39,10 +44,13 @@ for fname, label in filenames:
     print(f"Loading from: {file_path}")
 
     assert file_path.exists(), f"File not found: {file_path}"
-    data = np.loadtxt(file_path)
-    data_cropped = data[crop_start_amount:-crop_end_amount]
-    indices = np.arange(len(data_cropped))
-    plot_data.append((indices, data_cropped, label))
+    plot_data.append((np.loadtxt(file_path), label))
+
+# One crop for all curves, so they share the same bins
+crop_start, crop_end = resolve_crop([data for data, _ in plot_data], crop_start_amount, crop_end_amount)
+print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
+plot_data = [(np.arange(len(data) - crop_start - crop_end), crop(data, crop_start, crop_end), label)
+             for data, label in plot_data]
 
 # === PLOT ===
 plt.figure(figsize=(10, 6))
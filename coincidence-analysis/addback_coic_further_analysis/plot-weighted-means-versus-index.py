@@ -4,7 +4,6 @@
 import matplotlib
 matplotlib.use('TkAgg')  # For PyCharm interactivity
 
-import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 from datetime import datetime
@@ -19,10 +18,14 @@ y_axis_label = "Weighted Mean Index"
 x_axis_label = "CH1 Peak Number"
 
 from pathlib import Path
+import sys
 
-# Set path to one level up
-csv_path = Path(__file__).resolve().parent.parent / "processed_peak_data.csv"
-df = pd.read_csv(csv_path)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from sipm_analysis.tables import read_table
+
+# Set path to one level up (Parquet, or the older CSV)
+table_path = Path(__file__).resolve().parent.parent / "processed_peak_data.parquet"
+df = read_table(table_path)
 
 # Filter by state
 df_filtered = df[df['state'] == 'filtered'].reset_index(drop=True)
@@ -3,113 +3,89 @@ matplotlib.use('TkAgg')  # For PyCharm interactivity
 
 from pathlib import Path
 import matplotlib.pyplot as plt
-import csv
+import pandas as pd
 import re
+import sys
 import numpy as np
-from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sipm_analysis.coincidence import discover_addback_files, summarize_addback_spectrum
+from sipm_analysis.loaders import load_spectrum
+from sipm_analysis.metrics import RunMetrics
+from sipm_analysis.peaks import crop
+from sipm_analysis.results_store import ResultsStore, acquisition_date
+from sipm_analysis.roi import resolve_crop
+from sipm_analysis.tables import write_table
 
 script_name = Path(__file__).name  # ✅ Provenance tracking
+run_metrics = RunMetrics(script_name)
 
 # === SETTINGS ===
 include_second_peaks = [3, 4, 5, 6, 7, 8]
 crop_data = True
-crop_start_amount = 100
-crop_end_amount = 3000
+crop_start_amount = 'auto'  # or a number of bins
+crop_end_amount = 'auto'
 data_directory = "20250507_more_peaks_compare_coicdence"
 font_size = 24
 font_size_legend = 14
 time_per_sample = 1.0
 
-peak_data = []
-
-# === Weighted Mean Function ===
-def calculate_weighted_mean(data, time_per_sample=1.0):
-    if len(data) == 0 or np.sum(data) == 0:
-        print("[WARNING] Empty or zero-sum data passed to weighted mean calculation.")
-        return None, None, 0
-
-    indices = np.arange(len(data))
-    total_counts = np.sum(data)
-    weighted_mean_index = np.average(indices, weights=data)
-    weighted_mean_time = weighted_mean_index * time_per_sample
-
-    return weighted_mean_index, weighted_mean_time, total_counts
-
 # === PATHS ===
 script_dir = Path(__file__).resolve().parent
 data_dir = script_dir.parent / "data-photon-counts-SiPM" / data_directory
 
-# === DISCOVER PEAK DIRECTORIES ===
-peak_dirs = [subdir for subdir in data_dir.rglob("*") if subdir.is_dir() and subdir.name.startswith("peak")]
 
-file_groups = {}
-for peak_dir in peak_dirs:
-    parts = peak_dir.name.split("_")
-    first_peak = parts[0].replace("peak", "")
-    second_peak = parts[1].replace("and", "")
-    coincidence = f"Peak {first_peak} and {second_peak}"
-    correlation_time = parts[2]
-    state = next((word for word in ["filtered", "unfiltered", "raw"] if word in parts), "")
+def sort_legend_key(label):
+    second_peak = re.search(r"Peak \d+ and (\d+)", label)
+    window = re.search(r",\s*([\d\.]+)", label)
+    return (int(second_peak.group(1)) if second_peak else float('inf'),
+            float(window.group(1)) if window else float('inf'))
 
-    data_files = list(peak_dir.glob("*.txt"))
-    for file_path in data_files:
-        if "AddBack" in file_path.name:
-            channel_number = file_path.name.split("_")[1]
-            group_key = (channel_number, "AddBack")
-            file_groups.setdefault(group_key, []).append((file_path, correlation_time, coincidence, state))
 
-# === PLOTTING & PEAK DATA COLLECTION ===
-for (channel, structure), files in file_groups.items():
-    plt.figure(figsize=(10, 6))
-
-    for file_path, correlation_time, coincidence, state in files:
-        match = re.search(r"Peak \d+ and (\d+)", coincidence)
-        if match:
-            second_peak_num = int(match.group(1))
-            if second_peak_num not in include_second_peaks:
+def load_addback_groups(groups):
+    """{(channel, structure): [(file_path, settings, data), ...]} of the included second peaks."""
+    loaded = {}
+    for key, files in groups.items():
+        for file_path, settings in files:
+            if settings["second_peak"] not in include_second_peaks:
                 continue
-        else:
-            continue
+            with run_metrics.stage("load"):
+                data = load_spectrum(file_path, delimiter=None)
+            run_metrics.count("files_loaded")
+            run_metrics.count("bins_processed", len(data))
+            loaded.setdefault(key, []).append((file_path, settings, data))
+    return loaded
 
-        data = np.loadtxt(file_path)
-        if crop_data:
-            indices = np.arange(len(data))
-            indices_cropped = indices[crop_start_amount:-crop_end_amount]
-            data = data[crop_start_amount:-crop_end_amount]
 
-        peak_value = np.max(data)
-        peak_index = int(np.argmax(data))
-        timestamp = peak_index * time_per_sample
+def process_addback_group(channel, structure, spectra, crop_start=0, crop_end=0):
+    """Plots and summarizes one group; every spectrum is cropped by the same (run wide) crop_start / crop_end."""
+    peak_data = []
+    plt.figure(figsize=(10, 6))
 
-        # ✅ Compute weighted mean for this curve
-        weighted_mean_index, weighted_mean_time, total_counts = calculate_weighted_mean(data, time_per_sample)
+    for file_path, settings, data in spectra:
+        indices_cropped = np.arange(len(data))
+        if crop_data:
+            indices_cropped = crop(indices_cropped, crop_start, crop_end)
+            data = crop(data, crop_start, crop_end)
 
-        print(f"[{file_path.name}] Weighted Mean Index: {weighted_mean_index:.2f}, Time: {weighted_mean_time:.2f}, Total Counts: {total_counts:.2f}")
+        # ✅ Compute weighted mean for this curve
+        with run_metrics.stage("weighted_mean"):
+            row = summarize_addback_spectrum(data, settings, channel, structure, file_path.name,
+                                             script_name, time_per_sample, crop_start if crop_data else 0)
+        run_metrics.count("events_processed", row["total_counts"])
+        peak_data.append(row)
 
-        peak_data.append({
-            "time_ran":  datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # ✅ timestampp,
-            "correlation_time": correlation_time,
-            "coincidence": coincidence,
-            "state": state,
-            "channel": channel,
-            "structure": structure,
-            "second_peak": second_peak_num,
-            "peak_value": peak_value,
-            "peak_index": peak_index,
-            "file_used_in_analysis": file_path.name,
-            "python_file_used_to_generate_this": script_name,
-            "weighted_mean_index": weighted_mean_index,
-            "weighted_mean_time": weighted_mean_time,
-            "total_counts": total_counts,
-            "timestamp": timestamp,
-        })
+        print(f"[{file_path.name}] Weighted Mean Index: {row['weighted_mean_index']:.2f}, "
+              f"Time: {row['weighted_mean_time']:.2f}, Total Counts: {row['total_counts']:.2f}")
 
         # Plot curve
-        x_vals = np.arange(len(data))
-        plt.plot(indices_cropped, data, label=f"{coincidence}, {correlation_time}", linewidth=3)
+        with run_metrics.stage("plot"):
+            plt.plot(indices_cropped, data, label=f"{settings['coincidence']}, {settings['correlation_time']}",
+                     linewidth=3)
 
-        # Plot weighted mean vertical line
-        plt.axvline(x=weighted_mean_index, color='gray', linestyle='--', linewidth=2)
+            # Plot weighted mean vertical line
+            plt.axvline(x=row["weighted_mean_index"] + row["crop_off_start"], color='gray', linestyle='--',
+                        linewidth=2)
 
     plt.xlabel("Index", fontsize=font_size)
     plt.ylabel("Counts", fontsize=font_size)
@@ -120,28 +96,50 @@ for (channel, structure), files in file_groups.items():
 
     handles, labels = plt.gca().get_legend_handles_labels()
     if handles:
-        sorted_pairs = sorted(zip(handles, labels),
-                              key=lambda x: (int(re.search(r"Peak \d+ and (\d+)", x[1]).group(1))
-                                             if re.search(r"Peak \d+ and (\d+)", x[1]) else float('inf'),
-                                             float(re.search(r",\s*([\d\.]+)", x[1]).group(1))
-                                             if re.search(r",\s*([\d\.]+)", x[1]) else float('inf')))
+        sorted_pairs = sorted(zip(handles, labels), key=lambda x: sort_legend_key(x[1]))
         sorted_handles, sorted_labels = zip(*sorted_pairs)
         plt.legend(sorted_handles, sorted_labels, fontsize=font_size_legend)
 
     plt.tight_layout()
     plt.show()
+    return peak_data
+
+
+def write_processed_peak_data(peak_data, output_file):
+    peak_data_sorted = sorted(peak_data, key=lambda x: (x['channel'], x['state'] != 'filtered', x['second_peak']))
+
+    with run_metrics.stage("write_table"):
+        df = pd.DataFrame(peak_data_sorted)
+        written = write_table(df, output_file)
+
+    for out in written:
+        print(f"✅ Final peak data saved to {out}")
+
+    with run_metrics.stage("store_append"):
+        results_dir = script_dir.parent / 'results-from-generated-data'
+        ResultsStore(results_dir / 'store').append('coincidence', df, acquisition_date(data_dir))
+
+
+if __name__ == '__main__':
+    # === PLOTTING & PEAK DATA COLLECTION ===
+    loaded = load_addback_groups(discover_addback_files(data_dir))
+
+    # One crop for the whole run, so peak_index / weighted_mean_index share an origin across files
+    crop_start, crop_end = 0, 0
+    if crop_data:
+        crop_start, crop_end = resolve_crop([data for spectra in loaded.values() for _, _, data in spectra],
+                                            crop_start_amount, crop_end_amount)
+        print(f"[ROI] crop_off_start={crop_start}, crop_off_end={crop_end}")
 
-# === FINAL OUTPUT CSV ===
-output_file = script_dir / "processed_peak_data.csv"
-peak_data_sorted = sorted(peak_data, key=lambda x: (x['channel'], x['state'] != 'filtered', x['second_peak']))
+    peak_data = []
+    for (channel, structure), spectra in loaded.items():
+        peak_data.extend(process_addback_group(channel, structure, spectra, crop_start, crop_end))
 
-fieldnames = list(peak_data_sorted[0].keys())
-with open(output_file, 'w', newline='') as f:
-    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(peak_data_sorted)
+    # === FINAL OUTPUT CSV ===
+    write_processed_peak_data(peak_data, script_dir / "processed_peak_data.csv")
 
-print(f"✅ Final peak data saved to {output_file}")
+    run_metrics.print_summary()
+    run_metrics.write_json()
 
 # import matplotlib
 # matplotlib.use('TkAgg')  # For PyCharm interactivity
@@ -1,30 +1,22 @@
 import matplotlib
 matplotlib.use('TkAgg')  # For PyCharm interactivity
 
-import os
-import re
 import numpy as np
 import matplotlib.pyplot as plt
-from collections import defaultdict
-from scipy.signal import find_peaks
-from scipy.ndimage import gaussian_filter1d
-import csv
-from datetime import datetime
 from pathlib import Path
 import pandas as pd
 
-# ========================================
-# Clean Output Directory Before Writing New Peak Data
-# ========================================
-generated_data_dir = Path('generated_peak_data_results')
-if generated_data_dir.exists():
-    print(f"🗑️ Clearing existing files in {generated_data_dir} ...")
-    for file in generated_data_dir.glob('peak_data_*.csv'):
-        file.unlink()
-    print(f"✅ Cleaned up {generated_data_dir}")
-else:
-    print(f"📁 Creating directory {generated_data_dir}")
-    generated_data_dir.mkdir(parents=True, exist_ok=True)
+from sipm_analysis.loaders import load_spectra, group_by_channel_and_gain
+from sipm_analysis.autotune import auto_peak_params
+from sipm_analysis.metrics import RunMetrics
+from sipm_analysis.peaks import (CROP_OFFSET_COLUMN, crop, smooth_data, find_spectrum_peaks, manual_peaks_in_crop,
+                                  write_peak_data_to_file)
+from sipm_analysis.plotting import draw_peaks, pulse_color_map
+from sipm_analysis.results_store import ResultsStore, acquisition_date
+from sipm_analysis.roi import resolve_crop
+from sipm_analysis.tables import write_table
+
+run_metrics = RunMetrics(Path(__file__).name)
 
 # ========================================
 # Parameters
@@ -32,142 +24,142 @@ else:
 data_dir = 'data-photon-counts-SiPM/20250428_more_light'
 pulse_voltages_to_plot = [1.6]
 gain_voltages_to_plot = [ 65.7]
-crop_off_start = 100
-crop_off_end = 3000
+# 'auto': crop every spectrum to the populated bins all of them share (sipm_analysis.roi), or a number of bins
+crop_off_start = 'auto'
+crop_off_end = 'auto'
 vertical_lines = False
 counts_threshold = 100
 peak_spacing_threshold = 16
 sigma = 3.6
+# True: estimate sigma / counts_threshold / peak_spacing_threshold from each spectrum's peak spacing
+auto_params = False
+# 'threshold': counts_threshold on the smoothed counts, 'baseline': fingers above the smooth envelope
+# (finds the small peaks on the slopes that otherwise need manual_peak_indices),
+# 'cwt': multi-scale wavelet peaks on the unsmoothed counts (sigma then only smooths the plotted curve)
+peak_method = 'threshold'
 
-pulse_color_map = {
-    1.0: 'black', 1.1: 'darkblue', 1.3: 'green',
-    1.6: 'orange', 2.0: 'deeppink', 2.3: 'red',
-}
-
+# Bins of the full spectrum (not counted from the crop, which 'auto' moves from day to day)
 manual_peak_indices = {
-    ('CH0', 65.7, 1.6): [140, 178, 553, 590],
-    ('CH1', 65.7, 1.6): [130, 177],
+    ('CH0', 65.7, 1.6): [240, 278, 653, 690],
+    ('CH1', 65.7, 1.6): [230, 277],
 }
 
-data_by_channel = {"CH0": defaultdict(lambda: defaultdict(list)),
-                   "CH1": defaultdict(lambda: defaultdict(list))}
-pulse_by_voltage = defaultdict(lambda: defaultdict(float))
+generated_data_dir = Path('generated_peak_data_results')
+# Result tables are Parquet, set SIPM_TABLE_FORMATS=parquet,csv (or put 'csv' here) to also get CSV
+table_formats = None
 
 # ========================================
 # Functions
 # ========================================
-def extract_gain_and_pulse_voltages(filename):
-    match = re.search(r"_(\d+)_?(\d+)_gain_(\d+)_?(\d+)[Vv]?_pulse", filename)
-    if match:
-        gain = float(f"{match.group(1)}.{match.group(2)}")
-        pulse = float(f"{match.group(3)}.{match.group(4)}")
-        return gain, pulse
-    return None, None
-
-def smooth_data(data, sigma=sigma):
-    return gaussian_filter1d(data, sigma=sigma)
-
-def write_peak_data_to_file(peaks, data_cropped, filename, gain_voltage, pulse_voltage, channel):
-    timestamp_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([
-            "Timestamp", "Channel", "Voltage Gain (V)", "Pulse Voltage (V)",
-            "Peak Number", "Peak Index", "Peak Counts", "Index Difference"
-        ])
-        for i, peak_idx in enumerate(peaks):
-            count_value = data_cropped[peak_idx]
-            diff = peak_idx - peaks[i - 1] if i > 0 else "N/A"
-            writer.writerow([
-                timestamp_str, channel, gain_voltage, pulse_voltage,
-                i + 1, peak_idx, count_value, diff
-            ])
-    print(f"✅ Peak data written to {filename}")
+def clean_output_dir():
+    # Clean Output Directory Before Writing New Peak Data
+    if generated_data_dir.exists():
+        print(f"🗑️ Clearing existing files in {generated_data_dir} ...")
+        for file in generated_data_dir.glob('peak_data_*.*'):
+            file.unlink()
+        print(f"✅ Cleaned up {generated_data_dir}")
+    else:
+        print(f"📁 Creating directory {generated_data_dir}")
+        generated_data_dir.mkdir(parents=True, exist_ok=True)
 
 def find_and_label_peaks(data, ax, label, crop_off_start, crop_off_end, color, style,
                          vertical_lines=False, channel=None, gain_voltage=None, pulse_voltage=None,
-                         output_file=None, manual_peaks=None):
-    data_cropped = data[crop_off_start:-crop_off_end]
-    smoothed_data = smooth_data(data_cropped)
-    x = np.arange(len(smoothed_data))
+                         output_file=None, manual_peaks=None, peak_tables=None):
+    data_cropped = crop(data, crop_off_start, crop_off_end)
+    params = {'sigma': sigma, 'counts_threshold': counts_threshold, 'peak_spacing_threshold': peak_spacing_threshold}
+    if auto_params:
+        with run_metrics.stage("auto_params"):
+            params = auto_peak_params(data_cropped)
+        print(f"[AUTO] {label}: sigma = {params['sigma']:.2f}, counts_threshold = {params['counts_threshold']:.0f}, "
+              f"peak_spacing_threshold = {params['peak_spacing_threshold']}")
 
-    peaks, _ = find_peaks(smoothed_data, height=counts_threshold, distance=peak_spacing_threshold)
-    if manual_peaks is not None:
-        peaks = np.unique(np.concatenate([peaks, np.array(manual_peaks)]))
+    with run_metrics.stage("smooth"):
+        smoothed_data = smooth_data(data_cropped, sigma=params['sigma'])
+    x = np.arange(len(smoothed_data))
 
-    ax.plot(x, smoothed_data, label=label, alpha=0.8, color=color, linestyle=style, linewidth=2)
-    counts_at_peaks = smoothed_data[peaks]
-    errors = np.sqrt(counts_at_peaks)
-    ax.errorbar(x[peaks], counts_at_peaks, yerr=errors, fmt='o', color=color,
-                ecolor='gray', elinewidth=1, capsize=3, markersize=5, label=f"{label} Peaks")
+    with run_metrics.stage("find_peaks"):
+        peaks = find_spectrum_peaks(smoothed_data, params['counts_threshold'], params['peak_spacing_threshold'],
+                                    manual_peaks, prominence=params.get('prominence'),
+                                    method=peak_method, sigma=params['sigma'], raw_data=data_cropped)
+    run_metrics.count("bins_processed", len(smoothed_data))
+    run_metrics.count("peaks_found", len(peaks))
 
-    if vertical_lines:
-        for p in peaks:
-            ax.axvline(x=p, color=color, linestyle='--', linewidth=1)
+    with run_metrics.stage("plot"):
+        draw_peaks(ax, x, smoothed_data, peaks, label, color, style, vertical_lines)
 
     if output_file:
-        write_peak_data_to_file(peaks, smoothed_data, output_file, gain_voltage, pulse_voltage, channel)
+        with run_metrics.stage("write_table"):
+            df = write_peak_data_to_file(peaks, smoothed_data, output_file, gain_voltage, pulse_voltage, channel,
+                                         formats=table_formats)
+        if peak_tables is not None:
+            peak_tables.append(df.assign(SourceFile=Path(output_file).stem, **{CROP_OFFSET_COLUMN: crop_off_start}))
 
     return peaks
 
-# ========================================
-# Load Data Files
-# ========================================
-print("\n=== Loading Data Files ===\n")
-for subdir, _, files in os.walk(data_dir):
-    for file in files:
-        if not file.startswith("CH") or "dark" in file.lower():
-            continue
+def combine_peak_data(peak_tables, results_dir):
+    # Combine All Peak Data into Final Output table (from memory, no re-reading)
+    if not peak_tables:
+        print("[WARNING] No peak tables were produced, nothing to combine")
+        return None
 
-        full_path = os.path.join(subdir, file)
-        try:
-            data = np.loadtxt(full_path, delimiter=',')
-        except Exception as e:
-            print(f"[ERROR] Could not load {full_path}: {e}")
-            continue
+    print(f"Combining {len(peak_tables)} peak tables.")
+    with run_metrics.stage("combine_tables"):
+        combined_df = pd.concat(peak_tables, ignore_index=True).sort_values(
+            by=['Channel', 'Voltage Gain (V)', 'Pulse Voltage (V)', 'Peak Index'],
+            ascending=[True, True, True, True]
+        )
+        written = write_table(combined_df, results_dir / 'all_peaks_combined_sorted', table_formats)
 
-        gain_v, pulse_v = extract_gain_and_pulse_voltages(file)
-        if gain_v is None:
-            print(f"[SKIPPED] Could not parse voltages from: {file}")
-            continue
+    # Keep this day's peaks next to the earlier days for long-term comparisons
+    with run_metrics.stage("store_append"):
+        ResultsStore(results_dir / 'store').append('peaks', combined_df, acquisition_date(data_dir))
 
-        if gain_voltages_to_plot and gain_v not in gain_voltages_to_plot:
-            continue
-        if pulse_voltages_to_plot and pulse_v not in pulse_voltages_to_plot:
-            continue
+    for out in written:
+        print(f"✅ Combined peak data written to: {out}")
+    return written
 
-        channel = "CH0" if "CH0" in file else "CH1"
-        print(f"[LOADED] {channel} | Gain = {gain_v} V | Pulse = {pulse_v} V | from {file}")
-        data_by_channel[channel][gain_v]["light"].append((data, pulse_v, file))
-        pulse_by_voltage[channel][gain_v] = pulse_v
+def main():
+    clean_output_dir()
 
-# ========================================
-# Plotting & Peak Detection
-# ========================================
-print("\n=== Plotting and Peak Detection ===\n")
+    # ========================================
+    # Load Data Files
+    # ========================================
+    print("\n=== Loading Data Files ===\n")
+    spectra = load_spectra(data_dir, gain_voltages_to_plot, pulse_voltages_to_plot, run_metrics=run_metrics)
+    data_by_channel = group_by_channel_and_gain(spectra)
+    peak_tables = []
+    # One crop for every spectrum, so the overlaid curves and the Peak Index values line up
+    with run_metrics.stage("roi"):
+        crop_start, crop_end = resolve_crop([spectrum.data for spectrum in spectra], crop_off_start, crop_off_end)
+    print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
+
+    # ========================================
+    # Plotting & Peak Detection
+    # ========================================
+    print("\n=== Plotting and Peak Detection ===\n")
 
-for channel, channel_data in data_by_channel.items():
-    voltages_sorted = sorted(channel_data.keys())
-    fig, axes = plt.subplots(len(voltages_sorted), 1, figsize=(15, 4 * len(voltages_sorted)))
-    axes = np.atleast_1d(axes)
+    for channel, channel_data in data_by_channel.items():
+        voltages_sorted = sorted(channel_data.keys())
+        fig, axes = plt.subplots(len(voltages_sorted), 1, figsize=(15, 4 * len(voltages_sorted)))
+        axes = np.atleast_1d(axes)
 
-    for idx, gain_v in enumerate(voltages_sorted):
-        ax = axes[idx]
-        voltage_data = channel_data[gain_v]
+        for idx, gain_v in enumerate(voltages_sorted):
+            ax = axes[idx]
 
-        if "light" in voltage_data:
-            for data, pulse_v, src in voltage_data["light"]:
+            for spectrum in channel_data[gain_v]:
+                pulse_v = spectrum.pulse
                 color = pulse_color_map.get(pulse_v, 'gray')
                 label = f"{pulse_v}V pulse"
-                manual_peaks = manual_peak_indices.get((channel, gain_v, pulse_v))
+                manual_peaks = manual_peaks_in_crop(manual_peak_indices.get((channel, gain_v, pulse_v)), crop_start,
+                                                    len(spectrum.data) - crop_start - crop_end)
                 output_file = generated_data_dir / f"peak_data_{channel}_gain_{gain_v}V_pulse_{pulse_v}V.csv"
 
                 find_and_label_peaks(
-                    data=data,
+                    data=spectrum.data,
                     ax=ax,
                     label=label,
-                    crop_off_start=crop_off_start,
-                    crop_off_end=crop_off_end,
+                    crop_off_start=crop_start,
+                    crop_off_end=crop_end,
                     color=color,
                     style='solid',
                     vertical_lines=vertical_lines,
@@ -175,44 +167,30 @@ for channel, channel_data in data_by_channel.items():
                     gain_voltage=gain_v,
                     pulse_voltage=pulse_v,
                     output_file=output_file,
-                    manual_peaks=manual_peaks
+                    manual_peaks=manual_peaks,
+                    peak_tables=peak_tables
                 )
 
-        ax.set_title(f"{channel} — {gain_v} V gain", fontsize=18)
-        ax.set_xlabel("Index", fontsize=14)
-        ax.set_ylabel("Counts", fontsize=14)
-        ax.grid(True)
-        ax.legend(fontsize=10)
-
-    plt.tight_layout()
-    plt.show()
-
-# ========================================
-# Combine All Peak Data into Final Output CSV
-# ========================================
-repo_root = Path(__file__).resolve().parent
-results_dir = repo_root / 'results-from-generated-data'
-results_dir.mkdir(parents=True, exist_ok=True)
-
-csv_files = list(generated_data_dir.glob('peak_data_*.csv'))
-if not csv_files:
-    print(f"[WARNING] No peak_data_*.csv files found in {generated_data_dir}")
-else:
-    print(f"Found {len(csv_files)} peak data CSV files to combine.")
+            ax.set_title(f"{channel} — {gain_v} V gain", fontsize=18)
+            ax.set_xlabel("Index", fontsize=14)
+            ax.set_ylabel("Counts", fontsize=14)
+            ax.grid(True)
+            ax.legend(fontsize=10)
 
-    combined_df = pd.concat(
-        [pd.read_csv(f).assign(SourceFile=f.name) for f in csv_files],
-        ignore_index=True
-    ).sort_values(
-        by=['Channel', 'Voltage Gain (V)', 'Pulse Voltage (V)', 'Peak Index'],
-        ascending=[True, True, True, True]
-    )
+        with run_metrics.stage("plot"):
+            plt.tight_layout()
+        plt.show()  # blocking window, deliberately not timed
 
-    combined_output_file = results_dir / 'all_peaks_combined_sorted.csv'
-    combined_df.to_csv(combined_output_file, index=False)
+    repo_root = Path(__file__).resolve().parent
+    results_dir = repo_root / 'results-from-generated-data'
+    results_dir.mkdir(parents=True, exist_ok=True)
+    combine_peak_data(peak_tables, results_dir)
 
-    print(f"✅ Combined peak data written to: {combined_output_file}")
+    run_metrics.print_summary()
+    run_metrics.write_json(results_dir / 'metrics')
 
+if __name__ == '__main__':
+    main()
 
 
 # import matplotlib
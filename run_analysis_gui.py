@@ -1,58 +1,64 @@
 import tkinter as tk
 from tkinter import messagebox, filedialog
-import subprocess
 import os
 import json
 
+from sipm_analysis.pipeline import DEFAULT_PARAMS, build_sipm_pipeline, run_pipeline
+from sipm_analysis.roi import is_auto
+
 # Default values for parameters
 DEFAULTS = {
+    "data_dir": DEFAULT_PARAMS["data_dir"],
     "gain_voltages_to_plot": "65.7",  # string, will parse to list of floats
-    "crop_off_start": "0",
-    "crop_off_end": "0",
+    "crop_off_start": "auto",  # "auto": from the populated bins of the spectra, or a number of bins
+    "crop_off_end": "auto",
     "counts_threshold": "10",
     "peak_spacing_threshold": "5",
     "sigma": "1.0",
-    "manual_peak_indices": "",  # comma separated indices
+    "manual_peak_indices": "",  # comma separated bins of the full (uncropped) spectrum
+    "peak_method": "threshold",  # or "baseline": fingers above the smooth envelope, "cwt": wavelet peaks
+    "auto_params": False,  # sigma/thresholds estimated from the spectrum, the fields above are ignored
 }
 
+# Kept between button presses so unchanged stages (e.g. loading) are reused
+pipeline = build_sipm_pipeline()
+
 def run_scripts(params):
-    # Save params to a JSON config file, or export as env vars
+    # Save params so the run can be repeated with `python -m sipm_analysis.pipeline`
     with open("params_config.json", "w") as f:
         json.dump(params, f)
-    
-    # Run your main plotting script, passing config path or params as needed
-    # Example assuming plot-fit-peaks-SiPM-data.py reads params_config.json
-    p1 = subprocess.run(["python", "plot-fit-peaks-SiPM-data.py"])
-    
-    if p1.returncode != 0:
-        messagebox.showerror("Error", "plot-fit-peaks-SiPM-data.py failed.")
-        return
-    
-    # Change directory for next scripts
-    os.chdir("single-channel-analysis")
-    
-    p2 = subprocess.run(["python", "plot_index_vs_peak.py"])
-    p3 = subprocess.run(["python", "plot_spacing_between_peaks.py"])
-    
-    if p2.returncode != 0 or p3.returncode != 0:
-        messagebox.showerror("Error", "One of the single-channel-analysis scripts failed.")
+
+    # All stages run in this process, only the final tables are written to disk
+    try:
+        outputs = run_pipeline(dict(DEFAULT_PARAMS, **params), pipeline)
+    except Exception as e:
+        messagebox.showerror("Error", f"Analysis failed: {e}")
         return
-    
-    messagebox.showinfo("Success", "All scripts ran successfully!")
+
+    results_dir = os.path.dirname(outputs["write"][0])
+    messagebox.showinfo("Success", f"Analysis finished, results in {results_dir}")
     # Optionally open folder or files here for viewing
-    os.startfile(os.getcwd())  # Opens the folder in File Explorer (Windows)
+    if hasattr(os, "startfile"):
+        os.startfile(results_dir)  # Opens the folder in File Explorer (Windows)
+
+def parse_crop(text):
+    text = text.strip()
+    return "auto" if is_auto(text) else int(text)
 
 def on_submit():
     params = {}
     try:
         # parse and validate input values
+        params["data_dir"] = entry_data_dir.get().strip()
         params["gain_voltages_to_plot"] = [float(x.strip()) for x in entry_gain.get().split(",") if x.strip()]
-        params["crop_off_start"] = int(entry_crop_start.get())
-        params["crop_off_end"] = int(entry_crop_end.get())
+        params["crop_off_start"] = parse_crop(entry_crop_start.get())
+        params["crop_off_end"] = parse_crop(entry_crop_end.get())
         params["counts_threshold"] = int(entry_counts_thresh.get())
         params["peak_spacing_threshold"] = int(entry_peak_spacing.get())
         params["sigma"] = float(entry_sigma.get())
         params["manual_peak_indices"] = [int(x.strip()) for x in entry_manual_peaks.get().split(",") if x.strip()]
+        params["auto_params"] = auto_params_var.get()
+        params["peak_method"] = peak_method_var.get()
     except Exception as e:
         messagebox.showerror("Input error", f"Invalid input: {e}")
         return
@@ -63,43 +69,63 @@ root = tk.Tk()
 root.title("SiPM Data Plotter")
 
 # Build form
-tk.Label(root, text="Gain voltages to plot (comma-separated floats):").grid(row=0, column=0)
+def browse_data_dir():
+    folder = filedialog.askdirectory(initialdir=entry_data_dir.get())
+    if folder:
+        entry_data_dir.delete(0, tk.END)
+        entry_data_dir.insert(0, folder)
+
+tk.Label(root, text="Data directory:").grid(row=0, column=0)
+entry_data_dir = tk.Entry(root, width=40)
+entry_data_dir.grid(row=0, column=1)
+entry_data_dir.insert(0, DEFAULTS["data_dir"])
+tk.Button(root, text="Browse...", command=browse_data_dir).grid(row=0, column=2)
+
+tk.Label(root, text="Gain voltages to plot (comma-separated floats):").grid(row=1, column=0)
 entry_gain = tk.Entry(root, width=40)
-entry_gain.grid(row=0, column=1)
+entry_gain.grid(row=1, column=1)
 entry_gain.insert(0, DEFAULTS["gain_voltages_to_plot"])
 
-tk.Label(root, text="Crop off start (int):").grid(row=1, column=0)
+tk.Label(root, text="Crop off start (int or auto):").grid(row=2, column=0)
 entry_crop_start = tk.Entry(root)
-entry_crop_start.grid(row=1, column=1)
+entry_crop_start.grid(row=2, column=1)
 entry_crop_start.insert(0, DEFAULTS["crop_off_start"])
 
-tk.Label(root, text="Crop off end (int):").grid(row=2, column=0)
+tk.Label(root, text="Crop off end (int or auto):").grid(row=3, column=0)
 entry_crop_end = tk.Entry(root)
-entry_crop_end.grid(row=2, column=1)
+entry_crop_end.grid(row=3, column=1)
 entry_crop_end.insert(0, DEFAULTS["crop_off_end"])
 
-tk.Label(root, text="Counts threshold (int):").grid(row=3, column=0)
+tk.Label(root, text="Counts threshold (int):").grid(row=4, column=0)
 entry_counts_thresh = tk.Entry(root)
-entry_counts_thresh.grid(row=3, column=1)
+entry_counts_thresh.grid(row=4, column=1)
 entry_counts_thresh.insert(0, DEFAULTS["counts_threshold"])
 
-tk.Label(root, text="Peak spacing threshold (int):").grid(row=4, column=0)
+tk.Label(root, text="Peak spacing threshold (int):").grid(row=5, column=0)
 entry_peak_spacing = tk.Entry(root)
-entry_peak_spacing.grid(row=4, column=1)
+entry_peak_spacing.grid(row=5, column=1)
 entry_peak_spacing.insert(0, DEFAULTS["peak_spacing_threshold"])
 
-tk.Label(root, text="Sigma (float):").grid(row=5, column=0)
+tk.Label(root, text="Sigma (float):").grid(row=6, column=0)
 entry_sigma = tk.Entry(root)
-entry_sigma.grid(row=5, column=1)
+entry_sigma.grid(row=6, column=1)
 entry_sigma.insert(0, DEFAULTS["sigma"])
 
-tk.Label(root, text="Manual peak indices (comma-separated ints):").grid(row=6, column=0)
+tk.Label(root, text="Manual peak bins, uncropped spectrum (comma-separated ints):").grid(row=7, column=0)
 entry_manual_peaks = tk.Entry(root)
-entry_manual_peaks.grid(row=6, column=1)
+entry_manual_peaks.grid(row=7, column=1)
 entry_manual_peaks.insert(0, DEFAULTS["manual_peak_indices"])
 
+auto_params_var = tk.BooleanVar(value=DEFAULTS["auto_params"])
+tk.Checkbutton(root, text="Automatic sigma / thresholds (from the peak spacing)",
+               variable=auto_params_var).grid(row=8, column=0, columnspan=2)
+
+tk.Label(root, text="Peak method:").grid(row=9, column=0)
+peak_method_var = tk.StringVar(value=DEFAULTS["peak_method"])
+tk.OptionMenu(root, peak_method_var, "threshold", "baseline", "cwt").grid(row=9, column=1, sticky="w")
+
 # Submit button
 submit_btn = tk.Button(root, text="Run Analysis", command=on_submit)
-submit_btn.grid(row=7, column=0, columnspan=2, pady=10)
+submit_btn.grid(row=10, column=0, columnspan=2, pady=10)
 
 root.mainloop()
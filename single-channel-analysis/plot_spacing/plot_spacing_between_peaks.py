@@ -1,27 +1,29 @@
 import matplotlib
 matplotlib.use('TkAgg')
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
+import sys
 import matplotlib.ticker as ticker
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from sipm_analysis.tables import find_table, read_table
+
 def plot_spacing_between_peaks():
     # === Paths Setup ===
     script_dir = Path(__file__).resolve().parent
     repo_root = script_dir.parent.parent
     results_dir = repo_root / 'results-from-generated-data'
-    data_file = results_dir / 'results_spacing_from_slope.csv'
+    data_file = find_table(results_dir / 'results_spacing_from_slope')
 
     # === Load Data ===
     print(f"\n🟢 Loading data from file: {data_file}")
-    if not data_file.exists():
-        raise FileNotFoundError(f"❌ File does not exist: {data_file}")
+    if data_file is None:
+        raise FileNotFoundError(f"❌ File does not exist: {results_dir / 'results_spacing_from_slope'}")
 
-    df = pd.read_csv(data_file)
-    df.columns = df.columns.str.strip()  # Clean headers
+    df = read_table(data_file)
 
     print("\n📊 Full DataFrame Preview (first 10 rows):")
     print(df['Fitted Slope'])
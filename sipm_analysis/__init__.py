@@ -0,0 +1,19 @@
+# Shared helpers for the SiPM analysis scripts.
+#
+# The scripts in this repo are still run one by one (see README), this package
+# holds the loaders, peak finding, slope and coincidence code they share.
+#
+# Submodules are imported on first attribute access, and pandas / scipy /
+# matplotlib only inside the functions that use them, so e.g.
+# `from sipm_analysis import loaders` stays cheap for a worker that only needs
+# the peak tables.
+
+import importlib
+
+__all__ = ['coincidence', 'loaders', 'metrics', 'peaks', 'plotting', 'slopes']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,237 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.addback import iter_pairs_within, peak_classes
+from sipm_analysis.listmode import TIMETAG_SECONDS
+from sipm_analysis.parallel_pairs import add_delta_t_parallel
+from sipm_analysis.rates import PS_PER_NS
+
+# ========================================
+# True vs accidental CH0/CH1 coincidences for a sweep of windows
+# ========================================
+# counts-versus-correlation-time-window.py shows the counts growing with the
+# correlation window, but part of that is accidental: uncorrelated CH0 and
+# CH1 events that happen to fall in the window. Those are just as likely at
+# any time offset, so counting pairs in off-time windows (same width, centred
+# at +-offset where nothing is correlated any more) measures them.
+#
+# One pass over the sorted time tags histograms the CH0 - CH1 time difference
+# of every pair within the largest offset + window, split by the Peak Number
+# of both events. Any window W is then |dt| <= W summed from that histogram
+# and each off-time window is the same sum around its offset, so a sweep of
+# windows costs one pass. Per window and peak pair:
+#
+#   true = on-time - mean(off-time),  error = sqrt(on-time + sum(off-time) / n_off^2)
+#
+# These are pairs, not events: an event with several partners within W is in
+# several pairs, so accidentals add up independently of the true pairs and
+# the subtraction is unbiased. addback.pair_events instead keeps one partner
+# per event (the closest), which is what AddBack Pairs counts for reference.
+# The two agree while W times the CH1 rate is small; for wider windows the
+# one-to-one count loses accidentals to events that already have a true
+# partner, so subtracting off-time one-to-one pairs would over-subtract.
+#
+#   python -m sipm_analysis.accidentals DAQ/run/RAW/SDataR_run.csv --window-ns 50 100 250 500 750
+
+ACCIDENTAL_COLUMNS = [
+    'Window (ns)', 'CH0 Peak', 'CH1 Peak', 'On-time Pairs', 'Accidental Pairs', 'Accidental Error',
+    'True Pairs', 'True Error', 'True Rate (Hz)', 'True Rate Error (Hz)', 'AddBack Pairs', 'Off-time Windows'
+]
+
+DEFAULT_WINDOWS_NS = (50.0, 100.0, 250.0, 500.0, 750.0)
+DEFAULT_BIN_NS = 1.0
+DEFAULT_OFF_TIME_WINDOWS = 5  # on each side
+OFF_TIME_GUARD_NS = 500.0
+MAX_PEAK = 8
+
+
+def off_time_offsets(max_window_ns, n=DEFAULT_OFF_TIME_WINDOWS, guard_ns=OFF_TIME_GUARD_NS):
+    """+-k (2 W + guard) ns, k = 1..n: off-time windows that neither overlap each other nor the on-time one."""
+    step = 2 * max_window_ns + guard_ns
+    k = np.arange(1, n + 1) * step
+    return np.r_[-k[::-1], k]
+
+
+class DeltaTHistogram:
+    """CH0 - CH1 time differences within +-max_dt_ns, per (CH0 peak class, CH1 peak class)."""
+
+    def __init__(self, max_dt_ns, bin_ns=DEFAULT_BIN_NS, n_classes=1):
+        self.max_dt_ns = max_dt_ns
+        self.bin_ns = bin_ns
+        self.half_bins = int(np.ceil(max_dt_ns / bin_ns))
+        self.n_classes = n_classes
+        n_bins = 2 * self.half_bins + 1
+        # Bin k (0 .. n_bins - 1) is centred on (k - half_bins) * bin_ns
+        self.counts = np.zeros((n_classes, n_classes, n_bins), dtype=np.int64)
+        self.first = None
+        self.last = None
+        self._cumulative = None
+
+    @property
+    def real_time(self):
+        return (self.last - self.first) * TIMETAG_SECONDS if self.first is not None else 0.0
+
+    @property
+    def centers_ns(self):
+        return (np.arange(self.counts.shape[-1]) - self.half_bins) * self.bin_ns
+
+    def add(self, t0, t1, classes0=None, classes1=None, new0=None, new1=None):
+        """Pairs of one run or block (both channels' time tags sorted, in ps).
+
+        new0 / new1 (bool per event) mark the events not seen in an earlier block: when
+        given, pairs of two old events (already counted) are skipped.
+        """
+        classes0 = np.zeros(len(t0), dtype=np.int64) if classes0 is None else classes0
+        classes1 = np.zeros(len(t1), dtype=np.int64) if classes1 is None else classes1
+        n_bins = self.counts.shape[-1]
+        bin_ps = self.bin_ns * PS_PER_NS
+        max_ps = int((self.half_bins + 0.5) * bin_ps)
+        flat = self.counts.reshape(-1)
+        for i0, i1 in iter_pairs_within(t0, t1, max_ps):
+            if new0 is not None:
+                fresh = new0[i0] | new1[i1]
+                i0, i1 = i0[fresh], i1[fresh]
+            k = np.floor((t0[i0] - t1[i1]) / bin_ps + 0.5).astype(np.int64) + self.half_bins
+            inside = (k >= 0) & (k < n_bins)
+            index = (classes0[i0[inside]] * self.n_classes + classes1[i1[inside]]) * n_bins + k[inside]
+            flat += np.bincount(index, minlength=flat.size)
+        self._cumulative = None
+        self.extend_span(t0, t1)
+        return self
+
+    def extend_span(self, t0, t1):
+        """Widen first / last (real_time) to cover both sorted time tag arrays."""
+        if len(t0) and len(t1):
+            first, last = min(t0[0], t1[0]), max(t0[-1], t1[-1])
+            self.first = first if self.first is None else min(self.first, first)
+            self.last = last if self.last is None else max(self.last, last)
+
+    def window_counts(self, window_ns, offset_ns=0.0):
+        """Pairs with |dt - offset| <= window, per class pair (n_classes x n_classes)."""
+        if self._cumulative is None:
+            # Running sum over dt: every window is a difference of two entries
+            self._cumulative = np.concatenate([np.zeros(self.counts.shape[:2] + (1,), dtype=np.int64),
+                                               np.cumsum(self.counts, axis=-1)], axis=-1)
+        cumulative = self._cumulative
+        low = int(np.floor((offset_ns - window_ns) / self.bin_ns + 0.5)) + self.half_bins
+        high = int(np.floor((offset_ns + window_ns) / self.bin_ns + 0.5)) + self.half_bins + 1
+        if low < 0 or high > self.counts.shape[-1]:
+            raise ValueError(f"window {window_ns:g} ns at offset {offset_ns:g} ns is outside the histogram")
+        return cumulative[..., high] - cumulative[..., low]
+
+
+def addback_counts(t0, t1, window_ns, classes0=None, classes1=None, n_classes=1, workers=1):
+    """One-to-one pairs (as addback.pair_events) within window_ns, per class pair (n_classes x n_classes)."""
+    from sipm_analysis.parallel_pairs import pair_events_parallel
+
+    i0, i1 = pair_events_parallel(t0, t1, int(round(window_ns * PS_PER_NS)), workers)
+    classes0 = np.zeros(len(t0), dtype=np.int64) if classes0 is None else classes0
+    classes1 = np.zeros(len(t1), dtype=np.int64) if classes1 is None else classes1
+    index = classes0[i0] * n_classes + classes1[i1]
+    return np.bincount(index, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+
+def accidental_table(histogram, windows_ns, offsets_ns, peak_labels=None, addback=None):
+    """ACCIDENTAL_COLUMNS, one row per window and class pair (class 0 = 'all' when peak_labels is None).
+
+    addback: per window, the addback_counts for the AddBack Pairs column (None = left empty).
+    """
+    import pandas as pd
+
+    rows = []
+    n_off = len(offsets_ns)
+    addback = [None] * len(windows_ns) if addback is None else addback
+    for window, one_to_one in zip(windows_ns, addback):
+        on = histogram.window_counts(window)
+        off = sum(histogram.window_counts(window, offset) for offset in offsets_ns)
+        if one_to_one is None:
+            one_to_one = np.full(on.shape, np.nan)
+        # 'all' over every class, then the peak pairs
+        pairs = [('all', 'all', on.sum(), off.sum(), one_to_one.sum())]
+        if peak_labels is not None:
+            pairs += [(peak_labels[a], peak_labels[b], on[a, b], off[a, b], one_to_one[a, b])
+                      for a in range(1, histogram.n_classes) for b in range(1, histogram.n_classes)]
+        for peak0, peak1, n_on, n_off_total, n_addback in pairs:
+            accidental = n_off_total / n_off
+            accidental_error = np.sqrt(n_off_total) / n_off
+            true_error = np.sqrt(n_on + accidental_error ** 2)
+            rows.append({
+                'Window (ns)': window, 'CH0 Peak': peak0, 'CH1 Peak': peak1,
+                'On-time Pairs': int(n_on), 'Accidental Pairs': accidental, 'Accidental Error': accidental_error,
+                'True Pairs': n_on - accidental, 'True Error': true_error,
+                'True Rate (Hz)': (n_on - accidental) / histogram.real_time,
+                'True Rate Error (Hz)': true_error / histogram.real_time,
+                'AddBack Pairs': n_addback,
+                'Off-time Windows': n_off,
+            })
+    return pd.DataFrame(rows, columns=ACCIDENTAL_COLUMNS)
+
+
+def channel_times(events, ch):
+    """Sorted time tags (ps) and energies of one channel."""
+    mask = events.channel == ch
+    order = np.argsort(events.timetag[mask], kind='stable')
+    return events.timetag[mask][order], events.energy[mask][order]
+
+
+def accidental_sweep(events, windows_ns=DEFAULT_WINDOWS_NS, offsets_ns=None, max_peak=MAX_PEAK,
+                     calibrations=None, bin_ns=DEFAULT_BIN_NS, channels=(0, 1), workers=1):
+    """Accidental-subtracted coincidences of one list-mode run, all windows from one delta-t pass.
+
+    calibrations: {channel: (pedestal, spacing)} for the per peak pair rows (None = only 'all').
+    workers: processes for the delta-t pass and the AddBack pairing (None = number of CPUs), same counts as 1.
+    Returns (accidental_df, DeltaTHistogram).
+    """
+    offsets_ns = off_time_offsets(max(windows_ns)) if offsets_ns is None else np.asarray(offsets_ns)
+    (t0, e0), (t1, e1) = (channel_times(events, ch) for ch in channels)
+
+    n_classes, classes0, classes1, labels = 1, None, None, None
+    if calibrations:
+        n_classes = max_peak + 1
+        classes0 = peak_classes(e0, calibrations[channels[0]], max_peak)
+        classes1 = peak_classes(e1, calibrations[channels[1]], max_peak)
+        labels = [None] + [str(n) for n in range(1, max_peak + 1)]
+
+    histogram = DeltaTHistogram(np.max(np.abs(offsets_ns)) + max(windows_ns), bin_ns, n_classes)
+    add_delta_t_parallel(histogram, t0, t1, classes0, classes1, workers)
+    addback = [addback_counts(t0, t1, window, classes0, classes1, n_classes, workers) for window in windows_ns]
+    return accidental_table(histogram, windows_ns, offsets_ns, labels, addback), histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description="True / accidental CH0-CH1 coincidences for a sweep of windows.")
+    parser.add_argument('path', help="list-mode .csv with both channels")
+    parser.add_argument('--window-ns', type=float, nargs='+', default=list(DEFAULT_WINDOWS_NS))
+    parser.add_argument('--off-time-windows', type=int, default=DEFAULT_OFF_TIME_WINDOWS, help="on each side")
+    parser.add_argument('--bin-ns', type=float, default=DEFAULT_BIN_NS, help="windows are rounded to this")
+    parser.add_argument('--max-peak', type=int, default=MAX_PEAK, help="peak pairs up to this Peak Number")
+    parser.add_argument('--no-peaks', action='store_true', help="only all events, no calibration")
+    parser.add_argument('--workers', type=int, help="processes for the delta-t pass (default: number of CPUs)")
+    parser.add_argument('--output-dir', help="write accidental_coincidences here")
+    args = parser.parse_args()
+
+    from sipm_analysis.addback import channel_calibration
+    from sipm_analysis.listmode import energy_histogram, read_list_mode
+
+    events = read_list_mode(args.path)
+    calibrations = None
+    if not args.no_peaks:
+        calibrations = {ch: channel_calibration(energy_histogram(events.energy[events.channel == ch]))
+                        for ch in (0, 1)}
+    offsets = off_time_offsets(max(args.window_ns), args.off_time_windows)
+    table, _ = accidental_sweep(events, args.window_ns, offsets, args.max_peak, calibrations, args.bin_ns,
+                                workers=args.workers)
+
+    overall = table[table['CH0 Peak'] == 'all'].drop(columns=['CH0 Peak', 'CH1 Peak'])
+    print(overall.to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+    if args.output_dir:
+        from sipm_analysis.tables import write_table
+
+        write_table(table, Path(args.output_dir) / 'accidental_coincidences')
+        print(f"✅ Accidental-corrected coincidences written to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
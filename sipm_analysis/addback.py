@@ -0,0 +1,223 @@
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.listmode import DEFAULT_N_BINS
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS
+from sipm_analysis.rates import PS_PER_NS
+
+# ========================================
+# AddBack spectra built from list-mode events
+# ========================================
+# The digitizer's 0@AddBack_Espectrum*.txt is the spectrum of E(CH0) + E(CH1)
+# for events of both channels inside the correlation window. With the
+# list-mode events of a run the same spectrum can be rebuilt for any window,
+# energy cut and gain matching, without a new acquisition:
+#
+#   python -m sipm_analysis.addback DAQ/run/RAW/SDataR_run.csv --window-ns 50 250 750 --peaks 4 8
+#
+# Pairing: each CH0 event takes the nearest CH1 event in time, each CH1
+# event keeps only its nearest CH0 partner (one-to-one), and pairs further
+# apart than the window are dropped, all with searchsorted on the sorted time
+# tags. Gain matching puts CH1 on the CH0 scale before summing:
+#
+#   E_addback = (E0 - offset0) + (E1 - offset1) * spacing0 / spacing1
+#
+# (offsets 0 = what the digitizer sums). The output folders are named like the
+# acquisition ones (peak4_and8_750ns_correlation_window_..._filtered), so
+# plot_coic_addback_with_weighted_means.py and peak-cut-selector.py read them
+# unchanged.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_output_dir = repo_root / 'generated_addback'
+CUT_HALF_WIDTH = 0.5  # +- this many finger spacings around a peak for --peaks
+MAX_CHUNK_EVENTS = 200_000  # CH0 events per all-pairs chunk
+
+
+def channel_calibration(spectrum, peak_params=None):
+    """(pedestal, spacing) of one ENERGY histogram: Peak Number n sits at pedestal + n * spacing."""
+    from sipm_analysis.peaks import analyze_spectrum
+    from sipm_analysis.roi import resolve_crop
+    from sipm_analysis.slopes import fit_spacing
+
+    params = {**{k: DEFAULT_PEAK_PARAMS[k] for k in ('crop_off_start', 'crop_off_end', 'sigma',
+                                                      'counts_threshold', 'peak_spacing_threshold')},
+              'method': DEFAULT_PEAK_PARAMS['peak_method'], **(peak_params or {})}
+    # The peaks are shifted back by the crop, so an "auto" one has to be known here
+    params['crop_off_start'], params['crop_off_end'] = resolve_crop([spectrum], params['crop_off_start'],
+                                                                    params['crop_off_end'])
+    _, peaks = analyze_spectrum(np.asarray(spectrum, dtype=float), **params)
+    if len(peaks) < 2:
+        raise ValueError(f"only {len(peaks)} peaks found in the ENERGY spectrum, can't calibrate")
+    _, spacing, intercept = fit_spacing(np.arange(1, len(peaks) + 1), np.asarray(peaks) + params['crop_off_start'])
+    return float(intercept), float(spacing)
+
+
+def peak_cut(calibration, peak_number, half_width=CUT_HALF_WIDTH):
+    """ENERGY range (low, high) of one Peak Number of a (pedestal, spacing) calibration."""
+    pedestal, spacing = calibration
+    center = pedestal + peak_number * spacing
+    return center - half_width * spacing, center + half_width * spacing
+
+
+def pair_events(t0, t1, window_ps):
+    """Index pairs (i0, i1) of one-to-one nearest CH0/CH1 events at most window_ps apart (both sorted)."""
+    t0, t1 = np.asarray(t0, dtype=np.int64), np.asarray(t1, dtype=np.int64)
+    if len(t0) == 0 or len(t1) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    right = np.clip(np.searchsorted(t1, t0), 0, len(t1) - 1)
+    left = np.clip(right - 1, 0, len(t1) - 1)
+    take_left = np.abs(t0 - t1[left]) < np.abs(t0 - t1[right])
+    i1 = np.where(take_left, left, right)
+    dt = np.abs(t0 - t1[i1])
+    i0 = np.flatnonzero(dt <= window_ps)
+    i1, dt = i1[i0], dt[i0]
+
+    # A CH1 event picked by several CH0 events keeps the closest one (first in time on a tie)
+    order = np.lexsort((i0, dt, i1))
+    first = np.r_[True, i1[order][1:] != i1[order][:-1]]
+    keep = np.sort(order[first])
+    return i0[keep], i1[keep]
+
+
+def iter_pairs_within(t0, t1, max_dt_ps, chunk_events=MAX_CHUNK_EVENTS):
+    """Yield (i0, i1) index arrays of every CH0/CH1 pair with |t1 - t0| <= max_dt_ps (both sorted).
+
+    Unlike pair_events every pair counts (an event can be in several), as needed for
+    delta-t histograms and accidentals. CH0 is taken chunk_events at a time to bound memory.
+    """
+    t0, t1 = np.asarray(t0, dtype=np.int64), np.asarray(t1, dtype=np.int64)
+    for start in range(0, len(t0), chunk_events):
+        t = t0[start:start + chunk_events]
+        low = np.searchsorted(t1, t - max_dt_ps, side='left')
+        high = np.searchsorted(t1, t + max_dt_ps, side='right')
+        n = high - low
+        total = int(n.sum())
+        if total == 0:
+            continue
+        i0 = np.repeat(np.arange(start, start + len(t)), n)
+        # i1 runs from low to high - 1 for each CH0 event
+        first = np.repeat(np.cumsum(n) - n, n)
+        i1 = np.repeat(low, n) + np.arange(total) - first
+        yield i0, i1
+
+
+def peak_classes(energy, calibration, max_peak, half_width=CUT_HALF_WIDTH):
+    """Peak Number (1..max_peak) of each event, 0 when it is not within half_width spacings of one."""
+    pedestal, spacing = calibration
+    position = (np.asarray(energy, dtype=float) - pedestal) / spacing
+    number = np.rint(position)
+    inside = (np.abs(position - number) <= half_width) & (number >= 1) & (number <= max_peak)
+    return np.where(inside, number, 0).astype(np.int64)
+
+
+def build_addback(events, window_ns, calibrations=None, cuts=None, n_bins=DEFAULT_N_BINS, channels=(0, 1),
+                  offsets=None, workers=1):
+    """AddBack and per-channel spectra of the coincident CH0/CH1 events.
+
+    calibrations: {channel: (pedestal, spacing)} for the gain matching (None = plain sum)
+    cuts: {channel: (low, high)} ENERGY range an event must be in to be paired
+    workers: processes for the pairing (None = number of CPUs), same result as 1
+    Returns {'AddBack': spectrum, 'CH0': spectrum, 'CH1': spectrum, 'pairs': n, 'singles': {ch: n}}.
+    """
+    offsets = offsets or {}
+    per_channel = []
+    for ch in channels:
+        mask = events.channel == ch
+        t, energy = events.timetag[mask], events.energy[mask]
+        if cuts and ch in cuts:
+            low, high = cuts[ch]
+            keep = (energy >= low) & (energy < high)
+            t, energy = t[keep], energy[keep]
+        order = np.argsort(t, kind='stable')
+        per_channel.append((t[order], energy[order]))
+
+    from sipm_analysis.parallel_pairs import pair_events_parallel
+
+    (t0, e0), (t1, e1) = per_channel
+    i0, i1 = pair_events_parallel(t0, t1, int(round(window_ns * PS_PER_NS)), workers)
+
+    ch0, ch1 = channels
+    scale = 1.0
+    if calibrations:
+        scale = calibrations[ch0][1] / calibrations[ch1][1]
+    energy = (e0[i0] - offsets.get(ch0, 0.0)) + (e1[i1] - offsets.get(ch1, 0.0)) * scale
+    energy = np.rint(energy).astype(np.int64)
+
+    def histogram(values):
+        values = values[(values >= 0) & (values < n_bins)]
+        return np.bincount(values, minlength=n_bins)
+
+    return {
+        'AddBack': histogram(energy),
+        f'CH{ch0}': histogram(e0[i0]),
+        f'CH{ch1}': histogram(e1[i1]),
+        'pairs': len(i0),
+        'singles': {ch0: len(t0) - len(i0), ch1: len(t1) - len(i1)},
+    }
+
+
+def addback_folder_name(first_peak, second_peak, window_ns, gain=None, pulse=None, state='filtered'):
+    """peak4_and8_750ns_correlation_window_65_7_gain_1_6_pulse_filtered, as parse_coincidence_folder expects."""
+    name = f"peak{first_peak}_and{second_peak}_{window_ns:g}ns_correlation_window"
+    if gain is not None and pulse is not None:
+        name += f"_{str(gain).replace('.', '_')}_gain_{str(pulse).replace('.', '_')}_pulse"
+    return f"{name}_{state}"
+
+
+def write_addback(result, output_dir, first_peak, second_peak, window_ns, gain=None, pulse=None):
+    """Write the spectra like the digitizer does (one count per line). Returns the folder."""
+    state = 'filtered' if first_peak is not None else 'unfiltered'
+    folder = Path(output_dir) / addback_folder_name(first_peak or 0, second_peak or 0, window_ns, gain, pulse, state)
+    folder.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    tag = f"peak_{first_peak or 0}_and{second_peak or 0}_{window_ns:g}_ns_{stamp}"
+    np.savetxt(folder / f"0@AddBack_EspectrumF_{tag}.txt", result['AddBack'], fmt='%d')
+    for ch in ('CH0', 'CH1'):
+        np.savetxt(folder / f"{ch}@built_EspectrumF_{tag}.txt", result[ch], fmt='%d')
+    return folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AddBack spectra from list-mode CH0/CH1 events.")
+    parser.add_argument('path', help="list-mode .csv with both channels")
+    parser.add_argument('--window-ns', type=float, nargs='+', default=[750.0], help="correlation windows")
+    parser.add_argument('--peaks', type=int, nargs=2, metavar=('CH0_PEAK', 'CH1_PEAK'),
+                        help="only pair events in these Peak Numbers (like the peakA_andB folders)")
+    parser.add_argument('--cut-half-width', type=float, default=CUT_HALF_WIDTH, help="in finger spacings")
+    parser.add_argument('--no-gain-matching', action='store_true', help="plain E0 + E1 like the digitizer")
+    parser.add_argument('--bins', type=int, default=DEFAULT_N_BINS)
+    parser.add_argument('--workers', type=int, help="processes for the pairing (default: number of CPUs)")
+    parser.add_argument('--output-dir', default=str(default_output_dir))
+    args = parser.parse_args()
+
+    from sipm_analysis.listmode import energy_histogram, read_list_mode
+    from sipm_analysis.loaders import extract_gain_and_pulse_voltages
+
+    events = read_list_mode(args.path)
+    gain, pulse = extract_gain_and_pulse_voltages(str(args.path))
+
+    calibrations = None
+    if args.peaks or not args.no_gain_matching:
+        calibrations = {}
+        for ch in (0, 1):
+            calibrations[ch] = channel_calibration(energy_histogram(events.energy[events.channel == ch], args.bins))
+            print(f"[CALIBRATION] CH{ch} | pedestal {calibrations[ch][0]:.1f}, spacing {calibrations[ch][1]:.2f} bins")
+    cuts = None
+    if args.peaks:
+        cuts = {ch: peak_cut(calibrations[ch], peak, args.cut_half_width) for ch, peak in zip((0, 1), args.peaks)}
+
+    first_peak, second_peak = args.peaks or (None, None)
+    for window_ns in args.window_ns:
+        result = build_addback(events, window_ns, None if args.no_gain_matching else calibrations, cuts, args.bins,
+                               workers=args.workers)
+        folder = write_addback(result, args.output_dir, first_peak, second_peak, window_ns, gain, pulse)
+        print(f"✅ {window_ns:g} ns: {result['pairs']} pairs, singles CH0 {result['singles'][0]} / "
+              f"CH1 {result['singles'][1]} -> {folder}")
+
+
+if __name__ == '__main__':
+    main()
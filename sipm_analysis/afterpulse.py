@@ -0,0 +1,274 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.listmode import DEFAULT_BLOCK_EVENTS, DEFAULT_N_BINS
+from sipm_analysis.rates import INTERVAL_EDGES_NS, PS_PER_NS
+
+# ========================================
+# Afterpulsing and delayed crosstalk from the time between dark events
+# ========================================
+# In a dark list-mode run an event is followed by
+#   - the next uncorrelated dark count (exponential with the dark count rate)
+#   - with probability P_ap an afterpulse, ~tau_ap after it
+#   - with probability P_dict a delayed crosstalk pulse, ~tau_dict after it
+# (whatever comes first). The probability of no event for a time t after an
+# event is then
+#
+#   S(t) = exp(-DCR t) (1 - P_ap (1 - exp(-t / tau_ap))) (1 - P_dict (1 - exp(-t / tau_dict)))
+#
+# and a bin [a, b) of the time-to-next-event histogram holds N (S(a) - S(b)).
+# Afterpulsing grows with the charge of the pulse, so the histogram is kept
+# separately for the photoelectron count of the earlier event (1, 2, ...,
+# MAX_PE and above) and fitted per p.e. class.
+#
+# Events are read in blocks twice: first the ENERGY histogram (p.e.
+# calibration: 1 p.e. peak and finger spacing), then the interval histograms.
+# Both are small fixed-size arrays, so 1e8+ events need one block of memory.
+#
+#   python -m sipm_analysis.afterpulse DAQ/run/RAW/SDataR_65_7_gain_..._dark.csv
+#
+# Results go next to the dark-count analysis in
+# single-channel-analysis/dark/generated_afterpulse_data/.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_output_dir = repo_root / 'single-channel-analysis' / 'dark' / 'generated_afterpulse_data'
+
+AFTERPULSE_COLUMNS = [
+    'Channel', 'Voltage Gain (V)', 'Previous p.e.', 'Events', 'Dark Count Rate (Hz)',
+    'Afterpulse Probability', 'Afterpulse Tau (ns)', 'Delayed Crosstalk Probability',
+    'Delayed Crosstalk Tau (ns)', 'Correlated Fraction', 'Fit Start (ns)', 'Fit Converged', 'Source File'
+]
+INTERVAL_PE_COLUMNS = ['Channel', 'Voltage Gain (V)', 'Previous p.e.', 'Interval Low (ns)', 'Interval High (ns)', 'Count']
+
+MAX_PE = 4  # the last class is "MAX_PE or more"
+CORRELATED_WINDOW_NS = 5000.0
+MIN_FIT_EVENTS = 200
+# Starting values: afterpulses ~100s of ns, delayed crosstalk ~10s of ns
+INITIAL_TAUS_NS = {'afterpulse': 200.0, 'delayed_crosstalk': 20.0}
+
+
+def energy_spectrum(blocks, n_bins=DEFAULT_N_BINS):
+    """{channel: ENERGY histogram} of a stream of Events blocks."""
+    spectra = {}
+    for events in blocks:
+        for ch in np.unique(events.channel):
+            energy = events.energy[events.channel == ch]
+            energy = energy[(energy >= 0) & (energy < n_bins)]
+            spectra.setdefault(int(ch), np.zeros(n_bins, dtype=np.int64))
+            spectra[int(ch)] += np.bincount(energy, minlength=n_bins)
+    return spectra
+
+
+def pe_calibration(spectrum, spacing=None):
+    """(position of the 1 p.e. peak, finger spacing) in ENERGY bins of a dark spectrum."""
+    from scipy.ndimage import gaussian_filter1d
+    from sipm_analysis.autotune import estimate_peak_spacing
+
+    if spacing is None:
+        spacing = estimate_peak_spacing(spectrum)
+    if not np.isfinite(spacing):
+        raise ValueError("No finger spacing found in the ENERGY spectrum, give it with spacing=")
+    # Dark counts are mostly single photoelectrons: the highest finger is 1 p.e.
+    one_pe = int(np.argmax(gaussian_filter1d(np.asarray(spectrum, dtype=float), max(1.0, spacing / 10))))
+    return float(one_pe), float(spacing)
+
+
+def pe_class(energy, one_pe, spacing, max_pe=MAX_PE):
+    """Photoelectron count 1..max_pe (max_pe = that many or more) of each event."""
+    pe = 1 + np.rint((np.asarray(energy, dtype=float) - one_pe) / spacing)
+    return np.clip(pe, 1, max_pe).astype(np.int64)
+
+
+class IntervalHistograms:
+    """Time to the next event, histogrammed per channel and p.e. class of the earlier event, block by block."""
+
+    def __init__(self, calibrations, max_pe=MAX_PE, edges_ns=INTERVAL_EDGES_NS):
+        self.calibrations = calibrations  # {channel: (one_pe, spacing)}
+        self.max_pe = max_pe
+        self.edges_ns = edges_ns
+        n = len(edges_ns) - 1
+        self.counts = {ch: np.zeros((max_pe, n), dtype=np.int64) for ch in calibrations}
+        self._last = {}  # channel -> (timetag, p.e.) of the last event of the previous block
+
+    def add(self, channel, timetag, energy):
+        for ch in np.unique(channel):
+            ch = int(ch)
+            if ch not in self.calibrations:
+                continue
+            mask = channel == ch
+            t = np.asarray(timetag[mask], dtype=np.int64)
+            pe = pe_class(energy[mask], *self.calibrations[ch], self.max_pe)
+            if ch in self._last:
+                t = np.r_[self._last[ch][0], t]
+                pe = np.r_[self._last[ch][1], pe]
+            if len(t):
+                self._last[ch] = (t[-1], pe[-1])
+
+            dt_ns = np.diff(t) / PS_PER_NS
+            previous = pe[:-1] - 1
+            n_bins = len(self.edges_ns) - 1
+            k = np.searchsorted(self.edges_ns, dt_ns, side='right') - 1
+            inside = (k >= 0) & (k < n_bins)
+            self.counts[ch] += np.bincount(previous[inside] * n_bins + k[inside],
+                                           minlength=self.max_pe * n_bins).reshape(self.max_pe, n_bins)
+
+    def add_blocks(self, blocks):
+        for events in blocks:
+            self.add(events.channel, events.timetag, events.energy)
+        return self
+
+
+def survival(t_ns, rate, p_ap, tau_ap, p_dict, tau_dict):
+    """S(t): probability of no event within t ns after an event."""
+    t_ns = np.asarray(t_ns, dtype=float)
+    return (np.exp(-rate * t_ns) * (1 - p_ap * (1 - np.exp(-t_ns / tau_ap)))
+            * (1 - p_dict * (1 - np.exp(-t_ns / tau_dict))))
+
+
+def _unpack(x):
+    # rate (1/ns) and the time constants in log, probabilities through a logistic, tau_dict < tau_ap
+    rate = np.exp(x[0])
+    p_ap, p_dict = 1 / (1 + np.exp(-x[1])), 1 / (1 + np.exp(-x[3]))
+    tau_dict = np.exp(x[4])
+    tau_ap = tau_dict + np.exp(x[2])
+    return rate, p_ap, tau_ap, p_dict, tau_dict
+
+
+def fit_intervals(counts, edges_ns=INTERVAL_EDGES_NS, min_events=MIN_FIT_EVENTS):
+    """Binned Poisson likelihood fit of S(t) to one time-to-next-event histogram.
+
+    Returns a dict with rate (Hz), the probabilities / time constants and the fit start (ns);
+    the bins before the first filled one + 1 (dead time) are left out.
+    """
+    from scipy.optimize import minimize
+    from sipm_analysis.rates import interval_slope
+
+    counts = np.asarray(counts, dtype=float)
+    filled = np.flatnonzero(counts)
+    result = {'events': int(counts.sum()), 'converged': False}
+    if counts.sum() < min_events or len(filled) < 5:
+        return result
+    first, last = filled[0] + 1, filled[-1] + 1
+    a, b, n = edges_ns[first:last], edges_ns[first + 1:last + 1], counts[first:last]
+    total = n.sum()
+
+    def nll(x):
+        params = _unpack(x)
+        s0 = survival(edges_ns[first], *params)
+        expected = total * (survival(a, *params) - survival(b, *params)) / max(s0 - survival(b[-1], *params), 1e-300)
+        expected = np.maximum(expected, 1e-300)
+        return float(np.sum(expected - n * np.log(expected)))
+
+    rate0 = interval_slope(counts.astype(np.int64), edges_ns) / 1e9
+    if not np.isfinite(rate0) or rate0 <= 0:
+        rate0 = 1 / max(np.average(np.sqrt(a * b), weights=n), 1.0)
+    x0 = np.array([np.log(rate0), np.log(0.05 / 0.95), np.log(INITIAL_TAUS_NS['afterpulse'] - INITIAL_TAUS_NS['delayed_crosstalk']),
+                   np.log(0.02 / 0.98), np.log(INITIAL_TAUS_NS['delayed_crosstalk'])])
+    fit = minimize(nll, x0, method='Nelder-Mead', options={'maxiter': 4000, 'xatol': 1e-4, 'fatol': 1e-4})
+    rate, p_ap, tau_ap, p_dict, tau_dict = _unpack(fit.x)
+
+    # Model-free check: events in the correlated window above what the dark counts alone give
+    window = edges_ns[1:] <= CORRELATED_WINDOW_NS
+    observed = counts[window].sum() / counts.sum()
+    correlated = observed - (1 - np.exp(-rate * edges_ns[1:][window][-1])) if window.any() else np.nan
+    result.update({
+        'rate': rate * 1e9, 'p_ap': p_ap, 'tau_ap': tau_ap, 'p_dict': p_dict, 'tau_dict': tau_dict,
+        'correlated': correlated, 'fit_start': float(edges_ns[first]), 'converged': bool(fit.success),
+    })
+    return result
+
+
+def afterpulse_table(histograms, gain=None, source=''):
+    """One row per channel and previous-p.e. class (plus 'all'), AFTERPULSE_COLUMNS."""
+    import pandas as pd
+
+    rows = []
+    for ch, counts in sorted(histograms.counts.items()):
+        classes = [(str(pe + 1) + ('+' if pe + 1 == histograms.max_pe else ''), counts[pe])
+                   for pe in range(histograms.max_pe)]
+        for label, hist in [('all', counts.sum(axis=0))] + classes:
+            fit = fit_intervals(hist, histograms.edges_ns)
+            rows.append({
+                'Channel': f'CH{ch}', 'Voltage Gain (V)': gain, 'Previous p.e.': label, 'Events': fit['events'],
+                'Dark Count Rate (Hz)': fit.get('rate', np.nan),
+                'Afterpulse Probability': fit.get('p_ap', np.nan), 'Afterpulse Tau (ns)': fit.get('tau_ap', np.nan),
+                'Delayed Crosstalk Probability': fit.get('p_dict', np.nan),
+                'Delayed Crosstalk Tau (ns)': fit.get('tau_dict', np.nan),
+                'Correlated Fraction': fit.get('correlated', np.nan), 'Fit Start (ns)': fit.get('fit_start', np.nan),
+                'Fit Converged': fit['converged'], 'Source File': source,
+            })
+    return pd.DataFrame(rows, columns=AFTERPULSE_COLUMNS)
+
+
+def interval_table(histograms, gain=None):
+    import pandas as pd
+
+    frames = []
+    edges = histograms.edges_ns
+    for ch, counts in sorted(histograms.counts.items()):
+        for pe in range(histograms.max_pe):
+            frames.append(pd.DataFrame({
+                'Channel': f'CH{ch}', 'Voltage Gain (V)': gain, 'Previous p.e.': pe + 1,
+                'Interval Low (ns)': edges[:-1], 'Interval High (ns)': edges[1:], 'Count': counts[pe],
+            }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=INTERVAL_PE_COLUMNS)
+
+
+def analyze_afterpulsing(path, gain=None, channels=None, spacing=None, max_pe=MAX_PE,
+                         block_events=DEFAULT_BLOCK_EVENTS, n_bins=DEFAULT_N_BINS):
+    """Two streaming passes over a dark list-mode file. Returns (afterpulse_df, interval_df)."""
+    from sipm_analysis.listmode import iter_list_mode_blocks
+    from sipm_analysis.loaders import extract_gain_and_pulse_voltages
+
+    path = Path(path)
+    if gain is None:
+        gain, _ = extract_gain_and_pulse_voltages(str(path))
+
+    calibrations = {}
+    for ch, spectrum in energy_spectrum(iter_list_mode_blocks(path, block_events, channels), n_bins).items():
+        try:
+            calibrations[ch] = pe_calibration(spectrum, spacing)
+        except ValueError as e:
+            print(f"[WARNING] CH{ch} of {path.name} skipped: {e}")
+            continue
+        one_pe, ch_spacing = calibrations[ch]
+        print(f"[CALIBRATION] CH{ch} | Gain = {gain} V | 1 p.e. at {one_pe:.0f}, spacing {ch_spacing:.2f} bins")
+
+    histograms = IntervalHistograms(calibrations, max_pe)
+    histograms.add_blocks(iter_list_mode_blocks(path, block_events, channels))
+    return afterpulse_table(histograms, gain, path.name), interval_table(histograms, gain)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Afterpulse / delayed crosstalk probabilities from dark list-mode runs.")
+    parser.add_argument('paths', nargs='+', help="dark list-mode .csv files, one per gain voltage")
+    parser.add_argument('--channels', type=int, nargs='*', help="CHANNEL numbers (default: all)")
+    parser.add_argument('--gain', type=float, help="gain voltage if it is not in the file name")
+    parser.add_argument('--spacing', type=float, help="finger spacing in ENERGY bins (default: estimated)")
+    parser.add_argument('--max-pe', type=int, default=MAX_PE)
+    parser.add_argument('--block-events', type=int, default=DEFAULT_BLOCK_EVENTS)
+    parser.add_argument('--output-dir', default=str(default_output_dir))
+    args = parser.parse_args()
+
+    import pandas as pd
+    from sipm_analysis.tables import write_table
+
+    results, intervals = [], []
+    for path in args.paths:
+        afterpulse_df, interval_df = analyze_afterpulsing(path, args.gain, args.channels, args.spacing,
+                                                          args.max_pe, args.block_events)
+        results.append(afterpulse_df)
+        intervals.append(interval_df)
+    results = pd.concat(results, ignore_index=True)
+    print(results.drop(columns=['Source File']).to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+
+    output_dir = Path(args.output_dir)
+    write_table(results, output_dir / 'afterpulse_results')
+    write_table(pd.concat(intervals, ignore_index=True), output_dir / 'interval_histograms_by_pe')
+    print(f"✅ Afterpulse tables written to {output_dir}")
+
+
+if __name__ == '__main__':
+    main()
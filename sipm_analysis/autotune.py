@@ -0,0 +1,105 @@
+import numpy as np
+
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS, crop, find_spectrum_peaks, smooth_data
+
+# ========================================
+# Automatic peak-finding parameters
+# ========================================
+# sigma, counts_threshold and peak_spacing_threshold are all fractions of the
+# finger spacing, so estimate the spacing first (autocorrelation of the
+# spectrum's slope, one FFT for a whole stack of spectra) and derive the rest
+# from it and from the Poisson noise of the spectrum:
+#
+#   sigma                  ~ spacing / 10   (3.6 for the usual ~38 bin spacing)
+#   peak_spacing_threshold ~ spacing / 2
+#   prominence             ~ 5 x Poisson noise left after smoothing, per bin
+#   counts_threshold       ~ quiet part of the spectrum + 5 x its noise
+
+SIGMA_PER_SPACING = 0.1
+DISTANCE_PER_SPACING = 0.5
+NOISE_FACTOR = 5.0
+
+
+def estimate_peak_spacing(spectra, min_spacing=4, max_spacing=None):
+    """Finger spacing in bins from the autocorrelation of the spectrum slope.
+
+    spectra is one spectrum or a 2D stack (one spectrum per row), the result is
+    a float or an array with one spacing per row (NaN where no period is found).
+    """
+    from scipy.ndimage import gaussian_filter1d
+
+    y = np.atleast_2d(np.asarray(spectra, dtype=float))
+    # The slope removes the broad envelope the fingers sit on
+    slope = np.diff(gaussian_filter1d(y, 1.5, axis=-1), axis=-1)
+    slope -= slope.mean(axis=-1, keepdims=True)
+    n = slope.shape[-1]
+
+    power = np.abs(np.fft.rfft(slope, n=2 * n, axis=-1)) ** 2
+    acf = np.fft.irfft(power, axis=-1)[:, :n]
+    acf /= np.where(acf[:, :1] > 0, acf[:, :1], 1.0)
+
+    max_spacing = min(max_spacing or n // 3, n - 2)
+    lags = acf[:, :max_spacing + 1]
+    # Skip the central lobe: only look after the first time the ACF goes negative
+    negative = lags < 0
+    first_negative = np.where(negative.any(axis=-1), negative.argmax(axis=-1), lags.shape[-1])
+    lag = np.arange(lags.shape[-1])
+    candidates = np.where((lag >= np.maximum(first_negative[:, None], min_spacing)) & (lag < max_spacing),
+                          lags, -np.inf)
+    k = candidates.argmax(axis=-1)
+    found = np.isfinite(candidates[np.arange(len(k)), k]) & (k > 0)
+
+    # Parabola through the three ACF points around the maximum -> sub-bin spacing
+    rows = np.arange(len(k))
+    k_safe = np.clip(k, 1, n - 2)
+    y0, y1, y2 = acf[rows, k_safe - 1], acf[rows, k_safe], acf[rows, k_safe + 1]
+    denominator = y0 - 2 * y1 + y2
+    offset = np.where(denominator != 0, 0.5 * (y0 - y2) / np.where(denominator != 0, denominator, 1), 0.0)
+    spacing = np.where(found, k_safe + np.clip(offset, -0.5, 0.5), np.nan)
+    return spacing if np.ndim(spectra) > 1 else float(spacing[0])
+
+
+def estimate_spacings(spectra, **kwargs):
+    """estimate_peak_spacing for a list of spectra of any lengths (one FFT per length)."""
+    spacings = np.full(len(spectra), np.nan)
+    by_length = {}
+    for i, data in enumerate(spectra):
+        by_length.setdefault(len(data), []).append(i)
+    for indices in by_length.values():
+        spacings[indices] = estimate_peak_spacing(np.stack([spectra[i] for i in indices]), **kwargs)
+    return spacings
+
+
+def auto_peak_params(data_cropped, spacing=None):
+    """sigma / counts_threshold / peak_spacing_threshold / prominence for one cropped spectrum."""
+    if spacing is None:
+        spacing = estimate_peak_spacing(data_cropped)
+    if not np.isfinite(spacing):
+        print("[WARNING] No finger spacing found, using the default peak parameters")
+        return {key: DEFAULT_PEAK_PARAMS[key] for key in ('sigma', 'counts_threshold', 'peak_spacing_threshold')}
+
+    sigma = max(1.0, SIGMA_PER_SPACING * spacing)
+    smoothed = smooth_data(data_cropped, sigma=sigma)
+    # Poisson noise of each bin, reduced by averaging over ~2*sqrt(pi)*sigma bins
+    smoothed_noise = np.sqrt(np.maximum(smoothed, 1.0) / (2 * np.sqrt(np.pi) * sigma))
+    quiet_level = np.percentile(smoothed, 10)
+
+    return {
+        'spacing': float(spacing),
+        'sigma': float(sigma),
+        'counts_threshold': float(quiet_level + NOISE_FACTOR * np.sqrt(max(quiet_level, 1.0))),
+        'peak_spacing_threshold': max(1, int(round(DISTANCE_PER_SPACING * spacing))),
+        'prominence': NOISE_FACTOR * smoothed_noise,
+    }
+
+
+def analyze_spectrum_auto(data, crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                          crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+                          manual_peaks=None, spacing=None):
+    """analyze_spectrum without hand-tuned parameters. Returns (smoothed_data, peaks, params)."""
+    data_cropped = crop(data, crop_off_start, crop_off_end)
+    params = auto_peak_params(data_cropped, spacing)
+    smoothed_data = smooth_data(data_cropped, sigma=params['sigma'])
+    peaks = find_spectrum_peaks(smoothed_data, params['counts_threshold'], params['peak_spacing_threshold'],
+                                manual_peaks, prominence=params.get('prominence'))
+    return smoothed_data, peaks, params
@@ -0,0 +1,96 @@
+import numpy as np
+
+# ========================================
+# Finger detection on top of the smooth envelope
+# ========================================
+# With an absolute counts_threshold the small fingers on the rising and
+# falling edge of the spectrum are either below the threshold or are only a
+# shoulder, not a local maximum, which is why manual_peak_indices exists.
+#
+# Here the baseline under the fingers is estimated first: a grey opening
+# (running minimum then running maximum over ~1.5 finger spacings) follows the
+# valleys between the fingers, and is smoothed to get rid of its corners.
+# The fingers are then the local maxima of smoothed - baseline that stand out
+# from the baseline by noise_factor x the Poisson noise of the bin (a
+# prominence that does not depend on where on the envelope the finger sits).
+# counts_threshold is still the minimum height of the smoothed spectrum.
+# Everything works on a 2D stack (one spectrum per row) without Python loops.
+
+BASELINE_WINDOW_PER_SPACING = 1.5
+DEFAULT_NOISE_FACTOR = 5.0
+
+
+def envelope_baseline(smoothed, window):
+    """Smooth lower envelope under the fingers for one spectrum or a 2D stack."""
+    from scipy.ndimage import gaussian_filter1d, grey_opening
+
+    y = np.atleast_2d(np.asarray(smoothed, dtype=float))
+    window = max(3, int(window) | 1)
+    opened = grey_opening(y, size=(1, window), mode='nearest')
+    baseline = np.minimum(gaussian_filter1d(opened, window / 4, axis=-1, mode='nearest'), y)
+    return baseline if np.ndim(smoothed) > 1 else baseline[0]
+
+
+def baseline_peak_mask(smoothed, window, distance, counts_threshold=0.0, sigma=1.0,
+                       noise_factor=DEFAULT_NOISE_FACTOR):
+    """Boolean (rows x bins) mask of the fingers found on smoothed - baseline."""
+    from scipy.ndimage import maximum_filter1d
+
+    y = np.atleast_2d(np.asarray(smoothed, dtype=float))
+    residual = y - envelope_baseline(y, window)
+    # Poisson noise per bin after averaging over ~2*sqrt(pi)*sigma bins
+    noise = np.sqrt(np.maximum(y, 1.0) / (2 * np.sqrt(np.pi) * max(sigma, 0.5)))
+
+    # A finger is the largest value within +-distance/2 (same as find_peaks' distance)
+    size = max(1, int(distance)) | 1
+    local_max = residual == maximum_filter1d(residual, size, axis=-1, mode='nearest')
+    mask = local_max & (y >= counts_threshold) & (residual >= noise_factor * noise)
+    # Plateaus give several equal maxima, keep the first of each run
+    mask[:, 1:] &= ~mask[:, :-1]
+    mask[:, [0, -1]] = False
+    return mask
+
+
+def baseline_peaks(smoothed, window, distance, counts_threshold=0.0, sigma=1.0,
+                   noise_factor=DEFAULT_NOISE_FACTOR, manual_peaks=None):
+    """Peak indices for one spectrum (array) or a 2D stack (list of arrays)."""
+    mask = baseline_peak_mask(smoothed, window, distance, counts_threshold, sigma, noise_factor)
+    rows, cols = np.nonzero(mask)
+    peaks = np.split(cols, np.searchsorted(rows, np.arange(1, mask.shape[0])))
+    if manual_peaks is not None:
+        peaks = [np.unique(np.concatenate([p, np.asarray(manual_peaks, dtype=p.dtype)])) for p in peaks]
+    return peaks if np.ndim(smoothed) > 1 else peaks[0]
+
+
+def baseline_window(peak_spacing_threshold, spacing=None):
+    """Opening width: 1.5 finger spacings, or 3x the find_peaks distance if the spacing is unknown."""
+    if spacing is not None and np.isfinite(spacing):
+        return BASELINE_WINDOW_PER_SPACING * spacing
+    return 3 * peak_spacing_threshold
+
+
+def baseline_peaks_many(smoothed_spectra, peak_spacing_threshold, counts_threshold=0.0, sigma=1.0,
+                        noise_factor=DEFAULT_NOISE_FACTOR, manual_peaks=None):
+    """baseline_peaks for a list of smoothed spectra of any lengths and gains.
+
+    Spectra with the same length and a similar finger spacing are stacked and
+    done in one go. Returns one peak array per spectrum, in order.
+    """
+    from sipm_analysis.autotune import estimate_spacings
+
+    spacings = estimate_spacings(smoothed_spectra)
+    windows = [baseline_window(peak_spacing_threshold, spacing) for spacing in spacings]
+
+    groups = {}
+    for i, (data, window) in enumerate(zip(smoothed_spectra, windows)):
+        # Openings a few bins apart find the same valleys
+        groups.setdefault((len(data), int(round(window / 4))), []).append(i)
+
+    peaks = [None] * len(smoothed_spectra)
+    for indices in groups.values():
+        window = np.median([windows[i] for i in indices])
+        stack = np.stack([smoothed_spectra[i] for i in indices])
+        for i, found in zip(indices, baseline_peaks(stack, window, peak_spacing_threshold, counts_threshold,
+                                                    sigma, noise_factor, manual_peaks)):
+            peaks[i] = found
+    return peaks
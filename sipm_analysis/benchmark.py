@@ -0,0 +1,119 @@
+import argparse
+import time
+
+import numpy as np
+
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS, PEAK_METHODS, analyze_spectra
+
+# ========================================
+# Benchmark of the peak_method engines on synthetic finger spectra
+# ========================================
+# Synthetic spectra with known finger positions (Gaussian fingers with a
+# Poisson-like envelope on a falling background, Poisson counts), laid out
+# like a CoMPASS spectrum so the usual crop_off_start / crop_off_end apply.
+#
+#   python -m sipm_analysis.benchmark --spectra 200
+#
+# prints, per case and method, the time per spectrum, the fraction of true
+# fingers found, the extra (false) peaks per spectrum and the mean position
+# error in bins.
+
+# spacing/width in bins, amplitude of the largest finger, background at the pedestal
+CASES = {
+    'nominal': dict(spacing=38.0, width=5.0, amplitude=3000, background=200),
+    'low_counts': dict(spacing=38.0, width=5.0, amplitude=150, background=20),
+    'close_fingers': dict(spacing=14.0, width=2.5, amplitude=3000, background=200),
+    'steep_background': dict(spacing=38.0, width=5.0, amplitude=1500, background=4000),
+}
+
+
+def synthetic_spectrum(rng, spacing, width, amplitude, background, n_bins=4500,
+                       crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                       crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+                       offset=60.0, mean_fingers=4.0):
+    """Poisson counts of one finger spectrum, true finger positions (cropped bins) and their expected counts."""
+    x = np.arange(n_bins) - crop_off_start
+    n_fingers = int((n_bins - crop_off_start - crop_off_end - offset) // spacing)
+    k = np.arange(n_fingers)
+    positions = offset + k * spacing + rng.normal(0, 0.2, n_fingers)
+    heights = amplitude * np.exp(-0.5 * ((k - mean_fingers) / (0.9 * mean_fingers)) ** 2)
+
+    expected = background * np.exp(-np.clip(x, 0, None) / 150) + 2
+    expected += (heights[:, None] * np.exp(-0.5 * ((x[None, :] - positions[:, None]) / width) ** 2)).sum(axis=0)
+    counts = rng.poisson(expected).astype(float)
+
+    # Only score fingers that stand out of the Poisson noise at all
+    under = background * np.exp(-positions / 150) + 2
+    visible = heights > 3 * np.sqrt(under)
+    return counts, positions[visible], (heights + under)[visible]
+
+
+def score(found, truth, tolerance):
+    """(true fingers found, extra peaks, sum of position errors) for one spectrum."""
+    if len(found) == 0:
+        return 0, 0, 0.0
+    distance = np.abs(np.asarray(found)[:, None] - truth[None, :])
+    nearest = distance.argmin(axis=1)
+    matched = distance[np.arange(len(found)), nearest] <= tolerance
+    hit = np.unique(nearest[matched])
+    errors = [distance[matched & (nearest == t)].min() for t in hit]
+    return len(hit), len(found) - len(hit), float(np.sum(errors))
+
+
+def case_params(case):
+    """Peak parameters a user would pick for the case (distance ~0.42 x spacing as in the defaults)."""
+    return dict(
+        crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+        crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+        sigma=min(DEFAULT_PEAK_PARAMS["sigma"], case['spacing'] / 10),
+        counts_threshold=min(DEFAULT_PEAK_PARAMS["counts_threshold"], case['amplitude'] / 10),
+        peak_spacing_threshold=max(2, int(0.42 * case['spacing'])),
+    )
+
+
+def run_benchmark(n_spectra=100, methods=PEAK_METHODS, cases=None, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for name, case in (cases or CASES).items():
+        spectra, positions, peak_counts = zip(*(synthetic_spectrum(rng, **case) for _ in range(n_spectra)))
+        params = case_params(case)
+        # Fingers below counts_threshold are not expected to be found by any method
+        truths = [p[c >= params['counts_threshold']] for p, c in zip(positions, peak_counts)]
+        tolerance = max(2.0, case['spacing'] / 6)
+
+        for method in methods:
+            analyze_spectra(spectra[:2], method=method, **params)  # imports / first-call overhead
+            start = time.perf_counter()
+            results = analyze_spectra(spectra, method=method, **params)
+            seconds = time.perf_counter() - start
+
+            hits = extra = errors = 0
+            for (_, peaks), truth in zip(results, truths):
+                h, e, err = score(peaks, truth, tolerance)
+                hits, extra, errors = hits + h, extra + e, errors + err
+            rows.append({
+                'case': name,
+                'method': method,
+                'ms per spectrum': 1000 * seconds / n_spectra,
+                'fingers found (%)': 100 * hits / sum(len(t) for t in truths),
+                'extra peaks per spectrum': extra / n_spectra,
+                'position error (bins)': errors / hits if hits else np.nan,
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the peak_method engines on synthetic spectra.")
+    parser.add_argument('--spectra', type=int, default=100, help="spectra per case")
+    parser.add_argument('--methods', nargs='+', default=list(PEAK_METHODS), choices=PEAK_METHODS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    table = run_benchmark(args.spectra, args.methods, seed=args.seed)
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.loaders import parse_coincidence_folder
+
+# ========================================
+# AddBack coincidence spectra: discovery and weighted means
+# ========================================
+
+
+def calculate_weighted_mean(data, time_per_sample=1.0):
+    if len(data) == 0 or np.sum(data) == 0:
+        print("[WARNING] Empty or zero-sum data passed to weighted mean calculation.")
+        return None, None, 0
+
+    indices = np.arange(len(data))
+    total_counts = np.sum(data)
+    weighted_mean_index = np.average(indices, weights=data)
+    weighted_mean_time = weighted_mean_index * time_per_sample
+
+    return weighted_mean_index, weighted_mean_time, total_counts
+
+
+def discover_addback_files(data_dir):
+    """Group AddBack spectra under peak*_and* folders: {(channel, "AddBack"): [(path, settings), ...]}."""
+    file_groups = {}
+    for peak_dir in sorted(Path(data_dir).rglob("peak*")):
+        if not peak_dir.is_dir():
+            continue
+        settings = parse_coincidence_folder(peak_dir.name)
+        if settings is None:
+            continue
+
+        for file_path in sorted(peak_dir.glob("*.txt")):
+            if "AddBack" in file_path.name:
+                channel_number = file_path.name.split("_")[1]
+                file_groups.setdefault((channel_number, "AddBack"), []).append((file_path, settings))
+    return file_groups
+
+
+def summarize_addback_spectrum(data, settings, channel, structure, file_name, script_name,
+                               time_per_sample=1.0, crop_off_start=0):
+    """One processed_peak_data.csv row for a (cropped) AddBack spectrum.
+
+    peak_index / weighted_mean_index count from the first kept bin; crop_off_start
+    (bins cut before it) is stored with them so rows of differently cropped runs compare.
+    """
+    peak_index = int(np.argmax(data))
+    weighted_mean_index, weighted_mean_time, total_counts = calculate_weighted_mean(data, time_per_sample)
+    return {
+        "time_ran": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "correlation_time": settings["correlation_time"],
+        "coincidence": settings["coincidence"],
+        "state": settings["state"],
+        "channel": channel,
+        "structure": structure,
+        "second_peak": settings["second_peak"],
+        "gain_voltage": settings["gain_voltage"],
+        "pulse_height": settings["pulse_height"],
+        "peak_value": np.max(data),
+        "peak_index": peak_index,
+        "file_used_in_analysis": file_name,
+        "python_file_used_to_generate_this": script_name,
+        "weighted_mean_index": weighted_mean_index,
+        "weighted_mean_time": weighted_mean_time,
+        "total_counts": total_counts,
+        "timestamp": peak_index * time_per_sample,
+        "crop_off_start": crop_off_start,
+    }
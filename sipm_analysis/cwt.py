@@ -0,0 +1,114 @@
+import numpy as np
+
+# ========================================
+# Multi-scale (continuous wavelet transform) peak detection
+# ========================================
+# One gaussian_filter1d(sigma) is a compromise: too wide and close fingers
+# at high gain merge, too narrow and low-count spectra stay noisy. Here the
+# cropped (unsmoothed) spectra are convolved with Ricker ("Mexican hat")
+# wavelets at several widths, all spectra and widths in one batched FFT.
+#
+# A finger is a maximum that persists from the coarse widths down to the
+# position width (a ridge line, followed with a running maximum of +-drift
+# bins between neighbouring widths) and whose best wavelet response is snr x
+# above the Poisson noise of that response. The position is read at a narrow
+# width (POSITION_WIDTH bins), so close fingers stay apart without the noise
+# of the very finest widths.
+
+DEFAULT_NUM_WIDTHS = 8
+DEFAULT_SNR = 5.0
+POSITION_WIDTH = 2.5
+MAX_BATCH_VALUES = 20_000_000  # rows x widths x FFT length per FFT call (~160 MB of float64)
+
+
+def default_widths(peak_spacing_threshold, num=DEFAULT_NUM_WIDTHS):
+    """Wavelet widths (bins) from 1.5 up to about the finger width (~ spacing / 4)."""
+    return np.geomspace(1.5, max(2.0, peak_spacing_threshold / 2), num)
+
+
+def ricker(points, width):
+    x = np.arange(points) - (points - 1) / 2
+    a = (x / width) ** 2
+    return 2 / (np.sqrt(3 * width) * np.pi ** 0.25) * (1 - a) * np.exp(-a / 2)
+
+
+def cwt_stack(spectra, widths):
+    """Ricker CWT of every row of a 2D stack -> (rows, widths, bins), batched FFT convolution."""
+    y = np.atleast_2d(np.asarray(spectra, dtype=float))
+    rows, n = y.shape
+    points = int(min(10 * max(widths), n)) | 1
+    n_fft = 1 << int(np.ceil(np.log2(n + points - 1)))
+
+    kernels = np.fft.rfft(np.stack([ricker(points, w) for w in widths]), n=n_fft, axis=-1)
+    out = np.empty((rows, len(widths), n))
+    chunk = max(1, MAX_BATCH_VALUES // (len(widths) * n_fft))
+    start = (points - 1) // 2
+    for i in range(0, rows, chunk):
+        # Edge bins are padded with the edge value so the ends don't look like peaks
+        padded = np.pad(y[i:i + chunk], ((0, 0), (start, n_fft - n - start)), mode='edge')
+        spectrum = np.fft.rfft(padded, axis=-1)
+        conv = np.fft.irfft(spectrum[:, None, :] * kernels[None, :, :], n=n_fft, axis=-1)
+        out[i:i + chunk] = conv[:, :, 2 * start:2 * start + n]
+    return out
+
+
+def cwt_peak_mask(spectra, widths, distance, counts_threshold=0.0, snr=DEFAULT_SNR, min_ridge=None):
+    """Boolean (rows x bins) mask of the ridge-line peaks."""
+    from scipy.ndimage import maximum_filter1d
+
+    y = np.atleast_2d(np.asarray(spectra, dtype=float))
+    widths = np.asarray(widths, dtype=float)
+    coefficients = cwt_stack(y, widths)
+    min_ridge = min_ridge or int(np.ceil(len(widths) / 2))
+
+    # Response of each wavelet to Poisson noise: sqrt(sum(w^2) * counts)
+    norms = np.array([np.sqrt(np.sum(ricker(int(10 * w) | 1, w) ** 2)) for w in widths])
+    noise = norms[None, :, None] * np.sqrt(np.maximum(y, 1.0))[:, None, :]
+    snr_map = coefficients / noise
+
+    size = max(1, int(distance)) | 1
+    maxima = coefficients == maximum_filter1d(coefficients, size, axis=-1, mode='nearest')
+    maxima &= coefficients > 0
+
+    # Ridge lines from the coarsest width down: length[s] = 1 + longest ridge within +-drift at s + 1
+    position_scale = min(int(np.searchsorted(widths, POSITION_WIDTH)), len(widths) - 1)
+    min_ridge = min(min_ridge, len(widths) - position_scale)
+    ridge = np.zeros(maxima.shape[:1] + maxima.shape[2:])
+    best_snr = np.full_like(ridge, -np.inf)
+    for s in range(len(widths) - 1, position_scale - 1, -1):
+        drift = max(1, int(np.ceil(widths[s] / 2)))
+        reach = 2 * drift + 1
+        ridge = np.where(maxima[:, s], maximum_filter1d(ridge, reach, axis=-1, mode='nearest') + 1, 0)
+        best_snr = np.maximum(maximum_filter1d(best_snr, reach, axis=-1, mode='nearest'), snr_map[:, s])
+
+    mask = (ridge >= min_ridge) & (best_snr >= snr) & (y >= counts_threshold)
+    mask[:, 1:] &= ~mask[:, :-1]
+    mask[:, [0, -1]] = False
+    return mask
+
+
+def cwt_peaks(spectra, peak_spacing_threshold, counts_threshold=0.0, widths=None, snr=DEFAULT_SNR,
+              min_ridge=None, manual_peaks=None):
+    """Peak indices for one cropped spectrum (array) or a 2D stack (list of arrays)."""
+    widths = default_widths(peak_spacing_threshold) if widths is None else widths
+    mask = cwt_peak_mask(spectra, widths, peak_spacing_threshold, counts_threshold, snr, min_ridge)
+    rows, cols = np.nonzero(mask)
+    peaks = np.split(cols, np.searchsorted(rows, np.arange(1, mask.shape[0])))
+    if manual_peaks is not None:
+        peaks = [np.unique(np.concatenate([p, np.asarray(manual_peaks, dtype=p.dtype)])) for p in peaks]
+    return peaks if np.ndim(spectra) > 1 else peaks[0]
+
+
+def cwt_peaks_many(spectra, peak_spacing_threshold, counts_threshold=0.0, manual_peaks=None, **kwargs):
+    """cwt_peaks for a list of spectra of any lengths (one batched transform per length)."""
+    by_length = {}
+    for i, data in enumerate(spectra):
+        by_length.setdefault(len(data), []).append(i)
+
+    peaks = [None] * len(spectra)
+    for indices in by_length.values():
+        stack = np.stack([spectra[i] for i in indices])
+        for i, found in zip(indices, cwt_peaks(stack, peak_spacing_threshold, counts_threshold,
+                                               manual_peaks=manual_peaks, **kwargs)):
+            peaks[i] = found
+    return peaks
@@ -0,0 +1,368 @@
+import argparse
+import json
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.peaks import crop_offsets
+from sipm_analysis.slopes import fit_spacing, iter_pulse_groups
+
+# ========================================
+# Gain drift monitor across runs / acquisition days
+# ========================================
+# One record per run, channel and gain:
+#   spacing  - peak spacing in bins (the Fitted Slope), proportional to the SiPM gain
+#   pedestal - where the fit puts Peak Number 0, in bins of the full spectrum
+#              (Peak Index + Crop Off Start, so a different crop isn't drift)
+#   width    - mean FWHM of the peaks, in bins
+#
+# The monitor keeps a small JSON state next to the results: the records of
+# every run it has seen, the reference (mean of the first `reference_runs`
+# runs) and the last `window` records of every channel/gain. update() only
+# touches the new runs, so checking a new day costs the same after a week or
+# after a year. A run that comes in again (a re-processed day) replaces its
+# records, and one that is earlier than the latest run seen (a re-processed
+# or backfilled day) rewinds the series to just before it and replays the
+# runs from there on in run order, so the reference and rolling means are the
+# same as if the days had come in order. The rewind rebuilds them from the
+# stored records of the first runs (reference) and of the runs right before
+# (rolling window) only. update_from_store() compares the store's partition
+# manifest (size and mtime of every part file, see results_store) with the
+# one it saw last, so it neither lists the store nor reads unchanged days.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_state_file = repo_root / 'results-from-generated-data' / 'drift_state.json'
+
+METRICS = ('spacing', 'pedestal', 'width')
+RUN_COLUMNS = ['run', 'Channel', 'Gain Voltage (V)'] + list(METRICS)
+# 2: pedestals in full-spectrum bins (1 stored them counted from each run's crop)
+STATE_VERSION = 2
+
+# spacing/width are relative to the reference, pedestal is absolute (bins)
+DEFAULT_TOLERANCES = {'spacing': 0.02, 'pedestal': 5.0, 'width': 0.10}
+RELATIVE_METRICS = ('spacing', 'width')
+
+
+def _series_key(channel, gain):
+    return f"{channel}|{float(gain)}"
+
+
+def runs_from_peak_table(df, run, excluded_peaks=()):
+    """One drift record per channel/gain of a peak table (pulses are averaged)."""
+    import pandas as pd
+
+    records = {}
+    for ch, gain, _, df_pulse in iter_pulse_groups(df, excluded_peaks):
+        if len(df_pulse) < 2:
+            continue
+        positions = df_pulse['Peak Index'].to_numpy(dtype=float) + crop_offsets(df_pulse)
+        _, fitted_slope, intercept = fit_spacing(df_pulse['Peak Number'].values, positions)
+        width = df_pulse['Peak Width'].mean() if 'Peak Width' in df_pulse.columns else np.nan
+        records.setdefault((str(ch), float(gain)), []).append((fitted_slope, intercept, width))
+
+    rows = []
+    for (ch, gain), values in records.items():
+        spacing, pedestal, width = np.nanmean(np.array(values, dtype=float), axis=0) if values else (np.nan,) * 3
+        rows.append([str(run), ch, gain, spacing, pedestal, width])
+    return pd.DataFrame(rows, columns=RUN_COLUMNS)
+
+
+def runs_from_result_tables(spacing_df, first_peaks_df, run):
+    """Drift records from results_spacing_from_slope + results_first_peaks_summary of one run."""
+    import pandas as pd
+
+    spacing = spacing_df.groupby(['Channel', 'Gain Voltage (V)'])['Fitted Slope'].mean()
+
+    first = first_peaks_df.rename(columns={
+        'Channel (from filename)': 'Channel', 'Gain Voltage (from filename)': 'Gain Voltage (V)'})
+    rows = []
+    for (ch, gain), df_gain in first.groupby(['Channel', 'Gain Voltage (V)'], observed=True):
+        if (ch, gain) not in spacing.index:
+            continue
+        slope = spacing[(ch, gain)]
+        # First peak position moved back to Peak Number 0 with this run's spacing
+        pedestal = (df_gain['Peak Index'] + crop_offsets(df_gain) - slope * df_gain['Peak Number']).mean()
+        width = df_gain['Peak Width'].mean() if 'Peak Width' in df_gain.columns else np.nan
+        rows.append([str(run), str(ch), float(gain), slope, pedestal, width])
+    return pd.DataFrame(rows, columns=RUN_COLUMNS)
+
+
+def _empty_reference():
+    return {'n': 0, **{m: 0.0 for m in METRICS}, **{f"n_{m}": 0 for m in METRICS}}
+
+
+def _values(metrics):
+    """{metric: value} of a stored record's metrics, null as NaN."""
+    return dict(zip(METRICS, (np.nan if v is None else float(v) for v in metrics)))
+
+
+def _add_to_reference(reference, values):
+    reference['n'] += 1
+    for m in METRICS:
+        if not np.isnan(values[m]):
+            reference[m] += values[m]
+            reference[f"n_{m}"] += 1
+
+
+def _recent_entry(run, values):
+    return dict({m: (None if np.isnan(v) else v) for m, v in values.items()}, run=run)
+
+
+class DriftMonitor:
+    def __init__(self, state_file=None, window=5, reference_runs=3, tolerances=None):
+        self.state_file = Path(state_file) if state_file else default_state_file
+        self.window = window
+        self.reference_runs = reference_runs
+        self.tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        self.state = self._load_state()
+
+    def _load_state(self):
+        state = {'version': STATE_VERSION, 'processed': [], 'series': {}, 'runs': {}, 'partitions': {}}
+        if self.state_file.exists():
+            with open(self.state_file) as f:
+                loaded = json.load(f)
+            state.update(loaded)
+            # Per-day fingerprints of older states: every stored day is compared once more by partition
+            state.pop('fingerprints', None)
+            if loaded.get('version', 1) < STATE_VERSION and state['processed']:
+                # Forget the partitions so update_from_store re-reads (and replays) every stored day
+                print(f"[WARNING] {self.state_file} has pedestals relative to each run's crop, "
+                      f"re-reading the stored days to put them in full-spectrum bins")
+                state['partitions'] = {}
+            state['version'] = STATE_VERSION
+        return state
+
+    def save(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    @property
+    def processed(self):
+        return set(self.state['processed'])
+
+    def _series(self, key):
+        return self.state['series'].setdefault(key, {
+            'reference': _empty_reference(),
+            'recent': [],
+            'n_runs': 0,
+        })
+
+    def _deviation(self, metric, rolling, reference):
+        if np.isnan(rolling) or np.isnan(reference):
+            return np.nan
+        if metric in RELATIVE_METRICS:
+            return (rolling - reference) / reference if reference else np.nan
+        return rolling - reference
+
+    def update(self, runs_df, runs=()):
+        """Add runs (RUN_COLUMNS), replacing the records of runs seen before.
+
+        runs: more run ids to replace, with no records left if runs_df has none for them.
+        Returns (trend DataFrame, list of alert strings) for the added runs, and
+        for every later run too when the series had to be replayed.
+        """
+        import pandas as pd
+
+        seen = self.processed
+        runs_df = runs_df.assign(run=runs_df['run'].astype(str))
+        changed = sorted(set(runs_df['run']) | {str(run) for run in runs})
+        if not changed:
+            return pd.DataFrame(), []
+        replay_from = changed[0] if seen and changed[0] <= max(seen) else None
+        if replay_from is not None:
+            # Before the records change: the ones taken out of the series are the stored ones
+            self._rewind(replay_from)
+        for run in changed:
+            # [channel, gain, spacing, pedestal, width] per record, NaN stored as null
+            records = runs_df.loc[runs_df['run'] == run, RUN_COLUMNS[1:]]
+            self.state['runs'][run] = [[str(ch), float(gain)] + [None if np.isnan(v) else float(v) for v in metrics]
+                                       for ch, gain, *metrics in records.itertuples(index=False)]
+
+        if replay_from is not None:
+            # A run at or before the latest one seen: replay from there on in run order
+            missing = seen - set(self.state['runs'])
+            if missing:
+                print(f"[WARNING] No stored records for runs {sorted(missing)} (drift state from an older "
+                      f"version), they are left out of the replayed series; delete {self.state_file} to rebuild")
+            runs_kept = sorted(self.state['runs'])
+            replay = runs_kept[bisect_left(runs_kept, replay_from):]
+        else:
+            replay = changed
+
+        rows, alerts = [], []
+        for run in replay:
+            run_rows, run_alerts = self._add_run(run, self.state['runs'][run])
+            rows.extend(run_rows)
+            alerts.extend(run_alerts)
+
+        self.state['processed'] = sorted(seen | set(changed))
+        return pd.DataFrame(rows), alerts
+
+    def _rewind(self, before):
+        """Put the series back to how they were after the last stored run before `before`.
+
+        The reference is rebuilt from the first runs and the rolling window from the runs
+        right before `before`, walking the stored records only as far as they need.
+        """
+        runs = sorted(self.state['runs'])
+        split = bisect_left(runs, before)
+        series_all = self.state['series']
+        for run in runs[split:]:
+            for ch, gain, *_ in self.state['runs'][run]:
+                series = series_all.get(_series_key(ch, gain))
+                if series is not None:
+                    series['n_runs'] -= 1
+        for key in [key for key, series in series_all.items() if series['n_runs'] <= 0]:
+            del series_all[key]
+
+        for series in series_all.values():
+            series['reference'] = _empty_reference()
+        filling = set(series_all)
+        for run in runs[:split]:
+            if not filling:
+                break
+            for ch, gain, *metrics in self.state['runs'][run]:
+                key = _series_key(ch, gain)
+                if key in filling:
+                    reference = series_all[key]['reference']
+                    _add_to_reference(reference, _values(metrics))
+                    if reference['n'] >= self.reference_runs:
+                        filling.discard(key)
+
+        recent = {key: [] for key in series_all}
+        filling = set(series_all)
+        for run in reversed(runs[:split]):
+            if not filling:
+                break
+            for ch, gain, *metrics in self.state['runs'][run]:
+                key = _series_key(ch, gain)
+                if key in filling:
+                    recent[key].append(_recent_entry(run, _values(metrics)))
+                    if len(recent[key]) >= self.window:
+                        filling.discard(key)
+        for key, series in series_all.items():
+            series['recent'] = recent[key][::-1]
+
+    def _add_run(self, run, records):
+        """Add one run's stored records to the series. Returns (trend rows, alerts)."""
+        rows, alerts = [], []
+        for ch, gain, *metrics in records:
+            values = _values(metrics)
+            series = self._series(_series_key(ch, gain))
+
+            reference = series['reference']
+            if reference['n'] < self.reference_runs:
+                _add_to_reference(reference, values)
+
+            series['recent'] = (series['recent'] + [_recent_entry(run, values)])[-self.window:]
+            series['n_runs'] += 1
+
+            row = {'run': run, 'Channel': ch, 'Gain Voltage (V)': gain, **values}
+            flagged = []
+            for m in METRICS:
+                recent = [r[m] for r in series['recent'] if r[m] is not None]
+                rolling = np.mean(recent) if recent else np.nan
+                ref = reference[m] / reference[f"n_{m}"] if reference[f"n_{m}"] else np.nan
+                deviation = self._deviation(m, rolling, ref)
+                row[f"rolling_{m}"] = rolling
+                row[f"{m}_drift"] = deviation
+                # Only judge drift once the reference is complete
+                if reference['n'] >= self.reference_runs and abs(deviation) > self.tolerances[m]:
+                    flagged.append(m)
+                    unit = '%' if m in RELATIVE_METRICS else ' bins'
+                    shown = deviation * 100 if m in RELATIVE_METRICS else deviation
+                    alerts.append(f"[DRIFT] {ch} | Gain = {gain} V | run {run}: {m} {shown:+.2f}{unit} "
+                                  f"vs reference (rolling {rolling:.2f}, reference {ref:.2f})")
+            row['alert'] = ",".join(flagged)
+            rows.append(row)
+        return rows, alerts
+
+    def update_from_store(self, store, excluded_peaks=()):
+        """Check the stored days that are new or were re-processed, reading only their partitions.
+
+        Days are found from the store's partition manifest: a day is read again when one of its
+        partitions was added, removed or has other part files (name, size or mtime) than last time.
+        """
+        import pandas as pd
+        from sipm_analysis.results_store import partition_keys
+
+        manifest = store.manifest('peaks')
+        known = self.state['partitions']
+        changed = [key for key in set(manifest) | set(known) if known.get(key) != manifest.get(key)]
+        if not changed:
+            return pd.DataFrame(columns=RUN_COLUMNS), []
+        dates = sorted({partition_keys(key)[0] for key in changed})
+
+        runs = [pd.DataFrame(columns=RUN_COLUMNS)]
+        stored_dates = sorted({partition_keys(key)[0] for key in manifest} & set(dates))
+        if stored_dates:
+            peaks = store.scan('peaks', date=stored_dates)
+            runs += [runs_from_peak_table(df_date, date, excluded_peaks)
+                     for date, df_date in peaks.groupby('date', observed=True)]
+        # dates also replaces a re-processed (or removed) day that has no usable channel/gain any more
+        trend, alerts = self.update(pd.concat(runs, ignore_index=True), runs=dates)
+        for key in changed:
+            if key in manifest:
+                known[key] = manifest[key]
+            else:
+                known.pop(key, None)
+        return trend, alerts
+
+
+def check_store_drift(store, state_file=None, excluded_peaks=(), **monitor_kwargs):
+    """Update the monitor from the store, save the state and add the trend rows to the store."""
+    monitor = DriftMonitor(state_file or Path(store.root).parent / 'drift_state.json', **monitor_kwargs)
+    trend, alerts = monitor.update_from_store(store, excluded_peaks)
+    monitor.save()
+    if not trend.empty:
+        for date, df_date in trend.groupby('run'):
+            store.append('drift', df_date, date)
+    for alert in alerts:
+        print(alert)
+    if not alerts:
+        print(f"✅ No drift beyond tolerances in {len(trend)} new or re-processed run(s)")
+    return trend, alerts
+
+
+def main():
+    from sipm_analysis.results_store import ResultsStore, default_store_dir
+    from sipm_analysis.tables import read_table
+
+    parser = argparse.ArgumentParser(description="Flag gain/pedestal/peak width drift across runs.")
+    parser.add_argument('--store', default=str(default_store_dir))
+    parser.add_argument('--state', help="state file (default: drift_state.json next to the store)")
+    parser.add_argument('--window', type=int, default=5, help="runs in the rolling mean")
+    parser.add_argument('--reference-runs', type=int, default=3, help="first runs that form the reference")
+    for metric, default in DEFAULT_TOLERANCES.items():
+        parser.add_argument(f'--{metric}-tolerance', type=float, default=default)
+    parser.add_argument('--tables', help="use results_spacing_from_slope + results_first_peaks_summary "
+                                         "from this folder instead of the store")
+    parser.add_argument('--run', help="run id for --tables (e.g. the acquisition date)")
+    args = parser.parse_args()
+
+    tolerances = {m: getattr(args, f"{m}_tolerance") for m in METRICS}
+    kwargs = dict(window=args.window, reference_runs=args.reference_runs, tolerances=tolerances)
+    store = ResultsStore(args.store)
+
+    if not args.tables:
+        check_store_drift(store, args.state, **kwargs)
+        return
+
+    if not args.run:
+        parser.error("--tables needs --run")
+    tables_dir = Path(args.tables)
+    runs = runs_from_result_tables(read_table(tables_dir / 'results_spacing_from_slope'),
+                                   read_table(tables_dir / 'results_first_peaks_summary'), args.run)
+    monitor = DriftMonitor(args.state or Path(store.root).parent / 'drift_state.json', **kwargs)
+    trend, alerts = monitor.update(runs)
+    monitor.save()
+    for alert in alerts:
+        print(alert)
+    if not alerts:
+        print(f"✅ No drift beyond tolerances in {len(trend)} new record(s)")
+
+
+if __name__ == '__main__':
+    main()
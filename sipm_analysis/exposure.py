@@ -0,0 +1,249 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.listmode import DEFAULT_N_BINS, TIMETAG_SECONDS
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS
+
+# ========================================
+# Spectra of any exposure time from one list-mode run
+# ========================================
+# photon_counts_data/20250403 has separate 20 s / 60 s / 120 s / 300 s folders
+# only to see how the statistics change with the exposure time. One long
+# list-mode run gives all of them:
+#
+#   python -m sipm_analysis.exposure DAQ/run/RAW/SDataR_run.csv --channel 0 --durations 20 60 120 300
+#
+# Events are sorted by time once and histogrammed per time segment (between
+# consecutive window edges) in a single bincount; the running sum over the
+# segments (prefix sums) then gives the spectrum of any window [a, b) as
+# prefix[b] - prefix[a]. Cumulative windows start at the first event, sliding
+# windows (--step) move along the run. Spectra are divided by the window
+# length (counts per second), the peaks are found on the counts with
+# counts_threshold scaled to the window length, and compared with the peaks of
+# the full run (peak position convergence vs exposure time).
+
+CONVERGENCE_COLUMNS = [
+    'Duration (s)', 'Window Start (s)', 'Peak Number', 'Peak Index', 'Peak Position',
+    'Reference Position', 'Shift (bins)'
+]
+SUMMARY_COLUMNS = [
+    'Duration (s)', 'Window Start (s)', 'Events', 'Peaks Found', 'Peaks Matched',
+    'Mean |Shift| (bins)', 'Fitted Spacing', 'Spacing vs Full Run (%)'
+]
+
+
+def sorted_events(timetag, energy):
+    """(times in s from the first event, energy) sorted by time; skips the sort if already sorted."""
+    timetag = np.asarray(timetag)
+    energy = np.asarray(energy)
+    if len(timetag) > 1 and np.any(timetag[1:] < timetag[:-1]):
+        order = np.argsort(timetag, kind='stable')
+        timetag, energy = timetag[order], energy[order]
+    times = (timetag - timetag[0]) * TIMETAG_SECONDS if len(timetag) else np.zeros(0)
+    return times, energy
+
+
+def prefix_histograms(times, energy, edges, n_bins=DEFAULT_N_BINS):
+    """Row k = spectrum of the events with edges[0] <= t < edges[k] (times sorted)."""
+    edges = np.asarray(edges, dtype=float)
+    split = np.searchsorted(times, edges, side='left')
+    segment_sizes = np.diff(split)
+    segment = np.repeat(np.arange(len(segment_sizes)), segment_sizes)
+    e = energy[split[0]:split[-1]]
+    keep = (e >= 0) & (e < n_bins)
+
+    counts = np.bincount(segment[keep] * n_bins + e[keep], minlength=len(segment_sizes) * n_bins)
+    prefix = np.zeros((len(edges), n_bins), dtype=np.int64)
+    np.cumsum(counts.reshape(len(segment_sizes), n_bins), axis=0, out=prefix[1:])
+    return prefix
+
+
+def window_spectra(times, energy, starts, durations, n_bins=DEFAULT_N_BINS):
+    """Counts of every window [start, start + duration), all windows from one set of prefix sums."""
+    starts = np.asarray(starts, dtype=float)
+    ends = starts + np.asarray(durations, dtype=float)
+    edges, inverse = np.unique(np.concatenate([starts, ends]), return_inverse=True)
+    prefix = prefix_histograms(times, energy, edges, n_bins)
+    return prefix[inverse[len(starts):]] - prefix[inverse[:len(starts)]]
+
+
+def cumulative_windows(run_length, durations):
+    """(starts, durations) of the windows starting at the first event, too long ones dropped."""
+    durations = np.asarray(sorted(set(float(d) for d in durations)))
+    too_long = durations > run_length
+    if too_long.any():
+        print(f"[WARNING] Run is only {run_length:.1f} s long, skipping durations {durations[too_long].tolist()}")
+    durations = durations[~too_long]
+    return np.zeros(len(durations)), durations
+
+
+def sliding_windows(run_length, durations, step):
+    """(starts, durations) of windows moved by step seconds through the run, per duration."""
+    starts, lengths = [], []
+    for duration in sorted(set(float(d) for d in durations)):
+        window_starts = np.arange(0.0, run_length - duration + 1e-9, step)
+        if len(window_starts) == 0:
+            print(f"[WARNING] Run is only {run_length:.1f} s long, no {duration:g} s window fits")
+        starts.append(window_starts)
+        lengths.append(np.full(len(window_starts), duration))
+    return np.concatenate(starts), np.concatenate(lengths)
+
+
+def rate_spectra(counts, durations, live_fraction=1.0):
+    """Counts per second of each window (per live second with the live_fraction from sipm_analysis.rates)."""
+    return counts / (np.asarray(durations, dtype=float)[:, None] * live_fraction)
+
+
+def refine_positions(smoothed_data, peaks):
+    """Sub-bin peak positions (parabola through each maximum and its neighbours)."""
+    peaks = np.asarray(peaks, dtype=int)
+    if len(peaks) == 0:
+        return np.zeros(0)
+    k = np.clip(peaks, 1, len(smoothed_data) - 2)
+    y0, y1, y2 = smoothed_data[k - 1], smoothed_data[k], smoothed_data[k + 1]
+    denominator = y0 - 2 * y1 + y2
+    safe = np.where(denominator != 0, denominator, 1.0)
+    return peaks + np.clip(np.where(denominator != 0, 0.5 * (y0 - y2) / safe, 0.0), -0.5, 0.5)
+
+
+def _fitted_spacing(numbers, positions):
+    from sipm_analysis.slopes import fit_spacing
+
+    if len(np.unique(numbers)) < 2:
+        return np.nan
+    return fit_spacing(np.asarray(numbers, dtype=float), np.asarray(positions))[1]
+
+
+def peak_convergence(counts, starts, durations, reference_counts, reference_duration, peak_params=None):
+    """Peaks of every window matched to the peaks of the reference (full run) spectrum.
+
+    Returns (convergence_df, summary_df) with CONVERGENCE_COLUMNS / SUMMARY_COLUMNS.
+    """
+    import pandas as pd
+    from sipm_analysis.peaks import analyze_spectra
+    from sipm_analysis.roi import resolve_crop
+
+    params = {**{k: DEFAULT_PEAK_PARAMS[k] for k in ('crop_off_start', 'crop_off_end', 'sigma',
+                                                      'counts_threshold', 'peak_spacing_threshold')},
+              'method': DEFAULT_PEAK_PARAMS['peak_method'], **(peak_params or {})}
+    # Windows cropped like the full run, so their peaks can be matched to its peaks
+    params['crop_off_start'], params['crop_off_end'] = resolve_crop([reference_counts], params['crop_off_start'],
+                                                                    params['crop_off_end'])
+
+    (reference_smoothed, reference_peaks), = analyze_spectra([reference_counts], **params)
+    reference = refine_positions(reference_smoothed, reference_peaks)
+    reference_spacing = _fitted_spacing(np.arange(1, len(reference) + 1), reference)
+    tolerance = 0.5 * (np.median(np.diff(reference)) if len(reference) > 1 else params['peak_spacing_threshold'])
+
+    rows, summary = [], []
+    for duration in np.unique(durations):
+        window = np.flatnonzero(durations == duration)
+        # Same threshold in counts per second as for the full run
+        threshold = params['counts_threshold'] * duration / reference_duration
+        results = analyze_spectra(counts[window], **{**params, 'counts_threshold': threshold})
+        for i, (smoothed, peaks) in zip(window, results):
+            positions = refine_positions(smoothed, peaks)
+            matched = []
+            if len(reference) and len(positions):
+                distance = np.abs(positions[:, None] - reference[None, :])
+                nearest = distance.argmin(axis=1)
+                matched = [j for j in range(len(peaks)) if distance[j, nearest[j]] <= tolerance]
+            numbers = np.array([nearest[j] + 1 for j in matched], dtype=int)
+            matched_positions = positions[matched]
+            shifts = matched_positions - reference[numbers - 1]
+            for j, number, shift in zip(matched, numbers, shifts):
+                rows.append({
+                    'Duration (s)': duration, 'Window Start (s)': starts[i], 'Peak Number': number,
+                    'Peak Index': int(peaks[j]), 'Peak Position': positions[j],
+                    'Reference Position': reference[number - 1], 'Shift (bins)': shift,
+                })
+
+            # Numbered like the full run, so a finger missed in a short window does not shift the fit
+            spacing = _fitted_spacing(numbers, matched_positions)
+            summary.append({
+                'Duration (s)': duration, 'Window Start (s)': starts[i], 'Events': int(counts[i].sum()),
+                'Peaks Found': len(peaks), 'Peaks Matched': len(matched),
+                'Mean |Shift| (bins)': np.mean(np.abs(shifts)) if len(shifts) else np.nan,
+                'Fitted Spacing': spacing,
+                'Spacing vs Full Run (%)': 100 * (spacing / reference_spacing - 1),
+            })
+    return pd.DataFrame(rows, columns=CONVERGENCE_COLUMNS), pd.DataFrame(summary, columns=SUMMARY_COLUMNS)
+
+
+def exposure_study(path, durations, channel=None, step=None, n_bins=DEFAULT_N_BINS, peak_params=None,
+                   output_dir=None, formats=None, live_time=False):
+    """Windowed spectra of one list-mode file and their peak convergence vs exposure time.
+
+    Returns (starts, durations, rate_spectra, convergence_df, summary_df); with output_dir the
+    rate spectra and both tables are written there. live_time=True divides by the live time
+    (dead time from the event intervals) instead of the real time.
+    """
+    from sipm_analysis.listmode import read_list_mode
+
+    events = read_list_mode(path, channels=None if channel is None else [channel])
+    if len(events.timetag) == 0:
+        raise ValueError(f"No events{'' if channel is None else f' on channel {channel}'} in {path}")
+    times, energy = sorted_events(events.timetag, events.energy)
+    run_length = float(times[-1])
+    print(f"[LOADED] {len(times)} events, {run_length:.1f} s from {events.source}")
+
+    if step:
+        starts, lengths = sliding_windows(run_length, durations, step)
+    else:
+        starts, lengths = cumulative_windows(run_length, durations)
+    # The full run is the last row, it is the reference for the convergence
+    all_starts, all_lengths = np.r_[starts, 0.0], np.r_[lengths, np.nextafter(run_length, np.inf)]
+    counts = window_spectra(times, energy, all_starts, all_lengths, n_bins)
+    convergence_df, summary_df = peak_convergence(counts[:-1], starts, lengths, counts[-1], run_length,
+                                                  peak_params)
+    live_fraction = 1.0
+    if live_time:
+        from sipm_analysis.rates import RateAnalyzer
+
+        analyzer = RateAnalyzer()
+        analyzer.add(events.channel, events.timetag)
+        live_fraction = analyzer.summary()['Live Fraction'].mean()
+        print(f"[LIVE TIME] live fraction {live_fraction:.4f}")
+    rates = rate_spectra(counts[:-1], lengths, live_fraction)
+
+    if output_dir is not None:
+        from sipm_analysis.tables import write_table
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem = Path(events.source).stem + ('' if channel is None else f'_CH{channel}')
+        np.savez_compressed(output_dir / f'{stem}_rate_spectra.npz', starts=starts, durations=lengths,
+                            counts_per_second=rates)
+        write_table(convergence_df, output_dir / f'{stem}_peak_convergence', formats)
+        write_table(summary_df, output_dir / f'{stem}_exposure_summary', formats)
+        print(f"✅ Exposure study written to {output_dir}")
+    return starts, lengths, rates, convergence_df, summary_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spectra and peak convergence vs exposure time from one list-mode run.")
+    parser.add_argument('path', help="CoMPASS list-mode .csv (DAQ/<run>/RAW)")
+    parser.add_argument('--durations', type=float, nargs='+', default=[20, 60, 120, 300],
+                        help="window lengths in s")
+    parser.add_argument('--step', type=float, help="slide the windows by this many s (default: cumulative from the start)")
+    parser.add_argument('--channel', type=int, help="CHANNEL number to use (default: all events in the file)")
+    parser.add_argument('--bins', type=int, default=DEFAULT_N_BINS)
+    parser.add_argument('--peak-method', default=DEFAULT_PEAK_PARAMS['peak_method'])
+    parser.add_argument('--counts-threshold', type=float, default=DEFAULT_PEAK_PARAMS['counts_threshold'],
+                        help="for the full run, scaled down for shorter windows")
+    parser.add_argument('--live-time', action='store_true', help="counts per live second (dead time corrected)")
+    parser.add_argument('--output-dir', default='exposure-study')
+    args = parser.parse_args()
+
+    _, _, _, _, summary_df = exposure_study(
+        args.path, args.durations, args.channel, args.step, args.bins,
+        {'method': args.peak_method, 'counts_threshold': args.counts_threshold}, args.output_dir,
+        live_time=args.live_time)
+    table = summary_df.groupby('Duration (s)')[['Peaks Matched', 'Mean |Shift| (bins)', 'Spacing vs Full Run (%)']]
+    print(table.agg(['mean', 'std']).to_string(float_format=lambda v: f"{v:.3f}"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import numpy as np
+
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS, crop
+
+# ========================================
+# Finger spacing (gain) straight from the spectrum, no peak finding
+# ========================================
+# The photoelectron fingers are a comb with period = gain in bins, so the
+# spacing shows up as
+#   - the fundamental of the power spectrum   (method='power')
+#   - the first rahmonic of the real cepstrum (method='cepstrum'), searched
+#     after the low-quefrency finger shape, with 2d / 3d / 4d folded back to d
+# Both work on a whole stack of equal-length spectra in one batched FFT and
+# interpolate between FFT bins, so the result is sub-bin. Use it as a quick
+# first-pass gain and as a cross-check of the Fitted Slope from
+# single-channel-analysis/plot_index_vs_peak_slope_spacing_table.py.
+
+# A cepstrum peak at q / m at least this high (vs the one at q) makes q the m-th rahmonic
+RAHMONIC_FRACTION = 0.5
+
+FFT_SPACING_COLUMNS = [
+    'Channel', 'Gain Voltage (V)', 'Pulse Height (V)', 'FFT Spacing', 'Cepstrum Spacing', 'Source File'
+]
+
+
+def _prepare(spectra, max_spacing):
+    """High-pass (remove the envelope the fingers sit on) and Hann-window each row."""
+    from scipy.ndimage import gaussian_filter1d
+
+    y = np.atleast_2d(np.asarray(spectra, dtype=float))
+    y = y - gaussian_filter1d(y, max_spacing / 2, axis=-1, mode='nearest')
+    return y * np.hanning(y.shape[-1])
+
+
+def _refine(values, k, log=False):
+    """Sub-bin position of the maxima at k (parabola through the neighbours)."""
+    rows = np.arange(len(k))
+    k = np.clip(k, 1, values.shape[-1] - 2)
+    y0, y1, y2 = (values[rows, k + d] for d in (-1, 0, 1))
+    if log:
+        # A Gaussian-shaped peak is a parabola in log
+        y0, y1, y2 = (np.log(np.maximum(v, 1e-300)) for v in (y0, y1, y2))
+    denominator = y0 - 2 * y1 + y2
+    safe = np.where(denominator != 0, denominator, 1.0)
+    return k + np.clip(np.where(denominator != 0, 0.5 * (y0 - y2) / safe, 0.0), -0.5, 0.5)
+
+
+def power_spectrum_spacing(spectra, min_spacing=4, max_spacing=200, oversample=4):
+    """Spacing in bins from the strongest comb frequency, for one spectrum or a 2D stack."""
+    y = _prepare(spectra, max_spacing)
+    n = y.shape[-1]
+    # Zero padding makes the frequency grid finer, the parabola does the rest
+    n_fft = 1 << int(np.ceil(np.log2(oversample * n)))
+    power = np.abs(np.fft.rfft(y, n=n_fft, axis=-1)) ** 2
+
+    k = np.arange(power.shape[-1])
+    band = (k >= n_fft / max_spacing) & (k <= n_fft / min_spacing)
+    k_peak = np.where(band, power, -np.inf).argmax(axis=-1)
+    spacing = n_fft / _refine(power, k_peak, log=True)
+    # A maximum on the edge of the band is envelope leakage, not the comb
+    spacing[(k_peak <= k[band][0]) | (k_peak >= k[band][-1])] = np.nan
+    return spacing if np.ndim(spectra) > 1 else float(spacing[0])
+
+
+def cepstrum_spacing(spectra, min_spacing=4, max_spacing=200, rahmonic_fraction=RAHMONIC_FRACTION):
+    """Spacing in bins from the first rahmonic of the real cepstrum, for one spectrum or a 2D stack."""
+    from scipy.ndimage import gaussian_filter1d
+
+    y = _prepare(spectra, max_spacing)
+    n = y.shape[-1]
+    power = np.abs(np.fft.rfft(y, n=2 * n, axis=-1)) ** 2
+    # Log power above the noise floor, weighted by how far the harmonics stand out of it: the
+    # frequencies past the last harmonic are only noise and would blur the rahmonic by a few bins
+    floor = np.median(power, axis=-1, keepdims=True) + 1e-12
+    envelope = gaussian_filter1d(power, 4 * n / max_spacing, axis=-1)
+    weight = envelope / (envelope + 10 * floor)
+    cepstrum = np.fft.irfft((np.log(power + floor) - np.log(2 * floor)) * weight, axis=-1)
+
+    rows = np.arange(len(cepstrum))
+    q = np.arange(cepstrum.shape[-1])
+    top = min(max_spacing, n - 2)
+    # The finger shape falls off from q = 0 and is larger than the comb: search after its first minimum
+    rising = np.diff(cepstrum[:, :top + 1], axis=-1) >= 0
+    lower = np.maximum(min_spacing, np.where(rising[:, 1:].any(axis=-1), rising[:, 1:].argmax(axis=-1) + 1, top))
+    band = (q >= lower[:, None]) & (q <= top)
+    q_peak = np.where(band, cepstrum, -np.inf).argmax(axis=-1)
+
+    # The comb also peaks at 2, 3, ... x the spacing: fold a rahmonic back to the first one
+    # when the cepstrum has a peak of its own at q_peak / m
+    first = q_peak.copy()
+    for m in (4, 3, 2):
+        around = np.clip(np.rint(q_peak / m).astype(np.int64)[:, None] + np.arange(-1, 2), 0, top)
+        best = around[rows, cepstrum[rows[:, None], around].argmax(axis=-1)]
+        value = cepstrum[rows, best]
+        is_peak = (value >= cepstrum[rows, best - 1]) & (value >= cepstrum[rows, best + 1])
+        folds = (best > lower) & (first == q_peak) & is_peak & (value >= rahmonic_fraction * cepstrum[rows, q_peak])
+        first = np.where(folds, best, first)
+
+    spacing = _refine(cepstrum, first)
+    spacing[(first <= lower) | (first >= top)] = np.nan
+    return spacing if np.ndim(spectra) > 1 else float(spacing[0])
+
+
+def estimate_spacing(spectra, method='power', **kwargs):
+    if method == 'power':
+        return power_spectrum_spacing(spectra, **kwargs)
+    if method == 'cepstrum':
+        return cepstrum_spacing(spectra, **kwargs)
+    raise ValueError(f"Unknown method '{method}', expected 'power' or 'cepstrum'")
+
+
+def fft_spacing_table(spectra, crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                      crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"], **kwargs):
+    """FFT and cepstrum spacing of every Spectrum, one batched FFT per spectrum length."""
+    import pandas as pd
+
+    from sipm_analysis.roi import resolve_crop
+
+    spectra = list(spectra)
+    crop_off_start, crop_off_end = resolve_crop([spectrum.data for spectrum in spectra], crop_off_start,
+                                                crop_off_end)
+    by_length = {}
+    for spectrum in spectra:
+        cropped = crop(spectrum.data, crop_off_start, crop_off_end)
+        by_length.setdefault(len(cropped), []).append((spectrum, cropped))
+
+    rows = []
+    for group in by_length.values():
+        stack = np.stack([cropped for _, cropped in group])
+        fft = power_spectrum_spacing(stack, **kwargs)
+        cep = cepstrum_spacing(stack, **kwargs)
+        for (spectrum, _), fft_spacing, cep_spacing in zip(group, fft, cep):
+            rows.append([spectrum.channel, spectrum.gain, spectrum.pulse, fft_spacing, cep_spacing, spectrum.source])
+    return pd.DataFrame(rows, columns=FFT_SPACING_COLUMNS).sort_values(
+        ['Channel', 'Gain Voltage (V)', 'Pulse Height (V)']).reset_index(drop=True)
+
+
+def compare_with_slopes(fft_df, summary_df):
+    """Add the Fitted Slope of results_spacing_from_slope and the relative difference to it."""
+    keys = ['Channel', 'Gain Voltage (V)', 'Pulse Height (V)']
+    merged = fft_df.merge(summary_df[keys + ['Fitted Slope']], on=keys, how='left')
+    merged['FFT vs Slope (%)'] = 100 * (merged['FFT Spacing'] / merged['Fitted Slope'] - 1)
+    return merged
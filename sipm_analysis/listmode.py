@@ -0,0 +1,85 @@
+import os
+import re
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+# ========================================
+# Loading CoMPASS list-mode (RAW) files
+# ========================================
+# CoMPASS writes one line per event into DAQ/<run>/RAW/*.csv (';' separated):
+#
+#     BOARD;CHANNEL;TIMETAG;ENERGY;ENERGYSHORT;FLAGS
+#
+# TIMETAG is in ps and ENERGY is the bin of the saved CH* spectrum, so a
+# histogram of ENERGY over the whole file is the spectrum CoMPASS saves.
+# Time tags are kept as int64 ps (float seconds lose the ps after ~2.5 h).
+
+Events = namedtuple('Events', ['channel', 'timetag', 'energy', 'source'])
+
+TIMETAG_SECONDS = 1e-12
+DEFAULT_N_BINS = 4096  # channels of the CoMPASS energy histogram (the saved CH* spectra)
+DEFAULT_BLOCK_EVENTS = 1_000_000  # ~16 MB of CHANNEL/TIMETAG/ENERGY per block
+LIST_MODE_DTYPES = {'CHANNEL': np.int16, 'TIMETAG': np.int64, 'ENERGY': np.int32}
+
+
+def channel_of_file(filename):
+    """'CH0' for ...CH0@DT5720B..., None when the file has all channels."""
+    match = re.search(r"CH(\d+)", filename)
+    return f"CH{match.group(1)}" if match else None
+
+
+def iter_list_mode_files(data_dir, include_dark=False):
+    """Yield every list-mode .csv under data_dir (the RAW folders of a CoMPASS run)."""
+    for subdir, _, files in os.walk(data_dir):
+        for file in sorted(files):
+            if not file.lower().endswith(".csv"):
+                continue
+            if "dark" in file.lower() and not include_dark:
+                continue
+            yield Path(subdir) / file
+
+
+def _columns(path):
+    with open(path) as f:
+        header = f.readline().strip().split(';')
+    return [c for c in ('CHANNEL', 'TIMETAG', 'ENERGY') if c in header]
+
+
+def _events(df, path, channels):
+    if 'CHANNEL' in df:
+        channel = df['CHANNEL'].to_numpy()
+    else:
+        # Older per-channel files only have TIMETAG;ENERGY, the channel is in the name
+        name = channel_of_file(Path(path).name)
+        channel = np.full(len(df), int(name[2:]) if name else 0, dtype=np.int16)
+    if channels is not None:
+        keep = np.isin(channel, list(channels))
+        df, channel = df[keep], channel[keep]
+    return Events(channel, df['TIMETAG'].to_numpy(), df['ENERGY'].to_numpy(), Path(path).name)
+
+
+def read_list_mode(path, channels=None):
+    """Events of one list-mode file, optionally only some CHANNEL numbers (ints)."""
+    import pandas as pd
+
+    df = pd.read_csv(path, sep=';', usecols=_columns(path), dtype=LIST_MODE_DTYPES)
+    return _events(df, path, channels)
+
+
+def iter_list_mode_blocks(path, block_events=DEFAULT_BLOCK_EVENTS, channels=None):
+    """Events of one list-mode file in blocks of block_events lines, for files that don't fit in memory."""
+    import pandas as pd
+
+    with pd.read_csv(path, sep=';', usecols=_columns(path), dtype=LIST_MODE_DTYPES,
+                     chunksize=block_events) as reader:
+        for df in reader:
+            yield _events(df, path, channels)
+
+
+def energy_histogram(energy, n_bins=DEFAULT_N_BINS):
+    """Spectrum (counts per bin) of a set of events, energies outside [0, n_bins) dropped."""
+    energy = np.asarray(energy)
+    energy = energy[(energy >= 0) & (energy < n_bins)]
+    return np.bincount(energy, minlength=n_bins)
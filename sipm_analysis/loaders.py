@@ -0,0 +1,118 @@
+import os
+import re
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+# ========================================
+# Loading CoMPASS spectra and generated tables
+# ========================================
+# pandas/pyarrow are only imported inside the functions that return DataFrames
+# so a worker that just needs the spectra does not pay for it.
+
+Spectrum = namedtuple('Spectrum', ['channel', 'gain', 'pulse', 'state', 'data', 'source'])
+
+
+def extract_gain_and_pulse_voltages(filename):
+    match = re.search(r"_(\d+)_?(\d+)_gain_(\d+)_?(\d+)[Vv]?_pulse", filename)
+    if match:
+        gain = float(f"{match.group(1)}.{match.group(2)}")
+        pulse = float(f"{match.group(3)}.{match.group(4)}")
+        return gain, pulse
+    return None, None
+
+
+def channel_from_filename(filename):
+    return "CH0" if "CH0" in filename else "CH1"
+
+
+def load_spectrum(path, delimiter=',', trimmed=False):
+    """One spectrum as an array, or a TrimmedSpectrum for .npz files (sipm_analysis.trimmed) and trimmed=True."""
+    from sipm_analysis.trimmed import TRIMMED_SUFFIX, TrimmedSpectrum, load_trimmed
+
+    if str(path).endswith(TRIMMED_SUFFIX):
+        return load_trimmed(path)
+    data = np.loadtxt(path, delimiter=delimiter)
+    return TrimmedSpectrum.from_dense(data) if trimmed else data
+
+
+def iter_spectrum_files(data_dir, include_dark=False):
+    """Yield (path, channel, gain, pulse, state) for every CH* file under data_dir."""
+    for subdir, _, files in os.walk(data_dir):
+        for file in sorted(files):
+            if not file.startswith("CH"):
+                continue
+            is_dark = "dark" in file.lower()
+            if is_dark and not include_dark:
+                continue
+
+            gain_v, pulse_v = extract_gain_and_pulse_voltages(file)
+            if gain_v is None:
+                print(f"[SKIPPED] Could not parse voltages from: {file}")
+                continue
+
+            state = "dark" if is_dark else "light"
+            yield Path(subdir) / file, channel_from_filename(file), gain_v, pulse_v, state
+
+
+def load_spectra(data_dir, gain_voltages=None, pulse_voltages=None, include_dark=False, run_metrics=None,
+                 trimmed=False):
+    """Load every matching spectrum under data_dir as a list of Spectrum tuples (data trimmed if trimmed=True)."""
+    spectra = []
+    for path, channel, gain_v, pulse_v, state in iter_spectrum_files(data_dir, include_dark):
+        if gain_voltages and gain_v not in gain_voltages:
+            continue
+        if pulse_voltages and pulse_v not in pulse_voltages:
+            continue
+
+        try:
+            if run_metrics is not None:
+                with run_metrics.stage("load"):
+                    data = load_spectrum(path, trimmed=trimmed)
+                run_metrics.count("files_loaded")
+            else:
+                data = load_spectrum(path, trimmed=trimmed)
+        except Exception as e:
+            print(f"[ERROR] Could not load {path}: {e}")
+            if run_metrics is not None:
+                run_metrics.count("files_failed")
+            continue
+
+        print(f"[LOADED] {channel} | Gain = {gain_v} V | Pulse = {pulse_v} V | from {path.name}")
+        spectra.append(Spectrum(channel, gain_v, pulse_v, state, data, path.name))
+    return spectra
+
+
+def group_by_channel_and_gain(spectra):
+    """Same nesting the plotting scripts use: {channel: {gain: [Spectrum, ...]}}."""
+    grouped = {}
+    for spectrum in spectra:
+        grouped.setdefault(spectrum.channel, {}).setdefault(spectrum.gain, []).append(spectrum)
+    return grouped
+
+
+def parse_coincidence_folder(folder_name):
+    """peak4_and8_50ns_correlation_window_..._filtered -> dict of the coincidence settings."""
+    match = re.search(r"peak(\d+)_and(\d+)", folder_name)
+    if not match:
+        return None
+    parts = folder_name.split("_")
+    first_peak, second_peak = int(match.group(1)), int(match.group(2))
+    gain_v, pulse_v = extract_gain_and_pulse_voltages(folder_name)
+    return {
+        "first_peak": first_peak,
+        "second_peak": second_peak,
+        "coincidence": f"Peak {first_peak} and {second_peak}",
+        "correlation_time": parts[2] if len(parts) > 2 else "",
+        "state": next((word for word in ["filtered", "unfiltered", "raw"] if word in parts), ""),
+        "gain_voltage": gain_v,
+        "pulse_height": pulse_v,
+    }
+
+
+def load_peak_table(path, **filters):
+    """Parquet/Arrow/CSV result table, see sipm_analysis.tables.read_table for the filters."""
+    from sipm_analysis.tables import read_table
+
+    return read_table(path, **filters)
@@ -0,0 +1,124 @@
+import cProfile
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# ========================================
+# Per-run timing / counter instrumentation
+# ========================================
+# Usage in a script:
+#
+#     run_metrics = RunMetrics(Path(__file__).name)
+#     with run_metrics.stage("load"):
+#         ...
+#         run_metrics.count("files_loaded")
+#     run_metrics.write_json()
+#
+# Set SIPM_PROFILE=1 to also dump a cProfile .prof file next to the JSON and
+# SIPM_TRACEMALLOC=1 to record peak traced memory per stage.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_metrics_dir = repo_root / 'results-from-generated-data' / 'metrics'
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class RunMetrics:
+    def __init__(self, script_name, profile=None, trace_memory=None):
+        self.script_name = script_name
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.counters = {}
+        self.profile = _env_flag('SIPM_PROFILE') if profile is None else profile
+        self.trace_memory = _env_flag('SIPM_TRACEMALLOC') if trace_memory is None else trace_memory
+        self._t0 = time.perf_counter()
+        self._profiler = None
+        # Peak memory of the open stages from before a nested stage reset the peak, innermost last
+        self._outer_peaks = []
+        self._started_tracing = False
+
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name):
+        # Stages can be entered many times (e.g. once per file), times add up
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        if self.trace_memory:
+            # reset_peak() also clears the peak of the enclosing stage, so keep it
+            if self._outer_peaks:
+                self._outer_peaks[-1] = max(self._outer_peaks[-1], tracemalloc.get_traced_memory()[1])
+            self._outer_peaks.append(0)
+            tracemalloc.reset_peak()
+        t_start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] += time.perf_counter() - t_start
+            entry['calls'] += 1
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], self._outer_peaks.pop())
+                entry['peak_memory_bytes'] = max(entry.get('peak_memory_bytes', 0), peak)
+
+    def timed(self, name=None):
+        """Decorator version of stage(), defaults to the function name."""
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def as_dict(self):
+        return {
+            'script': self.script_name,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'total_seconds': time.perf_counter() - self._t0,
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+
+    def write_json(self, output_dir=None):
+        output_dir = Path(output_dir) if output_dir else default_metrics_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{Path(self.script_name).stem}_{self.started_at.strftime('%Y%m%d_%H%M%S')}"
+        summary = self.as_dict()
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            profile_file = output_dir / f"{stem}.prof"
+            self._profiler.dump_stats(profile_file)
+            summary['profile_file'] = profile_file.name
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        metrics_file = output_dir / f"{stem}.json"
+        with open(metrics_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"⏱️ Run metrics written to {metrics_file}")
+        return metrics_file
+
+    def print_summary(self):
+        print("\n=== Stage Timings ===")
+        for name, entry in self.stages.items():
+            print(f"  {name:<20} {entry['seconds']:8.3f} s  ({entry['calls']} calls)")
+        for name, value in self.counters.items():
+            print(f"  {name:<20} {value}")
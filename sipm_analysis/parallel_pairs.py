@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sipm_analysis.rates import PS_PER_NS
+
+# ========================================
+# CH0/CH1 coincidences on several cores
+# ========================================
+# pair_events (one-to-one nearest pairs) and the all-pairs delta-t histogram
+# run on one core. For long two-channel runs the sorted CH0 time tags are cut
+# into chunks of equal size (CHUNKS_PER_WORKER per process so a slow chunk
+# doesn't hold the pool) and each chunk is paired in its own process with only
+# the events it can need:
+#
+#   all pairs:       CH1 events within max_dt of the chunk
+#   one-to-one:      CH0 events within 2 W of the chunk (the ones that can
+#                    compete for the same CH1 event) and CH1 events within 3 W
+#                    (everything those can pair with); only pairs whose CH0
+#                    event is in the chunk itself are kept
+#
+# so no pair is lost or counted twice at a chunk boundary, and the result is
+# identical to the serial one: same index arrays in the same order, same
+# integer histogram. Small inputs (under MIN_CHUNK_EVENTS per chunk) stay on
+# one core, where starting the processes would cost more than it saves.
+#
+# The time tags (and peak classes) go to the workers in shared memory
+# (sipm_analysis.shared), a job is only index ranges. One-to-one pairs are
+# written into a shared CH1-partner-per-CH0-event array; delta-t histograms
+# come back per job (their size doesn't grow with the run).
+
+MIN_CHUNK_EVENTS = 100_000
+CHUNKS_PER_WORKER = 4
+
+
+def n_workers(workers, n_events):
+    """Processes to use for n_events CH0 events (workers None = number of CPUs)."""
+    workers = workers or os.cpu_count() or 1
+    return max(1, min(workers, n_events // MIN_CHUNK_EVENTS))
+
+
+def chunk_bounds(n_events, n_chunks):
+    """(start, stop) index ranges of n_chunks contiguous, equal-sized chunks."""
+    bounds = np.linspace(0, n_events, n_chunks + 1).astype(np.int64)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _slice(t, low, high):
+    """Index range of the sorted time tags t with low <= t <= high."""
+    return int(np.searchsorted(t, low, side='left')), int(np.searchsorted(t, high, side='right'))
+
+
+def _pair_chunk(job):
+    from sipm_analysis.addback import pair_events
+    from sipm_analysis.shared import attached
+
+    window_ps, (low0, high0), (low1, high1), (start, stop) = job
+    i0, i1 = pair_events(attached('t0').array[low0:high0], attached('t1').array[low1:high1], window_ps)
+    i0, i1 = i0 + low0, i1 + low1
+    keep = (i0 >= start) & (i0 < stop)
+    attached('partner').array[i0[keep]] = i1[keep]
+
+
+def pair_events_parallel(t0, t1, window_ps, workers=None):
+    """addback.pair_events split over processes; returns the same (i0, i1)."""
+    from sipm_analysis.addback import pair_events
+
+    t0, t1 = np.asarray(t0, dtype=np.int64), np.asarray(t1, dtype=np.int64)
+    workers = n_workers(workers, len(t0))
+    if workers <= 1 or len(t1) == 0:
+        return pair_events(t0, t1, window_ps)
+
+    from sipm_analysis.shared import SharedArray
+
+    jobs = []
+    for start, stop in chunk_bounds(len(t0), workers * CHUNKS_PER_WORKER):
+        low, high = t0[start], t0[stop - 1]
+        jobs.append((window_ps, _slice(t0, low - 2 * window_ps, high + 2 * window_ps),
+                     _slice(t1, low - 3 * window_ps, high + 3 * window_ps), (start, stop)))
+    # partner[i] = CH1 index paired with CH0 event i, -1 = none
+    with SharedArray.from_array(t0) as shared0, SharedArray.from_array(t1) as shared1, \
+            SharedArray.create(t0.shape, np.int64, fill=-1) as partner:
+        _run(workers, _pair_chunk, jobs, {'t0': shared0.spec, 't1': shared1.spec, 'partner': partner.spec})
+        i0 = np.flatnonzero(partner.array >= 0)
+        return i0, partner.array[i0].copy()
+
+
+def _run(workers, func, jobs, specs):
+    from sipm_analysis.shared import attach_in_worker
+
+    with ProcessPoolExecutor(workers, initializer=attach_in_worker, initargs=(specs,)) as pool:
+        return list(pool.map(func, jobs))
+
+
+def _histogram_chunk(job):
+    from sipm_analysis.accidentals import DeltaTHistogram
+    from sipm_analysis.shared import attached
+
+    (max_dt_ns, bin_ns, n_classes), (start, stop), (low1, high1) = job
+    histogram = DeltaTHistogram(max_dt_ns, bin_ns, n_classes)
+    histogram.add(attached('t0').array[start:stop], attached('t1').array[low1:high1],
+                  attached('classes0').array[start:stop], attached('classes1').array[low1:high1])
+    return histogram.counts
+
+
+def add_delta_t_parallel(histogram, t0, t1, classes0=None, classes1=None, workers=None):
+    """histogram.add(t0, t1, classes0, classes1) split over processes, same counts."""
+    t0, t1 = np.asarray(t0, dtype=np.int64), np.asarray(t1, dtype=np.int64)
+    workers = n_workers(workers, len(t0))
+    if workers <= 1:
+        return histogram.add(t0, t1, classes0, classes1)
+
+    classes0 = np.zeros(len(t0), dtype=np.int64) if classes0 is None else np.asarray(classes0)
+    classes1 = np.zeros(len(t1), dtype=np.int64) if classes1 is None else np.asarray(classes1)
+    max_ps = int((histogram.half_bins + 0.5) * histogram.bin_ns * PS_PER_NS)
+    shape = (histogram.max_dt_ns, histogram.bin_ns, histogram.n_classes)
+    from sipm_analysis.shared import share_arrays
+
+    jobs = [(shape, (start, stop), _slice(t1, t0[start] - max_ps, t0[stop - 1] + max_ps))
+            for start, stop in chunk_bounds(len(t0), workers * CHUNKS_PER_WORKER)]
+    shared = share_arrays(t0, t1, classes0, classes1)
+    try:
+        specs = dict(zip(('t0', 't1', 'classes0', 'classes1'), (array.spec for array in shared)))
+        for counts in _run(workers, _histogram_chunk, jobs, specs):
+            histogram.counts += counts
+    finally:
+        for array in shared:
+            array.release()
+    histogram._cumulative = None
+    histogram.extend_span(t0, t1)
+    return histogram
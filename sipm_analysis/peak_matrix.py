@@ -0,0 +1,212 @@
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.listmode import DEFAULT_N_BINS
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS
+from sipm_analysis.rates import PS_PER_NS
+from sipm_analysis.roi import AUTO_CROP
+
+# ========================================
+# Every "peak i and peak j" coincidence from one list-mode run
+# ========================================
+# The peak4_and3 ... peak4_and8 folders each needed their own acquisition
+# with the digitizer's energy cuts. With list mode, one run gives all of them:
+#
+#   python -m sipm_analysis.peak_matrix DAQ/run/RAW/SDataR_65_7_gain_1_6_pulse.csv --window-ns 50 250 750
+#
+#   - each channel's ENERGY spectrum goes through the usual peak finder, a
+#     peak owns the bins halfway to its neighbours (Peak Number 1, 2, ... as in
+#     the peak tables)
+#   - CH0/CH1 events are paired once (one-to-one nearest, as in addback.py)
+#     with the largest window; smaller windows are cuts on |dt| of those pairs
+#   - one bincount per window gives the N x N matrix of pair counts and the
+#     AddBack spectrum (gain matched E0 + E1) of every cell
+#
+# Each cell becomes one row with the processed_peak_data.csv columns of
+# plot_coic_addback_with_weighted_means.py (weighted mean of its AddBack
+# spectrum etc.), plus the number of pairs and their mean CH0 - CH1 time.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_output_dir = repo_root / 'coincidence-analysis'
+MAX_PEAK = 8
+# One crop for all cells of a run (like plot_coic_addback_with_weighted_means.py),
+# stored as crop_off_start with the rows
+CROP_START = AUTO_CROP
+CROP_END = AUTO_CROP
+TIME_PER_SAMPLE = 1.0
+# What discover_addback_files reads from 0@AddBack_EspectrumF_... file names
+ADDBACK_CHANNEL = 'EspectrumF'
+STATE = 'built'
+
+
+def peak_boundaries(spectrum, peak_params=None):
+    """(peak positions, edges) of one ENERGY histogram; Peak Number n owns [edges[n-1], edges[n])."""
+    from sipm_analysis.peaks import analyze_spectrum
+    from sipm_analysis.roi import resolve_crop
+
+    params = {**{k: DEFAULT_PEAK_PARAMS[k] for k in ('crop_off_start', 'crop_off_end', 'sigma',
+                                                      'counts_threshold', 'peak_spacing_threshold')},
+              'method': DEFAULT_PEAK_PARAMS['peak_method'], **(peak_params or {})}
+    params['crop_off_start'], params['crop_off_end'] = resolve_crop([spectrum], params['crop_off_start'],
+                                                                    params['crop_off_end'])
+    _, peaks = analyze_spectrum(np.asarray(spectrum, dtype=float), **params)
+    peaks = np.asarray(peaks, dtype=float) + params['crop_off_start']
+    if len(peaks) < 2:
+        raise ValueError(f"only {len(peaks)} peaks found in the ENERGY spectrum")
+    middles = (peaks[1:] + peaks[:-1]) / 2
+    edges = np.r_[peaks[0] - (middles[0] - peaks[0]), middles, peaks[-1] + (peaks[-1] - middles[-1])]
+    return peaks, edges
+
+
+def classify(energy, edges, max_peak=MAX_PEAK):
+    """Peak Number of each event (1..max_peak), 0 outside the peaks."""
+    number = np.searchsorted(edges, np.asarray(energy, dtype=float), side='right')
+    return np.where((number >= 1) & (number < len(edges)) & (number <= max_peak), number, 0)
+
+
+def pair_matrix(t0, e0, t1, e1, edges0, edges1, windows_ns, max_peak=MAX_PEAK, n_bins=DEFAULT_N_BINS, workers=1):
+    """Counts, AddBack spectra and CH0 - CH1 time sums of every peak pair, per window.
+
+    Time tags sorted (ps). Returns a dict of arrays indexed [window, CH0 peak, CH1 peak(, bin)],
+    peak index 0 = outside the peaks. Only the pairing runs on several processes (workers),
+    the sums stay in one so they are the same as with workers=1.
+    """
+    from sipm_analysis.parallel_pairs import pair_events_parallel
+
+    windows_ns = np.asarray(windows_ns, dtype=float)
+    i0, i1 = pair_events_parallel(t0, t1, int(round(windows_ns.max() * PS_PER_NS)), workers)
+    dt_ns = (t0[i0] - t1[i1]) / PS_PER_NS
+    c0, c1 = classify(e0[i0], edges0, max_peak), classify(e1[i1], edges1, max_peak)
+
+    # Gain matching: CH1 put on the CH0 finger spacing before summing
+    scale = np.mean(np.diff(edges0)) / np.mean(np.diff(edges1))
+    addback = np.rint(e0[i0] + e1[i1] * scale).astype(np.int64)
+
+    n = max_peak + 1
+    cells = n * n
+    cell = c0 * n + c1
+    inside = (addback >= 0) & (addback < n_bins)
+    shape = (len(windows_ns), n, n)
+    result = {
+        'counts': np.zeros(shape, dtype=np.int64),
+        'dt_sum': np.zeros(shape), 'dt_squares': np.zeros(shape),
+        'spectra': np.zeros(shape + (n_bins,), dtype=np.int64),
+    }
+    for w, window in enumerate(windows_ns):
+        use = np.abs(dt_ns) <= window
+        result['counts'][w] = np.bincount(cell[use], minlength=cells).reshape(n, n)
+        result['dt_sum'][w] = np.bincount(cell[use], weights=dt_ns[use], minlength=cells).reshape(n, n)
+        result['dt_squares'][w] = np.bincount(cell[use], weights=dt_ns[use] ** 2, minlength=cells).reshape(n, n)
+        use &= inside
+        result['spectra'][w] = np.bincount(cell[use] * n_bins + addback[use],
+                                           minlength=cells * n_bins).reshape(n, n, n_bins)
+    return result
+
+
+def processed_rows(matrix, windows_ns, source, gain=None, pulse=None, script_name='peak_matrix.py',
+                   crop_start=CROP_START, crop_end=CROP_END, time_per_sample=TIME_PER_SAMPLE):
+    """processed_peak_data rows (summarize_addback_spectrum columns + pair timing) for every peak pair.
+
+    "auto" crops are resolved once over the spectra of all cells and windows.
+    """
+    import pandas as pd
+    from sipm_analysis.roi import resolve_crop
+
+    spectra = matrix['spectra'][:, 1:, 1:].astype(float)
+    crop_start, crop_end = resolve_crop(spectra.reshape(-1, spectra.shape[-1]), crop_start, crop_end)
+    spectra = spectra[..., crop_start:spectra.shape[-1] - crop_end]
+    totals = spectra.sum(axis=-1)
+    # Weighted mean index of every cell's cropped AddBack spectrum at once
+    index = np.arange(spectra.shape[-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted_mean = (spectra @ index) / totals
+        counts = matrix['counts'][:, 1:, 1:]
+        mean_dt = matrix['dt_sum'][:, 1:, 1:] / counts
+        std_dt = np.sqrt(np.maximum(matrix['dt_squares'][:, 1:, 1:] / counts - mean_dt ** 2, 0))
+    peak_index = spectra.argmax(axis=-1)
+    peak_value = spectra.max(axis=-1)
+
+    time_ran = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for w, window in enumerate(windows_ns):
+        for a in range(spectra.shape[1]):
+            for b in range(spectra.shape[2]):
+                empty = totals[w, a, b] == 0
+                rows.append({
+                    "time_ran": time_ran,
+                    "correlation_time": f"{window:g}ns",
+                    "coincidence": f"Peak {a + 1} and {b + 1}",
+                    "state": STATE,
+                    "channel": ADDBACK_CHANNEL,
+                    "structure": "AddBack",
+                    "second_peak": b + 1,
+                    "gain_voltage": gain,
+                    "pulse_height": pulse,
+                    "peak_value": peak_value[w, a, b],
+                    "peak_index": int(peak_index[w, a, b]),
+                    "file_used_in_analysis": source,
+                    "python_file_used_to_generate_this": script_name,
+                    "weighted_mean_index": None if empty else weighted_mean[w, a, b],
+                    "weighted_mean_time": None if empty else weighted_mean[w, a, b] * time_per_sample,
+                    "total_counts": totals[w, a, b],
+                    "timestamp": peak_index[w, a, b] * time_per_sample,
+                    "crop_off_start": crop_start,
+                    "first_peak": a + 1,
+                    "coincidence_counts": int(counts[w, a, b]),
+                    "mean_delta_t_ns": mean_dt[w, a, b],
+                    "delta_t_std_ns": std_dt[w, a, b],
+                })
+    return pd.DataFrame(rows)
+
+
+def peak_pair_study(path, windows_ns, max_peak=MAX_PEAK, peak_params=None, n_bins=DEFAULT_N_BINS, channels=(0, 1),
+                    workers=1):
+    """Returns (processed_df, matrix) for one list-mode file with both channels."""
+    from sipm_analysis.accidentals import channel_times
+    from sipm_analysis.listmode import energy_histogram, read_list_mode
+    from sipm_analysis.loaders import extract_gain_and_pulse_voltages
+
+    events = read_list_mode(path)
+    gain, pulse = extract_gain_and_pulse_voltages(str(path))
+    (t0, e0), (t1, e1) = (channel_times(events, ch) for ch in channels)
+
+    boundaries = []
+    for ch, energy in zip(channels, (e0, e1)):
+        peaks, edges = peak_boundaries(energy_histogram(energy, n_bins), peak_params)
+        print(f"[PEAKS] CH{ch} | {len(peaks)} peaks, first at {peaks[0]:.0f}, spacing {np.mean(np.diff(peaks)):.2f} bins")
+        boundaries.append(edges)
+
+    matrix = pair_matrix(t0, e0, t1, e1, boundaries[0], boundaries[1], windows_ns, max_peak, n_bins, workers)
+    return processed_rows(matrix, windows_ns, Path(path).name, gain, pulse), matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="All peak-pair coincidences of one list-mode run.")
+    parser.add_argument('path', help="list-mode .csv with both channels")
+    parser.add_argument('--window-ns', type=float, nargs='+', default=[750.0])
+    parser.add_argument('--max-peak', type=int, default=MAX_PEAK)
+    parser.add_argument('--counts-threshold', type=float, default=DEFAULT_PEAK_PARAMS['counts_threshold'],
+                        help="for the peak finder on the ENERGY spectra")
+    parser.add_argument('--workers', type=int, help="processes for the pairing (default: number of CPUs)")
+    parser.add_argument('--output-dir', default=str(default_output_dir))
+    args = parser.parse_args()
+
+    import pandas as pd
+    from sipm_analysis.tables import write_table
+
+    df, matrix = peak_pair_study(args.path, args.window_ns, args.max_peak,
+                                 {'counts_threshold': args.counts_threshold}, workers=args.workers)
+    largest = int(np.argmax(args.window_ns))
+    labels = [f"P{n}" for n in range(1, args.max_peak + 1)]
+    print(f"\nPairs within {max(args.window_ns):g} ns (rows CH0 peak, columns CH1 peak):")
+    print(pd.DataFrame(matrix['counts'][largest, 1:, 1:], index=labels, columns=labels).to_string())
+
+    for out in write_table(df, Path(args.output_dir) / 'processed_peak_data_matrix'):
+        print(f"✅ Peak-pair table saved to {out}")
+
+
+if __name__ == '__main__':
+    main()
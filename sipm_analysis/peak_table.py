@@ -0,0 +1,244 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.peaks import PEAK_TABLE_COLUMNS
+
+# ========================================
+# PeakTable: the peak table as one typed numpy array
+# ========================================
+# The peak tables were built as Python lists (one list or dict per peak, the
+# same timestamp string repeated on every row) and only became a DataFrame
+# to be written. A PeakTable keeps all peaks of a run or campaign in one
+# structured array (PEAK_TABLE_DTYPE, ~40 bytes a peak):
+#
+#   - Channel / State / SourceFile are small integer codes into a sorted list
+#     of names (categories), -1 = missing
+#   - Peak Counts / Peak Width are float32 (what typed_columns writes anyway),
+#     Index Difference is -1 for the first peak ("N/A" in the CSV tables)
+#
+# Appending, sorting and grouping (channel, gain, pulse) are numpy operations
+# on whole columns, to_frame() / from_frame() convert from / to the
+# PEAK_TABLE_COLUMNS DataFrames everything else reads, and save() / load()
+# keep the array as is in one .npz.
+
+PEAK_TABLE_DTYPE = np.dtype([
+    ('timestamp', 'datetime64[s]'),
+    ('channel', np.int16),
+    ('gain', np.float64),
+    ('pulse', np.float64),
+    ('peak_number', np.int16),
+    ('peak_index', np.int32),
+    ('peak_counts', np.float32),
+    ('index_difference', np.int32),
+    ('peak_width', np.float32),
+    ('state', np.int16),
+    ('source', np.int32),
+])
+CATEGORY_FIELDS = ('channel', 'state', 'source')
+# DataFrame column of each field (PEAK_TABLE_COLUMNS order), State / SourceFile only when present
+FRAME_COLUMNS = dict(zip(
+    ['timestamp', 'channel', 'gain', 'pulse', 'peak_number', 'peak_index', 'peak_counts', 'index_difference',
+     'peak_width'], PEAK_TABLE_COLUMNS))
+FRAME_COLUMNS.update(state='State', source='SourceFile')
+# Value of a field whose column is missing from a DataFrame (other floats NaN, ints 0)
+MISSING_VALUES = {'timestamp': np.datetime64('NaT'), 'index_difference': -1, 'channel': -1, 'state': -1, 'source': -1}
+
+
+def _no_categories():
+    return {field: None for field in CATEGORY_FIELDS}
+
+
+class PeakTable:
+    """Peaks of many spectra in one structured array (.rows) plus the names behind the category codes."""
+
+    def __init__(self, rows=None, categories=None):
+        self.rows = np.zeros(0, dtype=PEAK_TABLE_DTYPE) if rows is None else rows
+        # field -> sorted array of names, None when the table has no such column
+        self.categories = categories or _no_categories()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        """Rows (slice, index array or mask) as a PeakTable sharing the categories."""
+        return PeakTable(self.rows[index], self.categories)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def has(self, field):
+        return self.categories[field] is not None
+
+    def labels(self, field):
+        """Names of a category field per row (None where missing)."""
+        names = self.categories[field]
+        codes = self.rows[field]
+        if names is None:
+            return np.full(len(codes), None, dtype=object)
+        return np.where(codes >= 0, np.asarray(names, dtype=object)[np.maximum(codes, 0)], None)
+
+    # ---- building ----
+
+    @classmethod
+    def from_peaks(cls, peaks, smoothed_data, channel, gain_voltage, pulse_voltage, source=None, state=None,
+                   timestamp=None):
+        """Table of one spectrum's peaks, same values as peaks.peak_table_rows."""
+        from sipm_analysis.peaks import peak_fwhm
+
+        peaks = np.asarray(peaks, dtype=np.int64)
+        rows = np.zeros(len(peaks), dtype=PEAK_TABLE_DTYPE)
+        rows['timestamp'] = np.datetime64(timestamp or datetime.now().replace(microsecond=0), 's')
+        rows['gain'] = np.nan if gain_voltage is None else gain_voltage
+        rows['pulse'] = np.nan if pulse_voltage is None else pulse_voltage
+        rows['peak_number'] = np.arange(1, len(peaks) + 1)
+        rows['peak_index'] = peaks
+        rows['peak_counts'] = smoothed_data[peaks]
+        rows['index_difference'] = np.r_[-1, np.diff(peaks)][:len(peaks)]
+        rows['peak_width'] = peak_fwhm(smoothed_data, peaks)
+        categories = _no_categories()
+        for field, value in (('channel', channel), ('state', state), ('source', source)):
+            if value is not None:
+                categories[field] = np.array([str(value)])
+            rows[field] = 0 if value is not None else -1
+        return cls(rows, categories)
+
+    @classmethod
+    def from_frame(cls, df, source_column='SourceFile'):
+        """PeakTable of a PEAK_TABLE_COLUMNS DataFrame (e.g. read_table of all_peaks_combined_sorted)."""
+        import pandas as pd
+
+        rows = np.zeros(len(df), dtype=PEAK_TABLE_DTYPE)
+        categories = _no_categories()
+        columns = dict(FRAME_COLUMNS, source=source_column)
+        for field, column in columns.items():
+            if column not in df.columns:
+                rows[field] = MISSING_VALUES.get(field, np.nan if rows.dtype[field].kind == 'f' else 0)
+                continue
+            values = df[column]
+            if field in CATEGORY_FIELDS:
+                values = values.astype(object)
+                codes, names = pd.factorize(values.where(values.isna(), values.astype(str)), sort=True)
+                rows[field] = codes
+                categories[field] = np.asarray(names, dtype=str)
+            elif field == 'timestamp':
+                rows[field] = pd.to_datetime(values, errors='coerce').to_numpy().astype('datetime64[s]')
+            elif field == 'index_difference':
+                rows[field] = pd.to_numeric(values.replace('N/A', np.nan), errors='coerce').fillna(-1).to_numpy()
+            else:
+                rows[field] = values.to_numpy()
+        return cls(rows, categories)
+
+    @classmethod
+    def concat(cls, tables):
+        """One table from several, category codes renumbered onto the union of the names."""
+        tables = [table for table in tables if table is not None]
+        if not tables:
+            return cls()
+        rows = np.concatenate([table.rows for table in tables])
+        categories = _no_categories()
+        start = 0
+        for field in CATEGORY_FIELDS:
+            present = [table.categories[field] for table in tables if table.has(field)]
+            if present:
+                categories[field] = np.unique(np.concatenate(present))
+        for table in tables:
+            stop = start + len(table)
+            for field in CATEGORY_FIELDS:
+                if table.has(field) and len(table.categories[field]):
+                    codes = table.rows[field]
+                    remap = np.searchsorted(categories[field], table.categories[field])
+                    rows[field][start:stop] = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+            start = stop
+        return cls(rows, categories)
+
+    def append(self, *others):
+        return PeakTable.concat([self, *others])
+
+    # ---- ordering and groups ----
+
+    def sort(self):
+        """Sorted like all_peaks_combined_sorted: Channel, gain, pulse, Peak Index."""
+        rows = self.rows
+        # Category names are sorted, so sorting the codes sorts the channels by name
+        order = np.lexsort((rows['peak_index'], rows['pulse'], rows['gain'], rows['channel']))
+        return self[order]
+
+    def groups(self, excluded_peaks=()):
+        """Yield (channel, gain, pulse, PeakTable) like slopes.iter_pulse_groups, without a DataFrame per group.
+
+        Channels in order of first appearance, gains and pulses ascending, peaks by
+        Peak Number; only groups with peaks left after excluded_peaks. Peaks without a
+        channel, gain or pulse are left out, as in iter_pulse_groups (NaN matches no group).
+        """
+        rows = self.rows
+        codes, first = np.unique(rows['channel'], return_index=True)
+        channel_rank = np.argsort(np.argsort(first))[np.searchsorted(codes, rows['channel'])]
+        keyed = (rows['channel'] >= 0) & ~np.isnan(rows['gain']) & ~np.isnan(rows['pulse'])
+        keep = np.flatnonzero(keyed & ~np.isin(rows['peak_number'], list(excluded_peaks)))
+        keep = keep[np.lexsort((rows['peak_number'][keep], rows['pulse'][keep], rows['gain'][keep],
+                                channel_rank[keep]))]
+        if len(keep) == 0:
+            return
+        key = rows[['channel', 'gain', 'pulse']][keep]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        names = self.labels('channel')
+        for start, stop in zip(starts, np.r_[starts[1:], len(keep)]):
+            index = keep[start:stop]
+            first_row = index[0]
+            yield names[first_row], rows['gain'][first_row], rows['pulse'][first_row], self[index]
+
+    # ---- conversion and storage ----
+
+    def to_frame(self):
+        """PEAK_TABLE_COLUMNS DataFrame (plus State / SourceFile when the table has them)."""
+        import pandas as pd
+
+        rows = self.rows
+        index_difference = rows['index_difference'].astype(object)
+        index_difference[rows['index_difference'] < 0] = "N/A"
+        data = {
+            'Timestamp': pd.to_datetime(rows['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
+            'Channel': self.labels('channel'),
+            'Voltage Gain (V)': rows['gain'],
+            'Pulse Voltage (V)': rows['pulse'],
+            'Peak Number': rows['peak_number'].astype(np.int64),
+            'Peak Index': rows['peak_index'].astype(np.int64),
+            'Peak Counts': rows['peak_counts'],
+            'Index Difference': index_difference,
+            'Peak Width': rows['peak_width'],
+        }
+        for field in ('state', 'source'):
+            if self.has(field):
+                data[FRAME_COLUMNS[field]] = self.labels(field)
+        return pd.DataFrame(data)
+
+    def write(self, path, formats=None):
+        """write_table of to_frame(). Returns the files written."""
+        from sipm_analysis.tables import write_table
+
+        return write_table(self.to_frame(), path, formats)
+
+    @classmethod
+    def read(cls, path, **filters):
+        """PeakTable of a result table written by write_table (filters as in read_table)."""
+        from sipm_analysis.tables import read_table
+
+        return cls.from_frame(read_table(path, **filters))
+
+    def save(self, path):
+        """The array and the category names as they are, in one .npz."""
+        path = Path(path).with_suffix('.npz')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        names = {f'categories_{field}': self.categories[field] for field in CATEGORY_FIELDS if self.has(field)}
+        np.savez(path, rows=self.rows, **names)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(Path(path).with_suffix('.npz')) as stored:
+            categories = {field: stored[f'categories_{field}'] if f'categories_{field}' in stored else None
+                          for field in CATEGORY_FIELDS}
+            return cls(stored['rows'], categories)
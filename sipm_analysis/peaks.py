@@ -0,0 +1,221 @@
+from datetime import datetime
+
+import numpy as np
+
+from sipm_analysis.roi import resolve_crop
+from sipm_analysis.trimmed import TrimmedSpectrum
+
+# ========================================
+# Cropping, smoothing and peak finding on a single spectrum
+# ========================================
+# scipy is imported inside the functions that need it. Every function takes a
+# numpy array or a TrimmedSpectrum (sipm_analysis.trimmed), which is cropped,
+# smoothed and searched on its populated bins only. crop_off_start /
+# crop_off_end may be "auto" (sipm_analysis.roi): analyze_spectra then crops
+# all its spectra to the region of interest they share.
+
+PEAK_TABLE_COLUMNS = [
+    "Timestamp", "Channel", "Voltage Gain (V)", "Pulse Voltage (V)",
+    "Peak Number", "Peak Index", "Peak Counts", "Index Difference", "Peak Width"
+]
+# Peak Index counts from the first bin kept by the crop; combined / stored peak
+# tables carry that crop here, so Peak Index + Crop Off Start is the full-spectrum bin
+CROP_OFFSET_COLUMN = "Crop Off Start"
+
+# Defaults match plot-fit-peaks-SiPM-data.py
+DEFAULT_PEAK_PARAMS = {
+    "crop_off_start": 100,
+    "crop_off_end": 3000,
+    "counts_threshold": 100,
+    "peak_spacing_threshold": 16,
+    "sigma": 3.6,
+    "peak_method": "threshold",
+}
+
+# threshold: find_peaks with an absolute counts_threshold (the original approach)
+# baseline:  fingers above the smooth envelope, see sipm_analysis.baseline
+# cwt:       multi-scale wavelet ridges on the unsmoothed counts, see sipm_analysis.cwt
+PEAK_METHODS = ('threshold', 'baseline', 'cwt')
+
+
+def crop(data, crop_off_start, crop_off_end):
+    crop_off_start, crop_off_end = resolve_crop([data], crop_off_start, crop_off_end)
+    if isinstance(data, TrimmedSpectrum):
+        return data.crop(crop_off_start, crop_off_end)
+    # data[start:-0] would be empty, so count the end crop from the length
+    return data[crop_off_start:len(data) - crop_off_end]
+
+
+def manual_peaks_in_crop(manual_peaks, crop_off_start, n_bins=None):
+    """manual_peak_indices (bins of the full spectrum) counted from crop_off_start, as the peak finders want them.
+
+    Indices cropped away (before crop_off_start, or past n_bins cropped bins) are dropped with a warning.
+    """
+    if not manual_peaks:
+        return None
+    shifted = np.asarray(manual_peaks, dtype=np.int64) - int(crop_off_start)
+    inside = (shifted >= 0) & (shifted < (n_bins if n_bins is not None else np.iinfo(np.int64).max))
+    if not inside.all():
+        print(f"[WARNING] Manual peaks {list(np.asarray(manual_peaks)[~inside])} are outside the crop "
+              f"(crop_off_start = {crop_off_start}), left out")
+    return shifted[inside].tolist()
+
+
+def crop_offsets(df, default=None):
+    """crop_off_start of every row of a peak table, default (100) where it wasn't stored."""
+    default = DEFAULT_PEAK_PARAMS["crop_off_start"] if default is None else default
+    if CROP_OFFSET_COLUMN not in df.columns:
+        return np.full(len(df), int(default), dtype=np.int64)
+    return df[CROP_OFFSET_COLUMN].fillna(default).to_numpy(dtype=np.int64)
+
+
+def smooth_data(data, sigma=DEFAULT_PEAK_PARAMS["sigma"]):
+    from scipy.ndimage import gaussian_filter1d
+
+    if isinstance(data, TrimmedSpectrum):
+        return data.smooth(sigma)
+    return gaussian_filter1d(data, sigma=sigma)
+
+
+def _check_method(method):
+    if method not in PEAK_METHODS:
+        raise ValueError(f"Unknown peak_method '{method}', expected one of {PEAK_METHODS}")
+
+
+def find_spectrum_peaks(smoothed_data, counts_threshold, peak_spacing_threshold, manual_peaks=None,
+                        prominence=None, method="threshold", sigma=DEFAULT_PEAK_PARAMS["sigma"],
+                        raw_data=None):
+    """Peak indices of one spectrum. method='cwt' works on raw_data (the cropped counts) when given."""
+    from scipy.signal import find_peaks
+
+    _check_method(method)
+    if isinstance(smoothed_data, TrimmedSpectrum):
+        if method == "threshold":
+            return _trimmed_threshold_peaks(smoothed_data, counts_threshold, peak_spacing_threshold, manual_peaks,
+                                            prominence)
+        # baseline / cwt look at the whole spectrum
+        smoothed_data = np.asarray(smoothed_data)
+        raw_data = None if raw_data is None else np.asarray(raw_data)
+    if method == "cwt":
+        from sipm_analysis.cwt import cwt_peaks
+
+        return cwt_peaks(smoothed_data if raw_data is None else raw_data, peak_spacing_threshold,
+                         counts_threshold, manual_peaks=manual_peaks)
+    if method == "baseline":
+        from sipm_analysis.baseline import baseline_peaks_many
+
+        return baseline_peaks_many([smoothed_data], peak_spacing_threshold, counts_threshold, sigma,
+                                   manual_peaks=manual_peaks)[0]
+
+    # prominence may be a number or one value per bin (see sipm_analysis.autotune)
+    peaks, _ = find_peaks(smoothed_data, height=counts_threshold, distance=peak_spacing_threshold,
+                          prominence=prominence)
+    if manual_peaks is not None:
+        peaks = np.unique(np.concatenate([peaks, np.array(manual_peaks, dtype=peaks.dtype)]))
+    return peaks
+
+
+def _trimmed_threshold_peaks(smoothed, counts_threshold, peak_spacing_threshold, manual_peaks=None,
+                             prominence=None):
+    """Threshold peaks of a TrimmedSpectrum from its counts, in full-spectrum indices."""
+    from scipy.signal import find_peaks
+
+    if np.ndim(prominence):
+        prominence = np.asarray(prominence)[smoothed.offset:smoothed.stop]
+    peaks, _ = find_peaks(smoothed.counts, height=counts_threshold, distance=peak_spacing_threshold,
+                          prominence=prominence)
+    peaks = peaks + smoothed.offset
+    if manual_peaks is not None:
+        peaks = np.unique(np.concatenate([peaks, np.array(manual_peaks, dtype=peaks.dtype)]))
+    return peaks
+
+
+def analyze_spectrum(data, crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                     crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+                     sigma=DEFAULT_PEAK_PARAMS["sigma"],
+                     counts_threshold=DEFAULT_PEAK_PARAMS["counts_threshold"],
+                     peak_spacing_threshold=DEFAULT_PEAK_PARAMS["peak_spacing_threshold"],
+                     manual_peaks=None, method=DEFAULT_PEAK_PARAMS["peak_method"]):
+    """Crop, smooth and find peaks. Returns (smoothed_data, peaks)."""
+    data_cropped = crop(data, crop_off_start, crop_off_end)
+    smoothed_data = smooth_data(data_cropped, sigma=sigma)
+    peaks = find_spectrum_peaks(smoothed_data, counts_threshold, peak_spacing_threshold, manual_peaks,
+                                method=method, sigma=sigma, raw_data=data_cropped)
+    return smoothed_data, peaks
+
+
+def analyze_spectra(datas, crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                    crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+                    sigma=DEFAULT_PEAK_PARAMS["sigma"],
+                    counts_threshold=DEFAULT_PEAK_PARAMS["counts_threshold"],
+                    peak_spacing_threshold=DEFAULT_PEAK_PARAMS["peak_spacing_threshold"],
+                    manual_peaks=None, method=DEFAULT_PEAK_PARAMS["peak_method"]):
+    """analyze_spectrum for many spectra at once. Returns [(smoothed_data, peaks), ...]."""
+    _check_method(method)
+    # One region of interest for all of them, so Peak Index is the same bin in every spectrum
+    crop_off_start, crop_off_end = resolve_crop(datas, crop_off_start, crop_off_end)
+    cropped = [crop(data, crop_off_start, crop_off_end) for data in datas]
+    smoothed = [smooth_data(data, sigma=sigma) for data in cropped]
+    if method == "threshold":
+        return [(s, find_spectrum_peaks(s, counts_threshold, peak_spacing_threshold, manual_peaks)) for s in smoothed]
+
+    # baseline / cwt stack whole spectra
+    cropped = [np.asarray(data) for data in cropped]
+    smoothed = [np.asarray(s) for s in smoothed]
+
+    if method == "cwt":
+        from sipm_analysis.cwt import cwt_peaks_many
+
+        # The wavelets do their own smoothing, sigma only affects the returned/plotted curve
+        peaks = cwt_peaks_many(cropped, peak_spacing_threshold, counts_threshold, manual_peaks=manual_peaks)
+    else:
+        from sipm_analysis.baseline import baseline_peaks_many
+
+        peaks = baseline_peaks_many(smoothed, peak_spacing_threshold, counts_threshold, sigma,
+                                    manual_peaks=manual_peaks)
+    return list(zip(smoothed, peaks))
+
+
+def peak_fwhm(smoothed_data, peaks):
+    """Full width at half maximum of each peak, in bins."""
+    from scipy.signal import peak_widths
+
+    if len(peaks) == 0:
+        return np.array([])
+    if isinstance(smoothed_data, TrimmedSpectrum):
+        peaks = np.asarray(peaks)
+        if peaks.min() < smoothed_data.offset or peaks.max() >= smoothed_data.stop:
+            # e.g. a manual peak in the empty bins
+            return peak_widths(np.asarray(smoothed_data), peaks, rel_height=0.5)[0]
+        # The half-height crossings are inside the populated bins (zeros around them)
+        return peak_widths(smoothed_data.counts, np.asarray(peaks) - smoothed_data.offset, rel_height=0.5)[0]
+    return peak_widths(smoothed_data, peaks, rel_height=0.5)[0]
+
+
+def peak_table_rows(peaks, smoothed_data, channel, gain_voltage, pulse_voltage, timestamp_str=None):
+    timestamp_str = timestamp_str or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    widths = peak_fwhm(smoothed_data, peaks)
+    rows = []
+    for i, peak_idx in enumerate(peaks):
+        diff = peak_idx - peaks[i - 1] if i > 0 else "N/A"
+        rows.append([
+            timestamp_str, channel, gain_voltage, pulse_voltage,
+            i + 1, peak_idx, smoothed_data[peak_idx], diff, widths[i]
+        ])
+    return rows
+
+
+def peak_table_frame(peaks, smoothed_data, channel, gain_voltage, pulse_voltage):
+    from sipm_analysis.peak_table import PeakTable
+
+    return PeakTable.from_peaks(peaks, smoothed_data, channel, gain_voltage, pulse_voltage).to_frame()
+
+
+def write_peak_data_to_file(peaks, data_cropped, filename, gain_voltage, pulse_voltage, channel, formats=None):
+    """Writes the per-spectrum peak table (Parquet by default) and returns it as a DataFrame."""
+    from sipm_analysis.tables import write_table
+
+    df = peak_table_frame(peaks, data_cropped, channel, gain_voltage, pulse_voltage)
+    for out in write_table(df, filename, formats):
+        print(f"✅ Peak data written to {out}")
+    return df
@@ -0,0 +1,296 @@
+import argparse
+import hashlib
+import json
+from collections import namedtuple
+from pathlib import Path
+
+from sipm_analysis.loaders import load_spectra
+from sipm_analysis.metrics import RunMetrics
+from sipm_analysis.peaks import CROP_OFFSET_COLUMN, DEFAULT_PEAK_PARAMS, PEAK_TABLE_COLUMNS, analyze_spectra
+
+# ========================================
+# In-process pipeline: load -> crop -> peaks -> peak table -> slopes -> spacing
+# ========================================
+# Replaces running plot-fit-peaks-SiPM-data.py and the single-channel scripts
+# as separate interpreters that hand results to each other through CSV files.
+# Stages pass DataFrames/arrays in memory and only the `write` stage touches
+# disk. Outputs are cached per stage, keyed on the parameters the stage reads
+# and on its inputs, so re-running with a new sigma reuses the loaded spectra.
+
+repo_root = Path(__file__).resolve().parent.parent
+
+# crop_off_start / crop_off_end a run's Peak Index values are counted from, next to its tables
+CROP_FILE = 'crop.json'
+
+Stage = namedtuple('Stage', ['name', 'func', 'deps', 'params', 'cache'])
+
+DEFAULT_PARAMS = dict(
+    DEFAULT_PEAK_PARAMS,
+    crop_off_start='auto',  # "auto": from the populated bins of the run's spectra (sipm_analysis.roi)
+    crop_off_end='auto',
+    data_dir=str(repo_root / 'data-photon-counts-SiPM' / '20250428_more_light'),
+    results_dir=str(repo_root / 'results-from-generated-data'),
+    gain_voltages_to_plot=[],
+    pulse_voltages_to_plot=[],
+    manual_peak_indices=[],  # bins of the full spectrum, moved to the crop in peaks_stage
+    auto_params=False,  # estimate sigma/thresholds from each spectrum's peak spacing
+    excluded_peaks=[1, 9, 10, 11, 12],
+    table_formats=None,  # None -> SIPM_TABLE_FORMATS or parquet
+    store_results=True,  # also add the day's tables to the partitioned results store
+    trimmed_spectra=False,  # keep only the populated bins of each spectrum (.npz mirrors always are)
+    workers=1,  # processes for the peak finding (0 = number of CPUs), spectra shared, not copied
+)
+
+
+def _fingerprint(values):
+    blob = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class Pipeline:
+    def __init__(self, run_metrics=None):
+        self.stages = {}
+        self.run_metrics = run_metrics
+        self._cache = {}
+
+    def add(self, name, func, deps=(), params=(), cache=True):
+        """func(params, *dep_outputs) -> output. params lists the keys the stage reads."""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, func, tuple(deps), tuple(params), cache)
+        return self
+
+    def _order(self, targets):
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def run(self, params, targets=None):
+        """Run the stages needed for targets (default: all). Returns {stage name: output}."""
+        targets = targets or list(self.stages)
+        outputs, keys = {}, {}
+
+        for name in self._order(targets):
+            stage = self.stages[name]
+            stage_params = {key: params[key] for key in stage.params}
+            keys[name] = _fingerprint([name, stage_params, [keys[dep] for dep in stage.deps]])
+
+            if keys[name] in self._cache:
+                print(f"♻️ {name}: reusing cached output")
+                outputs[name] = self._cache[keys[name]]
+                continue
+
+            print(f"▶️ {name}")
+            dep_outputs = [outputs[dep] for dep in stage.deps]
+            if self.run_metrics is not None:
+                with self.run_metrics.stage(name):
+                    outputs[name] = stage.func(stage_params, *dep_outputs)
+            else:
+                outputs[name] = stage.func(stage_params, *dep_outputs)
+            if stage.cache:
+                self._cache[keys[name]] = outputs[name]
+
+        return outputs
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+# ========================================
+# SiPM single-channel stages
+# ========================================
+
+def load_stage(params):
+    return load_spectra(params['data_dir'], params['gain_voltages_to_plot'], params['pulse_voltages_to_plot'],
+                        trimmed=params['trimmed_spectra'])
+
+
+def crop_stage(params, spectra):
+    """(crop_off_start, crop_off_end) of the run, "auto" ones from the region of interest of all its spectra."""
+    from sipm_analysis.roi import is_auto, resolve_crop
+
+    crop = resolve_crop([spectrum.data for spectrum in spectra], params['crop_off_start'], params['crop_off_end'])
+    if is_auto(params['crop_off_start']) or is_auto(params['crop_off_end']):
+        print(f"[ROI] crop_off_start = {crop[0]}, crop_off_end = {crop[1]} for {len(spectra)} spectra")
+    return crop
+
+
+def peaks_stage(params, spectra, crop):
+    from sipm_analysis.peaks import manual_peaks_in_crop
+
+    crop_off_start, crop_off_end = crop
+    n_bins = min((len(spectrum.data) for spectrum in spectra), default=0) - crop_off_start - crop_off_end
+    manual_peaks = manual_peaks_in_crop(params['manual_peak_indices'], crop_off_start, n_bins)
+    if params['auto_params']:
+        return auto_peaks_stage(params, spectra, crop, manual_peaks)
+
+    if params['workers'] == 1:
+        analyzed = analyze_spectra(
+            [spectrum.data for spectrum in spectra], crop_off_start, crop_off_end,
+            params['sigma'], params['counts_threshold'], params['peak_spacing_threshold'], manual_peaks,
+            params['peak_method'])
+    else:
+        from sipm_analysis.shared import analyze_spectra_parallel
+
+        analyzed = analyze_spectra_parallel(
+            [spectrum.data for spectrum in spectra], crop_off_start, crop_off_end,
+            params['sigma'], params['counts_threshold'], params['peak_spacing_threshold'], manual_peaks,
+            params['peak_method'], workers=params['workers'])
+    return [(spectrum, smoothed, peaks) for spectrum, (smoothed, peaks) in zip(spectra, analyzed)]
+
+
+def auto_peaks_stage(params, spectra, crop, manual_peaks=None):
+    from sipm_analysis.autotune import analyze_spectrum_auto, estimate_spacings
+    from sipm_analysis.peaks import crop as crop_spectrum
+
+    crop_off_start, crop_off_end = crop
+    # One batched spacing estimate for all spectra, then the per-spectrum parameters
+    spacings = estimate_spacings([crop_spectrum(s.data, crop_off_start, crop_off_end) for s in spectra])
+    results = []
+    for spectrum, spacing in zip(spectra, spacings):
+        smoothed, peaks, auto = analyze_spectrum_auto(
+            spectrum.data, crop_off_start, crop_off_end, manual_peaks, spacing)
+        print(f"[AUTO] {spectrum.channel} | Gain = {spectrum.gain} V | Pulse = {spectrum.pulse} V | "
+              f"spacing = {auto.get('spacing', float('nan')):.1f}, sigma = {auto['sigma']:.2f}, "
+              f"counts_threshold = {auto['counts_threshold']:.0f}, "
+              f"peak_spacing_threshold = {auto['peak_spacing_threshold']}")
+        results.append((spectrum, smoothed, peaks))
+    return results
+
+
+def peak_table_stage(params, peak_results, crop):
+    """Same table plot-fit-peaks-SiPM-data.py writes to all_peaks_combined_sorted.csv."""
+    import pandas as pd
+
+    from sipm_analysis.peak_table import PeakTable
+
+    tables = []
+    for spectrum, smoothed, peaks in peak_results:
+        source = f"peak_data_{spectrum.channel}_gain_{spectrum.gain}V_pulse_{spectrum.pulse}V"
+        tables.append(PeakTable.from_peaks(peaks, smoothed, spectrum.channel, spectrum.gain, spectrum.pulse, source))
+    if not tables:
+        return pd.DataFrame(columns=PEAK_TABLE_COLUMNS + ['SourceFile', CROP_OFFSET_COLUMN])
+
+    # The crop goes with the rows, so a later day's crop can't shift them in the store
+    return PeakTable.concat(tables).sort().to_frame().assign(**{CROP_OFFSET_COLUMN: crop[0]})
+
+
+def slopes_stage(params, peak_table):
+    from sipm_analysis.slopes import compute_slopes
+
+    return compute_slopes(peak_table, Path(__file__).name, params['excluded_peaks'])
+
+
+def spacing_stage(params, slopes):
+    """Mean/std of Average Spacing per channel and gain, as in plot_spacing_between_peaks.py."""
+    summary_df, _ = slopes
+    return summary_df.groupby(['Channel', 'Gain Voltage (V)'])['Average Spacing'].agg(['mean', 'std']).reset_index()
+
+
+def fft_spacing_stage(params, spectra, crop):
+    """Peak-finding-free spacing of every spectrum, the cross-check for the fitted slopes."""
+    from sipm_analysis.fft_gain import fft_spacing_table
+
+    return fft_spacing_table(spectra, *crop)
+
+
+def write_stage(params, peak_table, slopes, spacing, fft_spacing, crop):
+    from sipm_analysis.fft_gain import compare_with_slopes
+    from sipm_analysis.tables import write_table
+
+    results_dir = Path(params['results_dir'])
+    summary_df, detailed_df = slopes
+
+    tables = {
+        'all_peaks_combined_sorted': peak_table,
+        'results_spacing_from_slope': summary_df,
+        'results_detailed_peak_data': detailed_df,
+        'results_mean_spacing_vs_gain': spacing,
+        'results_fft_spacing': compare_with_slopes(fft_spacing, summary_df),
+    }
+    written = []
+    for name, df in tables.items():
+        for out in write_table(df, results_dir / name, params['table_formats']):
+            print(f"✅ {out.name} written to {results_dir}")
+            written.append(out)
+    # Crop of this run, for tables read without their Crop Off Start column (the viewer falls back to it)
+    crop_file = results_dir / CROP_FILE
+    crop_file.write_text(json.dumps(dict(zip(('crop_off_start', 'crop_off_end'), crop))))
+    written.append(crop_file)
+
+    if params['store_results']:
+        from sipm_analysis.results_store import ResultsStore, acquisition_date
+
+        store = ResultsStore(results_dir / 'store')
+        date = acquisition_date(params['data_dir'])
+        store.append('peaks', peak_table, date)
+        store.append('slopes', summary_df, date)
+
+        from sipm_analysis.drift import check_store_drift
+
+        check_store_drift(store, excluded_peaks=params['excluded_peaks'])
+    return written
+
+
+def build_sipm_pipeline(run_metrics=None):
+    pipeline = Pipeline(run_metrics)
+    pipeline.add('load', load_stage, params=['data_dir', 'gain_voltages_to_plot', 'pulse_voltages_to_plot',
+                                             'trimmed_spectra'])
+    pipeline.add('crop', crop_stage, deps=['load'], params=['crop_off_start', 'crop_off_end'])
+    pipeline.add('peaks', peaks_stage, deps=['load', 'crop'],
+                 params=['sigma', 'counts_threshold',
+                         'peak_spacing_threshold', 'manual_peak_indices', 'auto_params', 'peak_method', 'workers'])
+    pipeline.add('peak_table', peak_table_stage, deps=['peaks', 'crop'])
+    pipeline.add('slopes', slopes_stage, deps=['peak_table'], params=['excluded_peaks'])
+    pipeline.add('spacing', spacing_stage, deps=['slopes'])
+    pipeline.add('fft_spacing', fft_spacing_stage, deps=['load', 'crop'])
+    # Always rewrite the artifacts, the files may have been moved/deleted since the last run
+    pipeline.add('write', write_stage, deps=['peak_table', 'slopes', 'spacing', 'fft_spacing', 'crop'], params=['results_dir', 'table_formats', 'store_results', 'data_dir', 'excluded_peaks'], cache=False)
+    return pipeline
+
+
+def load_params(config_file=None, **overrides):
+    params = dict(DEFAULT_PARAMS)
+    if config_file and Path(config_file).exists():
+        with open(config_file) as f:
+            params.update(json.load(f))
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    return params
+
+
+def run_pipeline(params, pipeline=None):
+    """Run every stage. Pass the same pipeline again to reuse its cached stage outputs."""
+    pipeline = pipeline or build_sipm_pipeline()
+    pipeline.run_metrics = RunMetrics('pipeline.py')
+    outputs = pipeline.run(params)
+    pipeline.run_metrics.print_summary()
+    pipeline.run_metrics.write_json(Path(params['results_dir']) / 'metrics')
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the single-channel SiPM analysis in one process.")
+    parser.add_argument('--config', default=str(repo_root / 'params_config.json'),
+                        help="JSON parameter file (same keys run_analysis_gui.py writes)")
+    parser.add_argument('--data-dir', help="override data_dir from the config")
+    parser.add_argument('--results-dir', help="override results_dir from the config")
+    parser.add_argument('--workers', type=int, help="processes for the peak finding (0 = number of CPUs)")
+    args = parser.parse_args()
+
+    params = load_params(args.config, data_dir=args.data_dir, results_dir=args.results_dir, workers=args.workers)
+    run_pipeline(params)
+
+
+if __name__ == '__main__':
+    main()
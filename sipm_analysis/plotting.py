@@ -0,0 +1,24 @@
+import numpy as np
+
+# ========================================
+# Shared matplotlib helpers
+# ========================================
+# These take an existing Axes, so matplotlib itself is only imported by the
+# script that creates the figure.
+
+pulse_color_map = {
+    1.0: 'black', 1.1: 'darkblue', 1.3: 'green',
+    1.6: 'orange', 2.0: 'deeppink', 2.3: 'red',
+}
+
+
+def draw_peaks(ax, x, smoothed_data, peaks, label, color, style, vertical_lines=False):
+    ax.plot(x, smoothed_data, label=label, alpha=0.8, color=color, linestyle=style, linewidth=2)
+    counts_at_peaks = smoothed_data[peaks]
+    errors = np.sqrt(counts_at_peaks)
+    ax.errorbar(x[peaks], counts_at_peaks, yerr=errors, fmt='o', color=color,
+                ecolor='gray', elinewidth=1, capsize=3, markersize=5, label=f"{label} Peaks")
+
+    if vertical_lines:
+        for p in peaks:
+            ax.axvline(x=p, color=color, linestyle='--', linewidth=1)
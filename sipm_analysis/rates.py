@@ -0,0 +1,250 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.listmode import DEFAULT_BLOCK_EVENTS, TIMETAG_SECONDS
+
+# ========================================
+# Event rates, dead time and pile-up from list-mode TIMETAGs
+# ========================================
+# analysis_single_dataset/test_data_plot_raw.py only plots TIMETAG vs ENERGY.
+# Here the time tags of each channel are reduced, block by block, to
+#   - events per time bin (rate vs time)
+#   - a histogram of the time between consecutive events (log bins)
+#   - a histogram of the instantaneous rate (k events / time they span)
+#   - events closer than the pile-up window to the previous one
+# so a multi-GB run needs one block (DEFAULT_BLOCK_EVENTS lines) of memory.
+#
+# Dead time (non-paralyzable model): after each recorded event the digitizer
+# is blind for tau, so the intervals are tau + an exponential with the true
+# rate. The true rate is the slope of the interval distribution above the
+# dead time, tau = 1 / measured rate - 1 / true rate and the live time is
+# real time x (1 - measured rate x tau). Divide counts by the live time
+# instead of the real time to compare counts per second between runs.
+#
+#   python -m sipm_analysis.rates DAQ/run/RAW/SDataR_run.csv
+
+RATE_SUMMARY_COLUMNS = [
+    'Channel', 'Events', 'Real Time (s)', 'Measured Rate (Hz)', 'True Rate (Hz)', 'Dead Time (ns)',
+    'Shortest Interval (ns)', 'Live Fraction', 'Live Time (s)', 'Median Instantaneous Rate (Hz)',
+    'Max Instantaneous Rate (Hz)', 'Pile-up Window (ns)', 'Pile-up Fraction', 'Expected Pile-up Fraction',
+    'Out Of Order Events'
+]
+RATE_VS_TIME_COLUMNS = ['Channel', 'Time (s)', 'Events', 'Rate (Hz)']
+INTERVAL_COLUMNS = ['Channel', 'Interval Low (ns)', 'Interval High (ns)', 'Count']
+
+PS_PER_NS = 1000
+DEFAULT_BIN_SECONDS = 1.0
+DEFAULT_PILEUP_WINDOW_NS = 200.0  # about the CoMPASS gate, set to yours
+DEFAULT_RATE_EVENTS = 100
+INTERVAL_EDGES_NS = np.logspace(-1, 10, 221)  # 0.1 ns .. 10 s, 20 bins per decade
+RATE_EDGES_HZ = np.logspace(-2, 9, 1101)  # 100 bins per decade, the median is read off this
+MIN_FIT_COUNTS = 20
+
+
+class _ChannelRates:
+    def __init__(self, rate_events):
+        self.first = None
+        self.last = None
+        self.events = 0
+        self.out_of_order = 0
+        self.pileup = 0
+        self.time_bins = np.zeros(0, dtype=np.int64)
+        self.intervals = np.zeros(len(INTERVAL_EDGES_NS) - 1, dtype=np.int64)
+        self.rates = np.zeros(len(RATE_EDGES_HZ) - 1, dtype=np.int64)
+        self.max_rate = 0.0
+        # Last rate_events time tags, so the k-event rate runs across block boundaries
+        self.tail = np.zeros(0, dtype=np.int64)
+
+
+class RateAnalyzer:
+    """Feed list-mode blocks with add(), read the tables with summary() / rate_vs_time() / intervals()."""
+
+    def __init__(self, bin_seconds=DEFAULT_BIN_SECONDS, pileup_window_ns=DEFAULT_PILEUP_WINDOW_NS,
+                 rate_events=DEFAULT_RATE_EVENTS):
+        self.bin_seconds = bin_seconds
+        self.bin_ps = int(round(bin_seconds / TIMETAG_SECONDS))
+        self.pileup_window_ns = pileup_window_ns
+        self.rate_events = rate_events
+        self.channels = {}
+
+    def add(self, channel, timetag):
+        """One block of events (CHANNEL numbers and TIMETAGs in ps, in the order of the file)."""
+        channel = np.asarray(channel)
+        timetag = np.asarray(timetag, dtype=np.int64)
+        for ch in np.unique(channel):
+            self._add_channel(int(ch), timetag[channel == ch])
+
+    def add_blocks(self, blocks):
+        for events in blocks:
+            self.add(events.channel, events.timetag)
+        return self
+
+    def _add_channel(self, ch, t):
+        state = self.channels.setdefault(ch, _ChannelRates(self.rate_events))
+        if len(t) == 0:
+            return
+        if state.first is None:
+            state.first = int(t[0])
+
+        # Time between consecutive events, including the one before this block
+        previous = np.r_[state.tail[-1:], t]
+        dt = np.diff(previous)
+        ordered = dt >= 0
+        state.out_of_order += int(np.count_nonzero(~ordered))
+        dt_ns = dt[ordered] / PS_PER_NS
+        state.intervals += np.histogram(dt_ns, INTERVAL_EDGES_NS)[0]
+        state.pileup += int(np.count_nonzero(dt_ns < self.pileup_window_ns))
+
+        # Rate vs time, the bin array grows with the run (not with the number of events)
+        bins = (t - state.first) // self.bin_ps
+        bins = bins[bins >= 0]
+        if len(bins):
+            counts = np.bincount(bins)
+            if len(counts) > len(state.time_bins):
+                state.time_bins = np.pad(state.time_bins, (0, len(counts) - len(state.time_bins)))
+            state.time_bins[:len(counts)] += counts
+
+        # Instantaneous rate: k events over the time they span
+        k = self.rate_events
+        joined = np.r_[state.tail, t]
+        if len(joined) > k:
+            span = (joined[k:] - joined[:-k]) * TIMETAG_SECONDS
+            rate = k / span[span > 0]
+            state.rates += np.histogram(rate, RATE_EDGES_HZ)[0]
+            if len(rate):
+                state.max_rate = max(state.max_rate, float(rate.max()))
+        state.tail = joined[-k:]
+
+        state.events += len(t)
+        state.last = int(t[-1]) if state.last is None else max(state.last, int(t[-1]))
+
+    def summary(self):
+        import pandas as pd
+
+        rows = [self._channel_summary(ch, state) for ch, state in sorted(self.channels.items())]
+        return pd.DataFrame(rows, columns=RATE_SUMMARY_COLUMNS)
+
+    def _channel_summary(self, ch, state):
+        real_time = (state.last - state.first) * TIMETAG_SECONDS if state.events > 1 else np.nan
+        measured = (state.events - 1) / real_time if state.events > 1 and real_time > 0 else np.nan
+        true_rate = interval_slope(state.intervals)
+        dead_time = 1 / measured - 1 / true_rate if np.isfinite(true_rate) else np.nan
+        # A slope below the measured rate is noise, not negative dead time
+        dead_time = max(dead_time, 0.0) if np.isfinite(dead_time) else np.nan
+        live_fraction = 1 - measured * dead_time if np.isfinite(dead_time) else 1.0
+        window_s = self.pileup_window_ns * 1e-9
+        return {
+            'Channel': f'CH{ch}',
+            'Events': state.events,
+            'Real Time (s)': real_time,
+            'Measured Rate (Hz)': measured,
+            'True Rate (Hz)': true_rate,
+            'Dead Time (ns)': dead_time * 1e9,
+            'Shortest Interval (ns)': _lowest_edge(state.intervals, INTERVAL_EDGES_NS),
+            'Live Fraction': live_fraction,
+            'Live Time (s)': real_time * live_fraction,
+            'Median Instantaneous Rate (Hz)': _histogram_median(state.rates, RATE_EDGES_HZ),
+            'Max Instantaneous Rate (Hz)': state.max_rate,
+            'Pile-up Window (ns)': self.pileup_window_ns,
+            'Pile-up Fraction': state.pileup / state.events,
+            # What a dead-time-free Poisson source at the true rate would give
+            'Expected Pile-up Fraction': 1 - np.exp(-(true_rate if np.isfinite(true_rate) else measured) * window_s),
+            'Out Of Order Events': state.out_of_order,
+        }
+
+    def rate_vs_time(self):
+        import pandas as pd
+
+        frames = []
+        for ch, state in sorted(self.channels.items()):
+            events = state.time_bins
+            frames.append(pd.DataFrame({
+                'Channel': f'CH{ch}', 'Time (s)': np.arange(len(events)) * self.bin_seconds,
+                'Events': events, 'Rate (Hz)': events / self.bin_seconds,
+            }))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RATE_VS_TIME_COLUMNS)
+
+    def intervals(self):
+        import pandas as pd
+
+        frames = [pd.DataFrame({
+            'Channel': f'CH{ch}', 'Interval Low (ns)': INTERVAL_EDGES_NS[:-1],
+            'Interval High (ns)': INTERVAL_EDGES_NS[1:], 'Count': state.intervals,
+        }) for ch, state in sorted(self.channels.items())]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=INTERVAL_COLUMNS)
+
+
+def _lowest_edge(counts, edges):
+    filled = np.flatnonzero(counts)
+    return float(edges[filled[0]]) if len(filled) else np.nan
+
+
+def _histogram_median(counts, edges):
+    if counts.sum() == 0:
+        return np.nan
+    k = int(np.searchsorted(np.cumsum(counts), counts.sum() / 2))
+    return float(np.sqrt(edges[k] * edges[k + 1]))
+
+
+def interval_slope(counts, edges_ns=INTERVAL_EDGES_NS, min_counts=MIN_FIT_COUNTS):
+    """True rate (Hz) from the exponential fall of the interval histogram (log bins, counts per bin)."""
+    if counts.sum() < 2 * min_counts:
+        return np.nan
+    centers = np.sqrt(edges_ns[:-1] * edges_ns[1:])
+    density = counts / np.diff(edges_ns)
+    # Fit between the most populated bin (above the dead time) and where the statistics run out
+    start = int(np.argmax(density))
+    use = np.arange(len(counts)) >= start
+    use &= counts >= min_counts
+    if np.count_nonzero(use) < 3:
+        return np.nan
+    # Poisson weights: sigma of log(density) is 1 / sqrt(counts)
+    slope, _ = np.polyfit(centers[use], np.log(density[use]), deg=1, w=np.sqrt(counts[use]))
+    return -slope * 1e9 if slope < 0 else np.nan
+
+
+def live_time_correction(counts_per_second, live_fraction):
+    """Counts per live second from counts per real second."""
+    return np.asarray(counts_per_second) / live_fraction
+
+
+def analyze_rates(paths, channels=None, block_events=DEFAULT_BLOCK_EVENTS, **analyzer_kwargs):
+    """RateAnalyzer over one or more list-mode files (in order, e.g. the parts of a split run)."""
+    from sipm_analysis.listmode import iter_list_mode_blocks
+
+    analyzer = RateAnalyzer(**analyzer_kwargs)
+    for path in [paths] if isinstance(paths, (str, Path)) else paths:
+        analyzer.add_blocks(iter_list_mode_blocks(path, block_events, channels))
+    return analyzer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rates, dead time and pile-up from CoMPASS list-mode files.")
+    parser.add_argument('paths', nargs='+', help="list-mode .csv files of one run (in time order)")
+    parser.add_argument('--channels', type=int, nargs='*', help="CHANNEL numbers (default: all)")
+    parser.add_argument('--bin-seconds', type=float, default=DEFAULT_BIN_SECONDS, help="rate vs time bin")
+    parser.add_argument('--pileup-window-ns', type=float, default=DEFAULT_PILEUP_WINDOW_NS)
+    parser.add_argument('--rate-events', type=int, default=DEFAULT_RATE_EVENTS,
+                        help="events per instantaneous rate")
+    parser.add_argument('--block-events', type=int, default=DEFAULT_BLOCK_EVENTS)
+    parser.add_argument('--output-dir', help="write rate_summary / rate_vs_time / interval_histogram tables here")
+    args = parser.parse_args()
+
+    analyzer = analyze_rates(args.paths, args.channels, args.block_events, bin_seconds=args.bin_seconds,
+                             pileup_window_ns=args.pileup_window_ns, rate_events=args.rate_events)
+    summary = analyzer.summary()
+    print(summary.T.to_string(header=False, float_format=lambda v: f"{v:.6g}"))
+    if args.output_dir:
+        from sipm_analysis.tables import write_table
+
+        output_dir = Path(args.output_dir)
+        write_table(summary, output_dir / 'rate_summary')
+        write_table(analyzer.rate_vs_time(), output_dir / 'rate_vs_time')
+        write_table(analyzer.intervals(), output_dir / 'interval_histogram')
+        print(f"✅ Rate tables written to {output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.plotting import pulse_color_map
+
+# ========================================
+# Multi-page PDF report of the single-channel summary plots
+# ========================================
+# python -m sipm_analysis.report  ->  results-from-generated-data/summary_report.pdf
+#
+# The same pages plot_index_vs_peak_slope_spacing_table.py (Peak Index vs Peak
+# Number per channel and gain) and plot_spacing_between_peaks.py (Average
+# Spacing vs Gain Voltage per channel) show one window at a time.
+#
+# Each kind of page has one template figure with its lines/texts created
+# once; a page only swaps the data of those artists (set_data) before it is
+# saved, instead of building a new figure. The page list is split over
+# worker processes that each write part of the PDF, the parts are joined with
+# pypdf (optional: pip install pypdf). Without pypdf (or with workers=1)
+# everything is written by this process, still reusing the templates, and a
+# [WARNING] says so when more workers were asked for.
+
+repo_root = Path(__file__).resolve().parent.parent
+default_results_dir = repo_root / 'results-from-generated-data'
+FONT_SIZE = 24
+
+
+# ========================================
+# Page data (plain arrays, cheap to send to the workers)
+# ========================================
+
+def index_vs_peak_pages(peak_df, excluded_peaks=()):
+    """One page per (channel, gain): Peak Index vs Peak Number of every pulse height."""
+    from sipm_analysis.slopes import iter_pulse_groups
+
+    pages = {}
+    for ch, gain, pulse, df_pulse in iter_pulse_groups(peak_df, excluded_peaks):
+        page = pages.setdefault((str(ch), float(gain)), {
+            'title': f'{ch} — Peak Index vs. Peak Number (Gain = {gain} V)', 'series': []})
+        page['series'].append((float(pulse), df_pulse['Peak Number'].to_numpy(float),
+                               df_pulse['Peak Index'].to_numpy(float)))
+    return [('index_vs_peak', pages[key]) for key in sorted(pages)]
+
+
+def spacing_vs_gain_pages(summary_df):
+    """One page per channel: mean ± std of Average Spacing vs Gain Voltage."""
+    pages = []
+    for ch in sorted(summary_df['Channel'].astype(str).unique()):
+        df_ch = summary_df[summary_df['Channel'].astype(str) == ch]
+        grouped = df_ch.groupby('Gain Voltage (V)')['Average Spacing'].agg(['mean', 'std']).reset_index()
+        pages.append(('spacing_vs_gain', {
+            'title': f'{ch} — Average Spacing vs. Gain Voltage', 'label': f'{ch} (mean ± std)',
+            'x': grouped['Gain Voltage (V)'].to_numpy(float),
+            'y': grouped['mean'].to_numpy(float),
+            'yerr': grouped['std'].fillna(0).to_numpy(float),
+        }))
+    return pages
+
+
+# ========================================
+# Figure templates
+# ========================================
+
+class IndexVsPeakPage:
+    def __init__(self):
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=(10, 6))
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlabel('Peak Number')
+        self.ax.set_ylabel('Peak Index')
+        self.ax.grid(True)
+        self.artists = {}
+        for pulse in pulse_color_map:
+            self._artists(pulse)
+
+    def _artists(self, pulse):
+        # Pulse heights outside pulse_color_map get their own (gray) artists the first time they show up
+        if pulse not in self.artists:
+            color = pulse_color_map.get(pulse, 'gray')
+            self.artists[pulse] = (
+                self.ax.plot([], [], marker='o', linestyle='-', color=color)[0],
+                self.ax.plot([], [], linestyle='--', color=color)[0],
+                self.ax.text(0, 0, '', fontsize=10, color=color, va='center'),
+            )
+        return self.artists[pulse]
+
+    def update(self, page):
+        for line, fit, text in self.artists.values():
+            line.set_visible(False), fit.set_visible(False), text.set_visible(False)
+
+        handles = []
+        x_max = 0
+        for pulse, x, y in page['series']:
+            line, fit, text = self._artists(pulse)
+            line.set_data(x, y)
+            line.set_label(f'{pulse}V pulse')
+            line.set_visible(True)
+            if len(x) >= 2:
+                coeffs = np.polyfit(x, y, deg=1)
+                x_fit = np.linspace(x.min(), x.max(), 300)
+                y_fit = np.polyval(coeffs, x_fit)
+                fit.set_data(x_fit, y_fit)
+                fit.set_label(f'{pulse}V fit')
+                fit.set_visible(True)
+                text.set_position((x_fit[-1] + 0.3, y_fit[-1]))
+                text.set_text(f'y = {coeffs[0]:.2f}x + {coeffs[1]:.1f}')
+                text.set_visible(True)
+                handles.append(fit)
+            handles.append(line)
+            x_max = max(x_max, x.max() if len(x) else 0)
+
+        self.ax.set_title(page['title'])
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+        # Room for the fit equations right of the last point
+        self.ax.set_xlim(right=x_max + 2.5)
+        self.ax.legend(handles=handles, title='Pulse Height')
+
+
+class SpacingVsGainPage:
+    def __init__(self):
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+        import matplotlib.ticker as ticker
+
+        self.fig = Figure(figsize=(10, 6))
+        self.ax = ax = self.fig.add_subplot()
+        self.points = ax.plot([], [], 'o-', color='black')[0]
+        self.errors = LineCollection([], colors='black')
+        ax.add_collection(self.errors)
+        self.caps = ax.plot([], [], '_', color='black', markersize=8)[0]
+        self.fit = ax.plot([], [], 'r--')[0]
+        self.fit_text = ax.text(0, 0, '', fontsize=16, color='red', ha='right', va='bottom')
+        self.labels = []
+        ax.set_xlabel('Gain Voltage (V)', fontsize=FONT_SIZE)
+        ax.set_ylabel('Average Spacing (Slope)', fontsize=FONT_SIZE)
+        ax.xaxis.set_major_formatter(ticker.FormatStrFormatter('%.1f'))
+        ax.tick_params(axis='x', labelsize=FONT_SIZE)
+        ax.tick_params(axis='y', labelsize=FONT_SIZE)
+        ax.grid(True)
+
+    def update(self, page):
+        x, y, yerr = page['x'], page['y'], page['yerr']
+        self.points.set_data(x, y)
+        self.points.set_label(page['label'])
+        self.errors.set_segments([[(xi, yi - e), (xi, yi + e)] for xi, yi, e in zip(x, y, yerr)])
+        self.caps.set_data(np.r_[x, x], np.r_[y - yerr, y + yerr])
+
+        # Value labels, the text pool only grows when a channel has more gains than any before
+        while len(self.labels) < len(x):
+            self.labels.append(self.ax.text(0, 0, '', fontsize=14, ha='center', va='bottom', color='black'))
+        for i, label in enumerate(self.labels):
+            if i < len(x):
+                is_last = i == len(x) - 1
+                label.set_position((x[i] - 0.015 if is_last else x[i] + 0.015, y[i] + 1))
+                label.set_text(f'{y[i]:.2f}')
+            label.set_visible(i < len(x))
+
+        handles = [self.points]
+        fits = len(np.unique(x)) >= 2
+        if fits:
+            coeffs = np.polyfit(x, y, deg=1)
+            x_fit = np.linspace(x.min(), x.max(), 300)
+            y_fit = np.polyval(coeffs, x_fit)
+            self.fit.set_data(x_fit, y_fit)
+            self.fit.set_label(f'Linear Fit: y = {coeffs[0]:.3f}x + {coeffs[1]:.2f}')
+            self.fit_text.set_position((x_fit[-1] - 0.15, y_fit[-1] - 1))
+            self.fit_text.set_text(f'y = {coeffs[0]:.3f}x + {coeffs[1]:.2f}')
+            handles.append(self.fit)
+        self.fit.set_visible(fits)
+        self.fit_text.set_visible(fits)
+
+        self.ax.set_title(page['title'], fontsize=FONT_SIZE)
+        self.ax.relim(visible_only=True)
+        self.ax.update_datalim(self.caps.get_xydata())
+        self.ax.autoscale_view()
+        self.ax.legend(handles=handles)
+
+
+TEMPLATES = {'index_vs_peak': IndexVsPeakPage, 'spacing_vs_gain': SpacingVsGainPage}
+
+
+# ========================================
+# Rendering
+# ========================================
+
+def render_pages(pages, pdf_path):
+    """Write pages into one PDF, one template figure per page kind. Returns pdf_path."""
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    templates = {}
+    with PdfPages(pdf_path) as pdf:
+        for kind, page in pages:
+            template = templates.get(kind)
+            if template is None:
+                template = templates[kind] = TEMPLATES[kind]()
+                template.update(page)
+                # Margins are worked out once per template, tight_layout on every page would draw it twice
+                template.fig.tight_layout()
+            else:
+                template.update(page)
+            pdf.savefig(template.fig)
+    return pdf_path
+
+
+def _render_part(args):
+    return render_pages(*args)
+
+
+def have_pypdf():
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_report(pages, pdf_path, workers=None, run_metrics=None):
+    """Render all pages into pdf_path, split over worker processes when pypdf can join the parts."""
+    pdf_path = Path(pdf_path)
+    pdf_path.parent.mkdir(parents=True, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, len(pages))
+
+    if workers > 1 and not have_pypdf():
+        print(f"[WARNING] pypdf is not installed, rendering the report in one process instead of {workers} "
+              f"(pip install pypdf to split it over the CPUs)")
+        workers = 1
+    stage = run_metrics.stage("render") if run_metrics is not None else nullcontext()
+    if workers <= 1:
+        with stage:
+            return render_pages(pages, pdf_path)
+
+    # Contiguous chunks so the joined PDF keeps the page order
+    bounds = np.linspace(0, len(pages), workers + 1).astype(int)
+    parts = [(pages[a:b], pdf_path.with_name(f"{pdf_path.stem}.part{i}.pdf"))
+             for i, (a, b) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+    from pypdf import PdfWriter
+
+    with stage, ProcessPoolExecutor(workers) as pool:
+        part_files = list(pool.map(_render_part, parts))
+
+    writer = PdfWriter()
+    for part in part_files:
+        writer.append(str(part))
+    with open(pdf_path, 'wb') as f:
+        writer.write(f)
+    for part in part_files:
+        Path(part).unlink()
+    return pdf_path
+
+
+def build_report(results_dir=None, pdf_path=None, workers=None, excluded_peaks=(1, 9, 10, 11, 12)):
+    """Summary report from the result tables in results_dir."""
+    from sipm_analysis.metrics import RunMetrics
+    from sipm_analysis.tables import read_table
+
+    results_dir = Path(results_dir) if results_dir else default_results_dir
+    pdf_path = Path(pdf_path) if pdf_path else results_dir / 'summary_report.pdf'
+    run_metrics = RunMetrics('report.py')
+
+    with run_metrics.stage("load"):
+        peak_df = read_table(results_dir / 'all_peaks_combined_sorted')
+        summary_df = read_table(results_dir / 'results_spacing_from_slope')
+    with run_metrics.stage("pages"):
+        pages = index_vs_peak_pages(peak_df, excluded_peaks) + spacing_vs_gain_pages(summary_df)
+    run_metrics.count("pages", len(pages))
+
+    write_report(pages, pdf_path, workers, run_metrics)
+    print(f"✅ {len(pages)} pages written to {pdf_path}")
+    run_metrics.print_summary()
+    run_metrics.write_json(results_dir / 'metrics')
+    return pdf_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-page PDF of the single-channel summary plots.")
+    parser.add_argument('--results-dir', default=str(default_results_dir))
+    parser.add_argument('--output', help="PDF file (default: <results-dir>/summary_report.pdf)")
+    parser.add_argument('--workers', type=int, help="processes (default: number of CPUs)")
+    parser.add_argument('--excluded-peaks', type=int, nargs='*', default=[1, 9, 10, 11, 12])
+    args = parser.parse_args()
+    build_report(args.results_dir, args.output, args.workers, args.excluded_peaks)
+
+
+if __name__ == '__main__':
+    main()
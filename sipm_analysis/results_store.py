@@ -0,0 +1,250 @@
+import argparse
+import json
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+# ========================================
+# Partitioned results store across acquisition days
+# ========================================
+# The per-run tables in results-from-generated-data/ only describe the one
+# data_dir that was processed last. The store keeps every day instead:
+#
+#   results-from-generated-data/store/<table>/date=20250428/channel=CH0/gain=65.7/part-*.parquet
+#
+# append() only writes the new partitions (and replaces everything stored for
+# the same day when a day is re-processed), scan() prunes whole directories on
+# date/channel/gain before reading any file. Rows without a channel or gain go
+# to channel=unknown / gain=nan instead of being dropped. Needs pyarrow.
+#
+# Every table keeps a manifest (_manifest.json) of its partitions: the part
+# files of each date=/channel=/gain= directory with their size and mtime.
+# append() updates it with what it wrote, so finding the days that changed
+# (the drift monitor) reads one small file instead of listing and stat-ing
+# every stored file. Files copied in by hand: rebuild it with
+#
+#   python -m sipm_analysis.results_store rescan peaks
+
+repo_root = Path(__file__).resolve().parent.parent
+default_store_dir = repo_root / 'results-from-generated-data' / 'store'
+
+PARTITION_KEYS = ['date', 'channel', 'gain']
+MANIFEST_FILE = '_manifest.json'
+TABLES = ('peaks', 'slopes', 'coincidence', 'drift')
+
+# Where each table keeps its channel and gain, the values become the partition keys
+SOURCE_COLUMNS = {
+    'channel': ['Channel', 'channel', 'Channel (from filename)'],
+    'gain': ['Voltage Gain (V)', 'Gain Voltage (V)', 'gain_voltage', 'Gain Voltage (from filename)'],
+}
+
+
+def acquisition_date(data_dir):
+    """YYYYMMDD from a data folder like data-photon-counts-SiPM/20250428_more_light."""
+    for part in reversed(Path(data_dir).parts):
+        match = re.match(r"(\d{8})", part)
+        if match:
+            return match.group(1)
+    return 'unknown'
+
+
+def _partition_schema():
+    import pyarrow as pa
+
+    return pa.schema([('date', pa.string()), ('channel', pa.string()), ('gain', pa.float64())])
+
+
+def _source_column(df, key):
+    column = next((name for name in SOURCE_COLUMNS[key] if name in df.columns), None)
+    if column is None:
+        raise KeyError(f"No {key} column in table (looked for {SOURCE_COLUMNS[key]})")
+    return column
+
+
+def _channel_label(value):
+    import pandas as pd
+
+    if pd.isna(value):
+        return 'unknown'
+    value = str(value)
+    return value if value.startswith('CH') else f"CH{value}"
+
+
+class ResultsStore:
+    def __init__(self, root=None):
+        self.root = Path(root) if root else default_store_dir
+
+    def partition_dir(self, table, date, channel, gain):
+        return self.root / table / f"date={date}" / f"channel={channel}" / f"gain={float(gain)}"
+
+    def _manifest_path(self, table):
+        return self.root / table / MANIFEST_FILE
+
+    def _write_manifest(self, table, manifest):
+        path = self._manifest_path(table)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        tmp.replace(path)
+
+    def rescan(self, table):
+        """Rebuild the manifest of a table from the files on disk. Returns it."""
+        manifest = {}
+        for f in sorted((self.root / table).glob('date=*/channel=*/gain=*/part-*.parquet')):
+            stat = f.stat()
+            manifest.setdefault(f.parent.relative_to(self.root / table).as_posix(), {})[f.name] = \
+                [stat.st_size, stat.st_mtime_ns]
+        if manifest or self._manifest_path(table).exists():
+            self._write_manifest(table, manifest)
+        return manifest
+
+    def manifest(self, table):
+        """{"date=../channel=../gain=..": {part file: [size, mtime_ns]}} of every stored partition.
+
+        Kept up to date by append(); built from the files once for a store written before it existed.
+        """
+        path = self._manifest_path(table)
+        if not path.exists():
+            return self.rescan(table)
+        with open(path) as f:
+            return json.load(f)
+
+    def append(self, table, df, date, replace=True):
+        """Add one day's rows of a result table. Returns the files written."""
+        from sipm_analysis.tables import typed_columns
+
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}', expected one of {TABLES}")
+        if df.empty:
+            return []
+
+        channel_col = _source_column(df, 'channel')
+        gain_col = _source_column(df, 'gain')
+        df = typed_columns(df)
+        channels = df[channel_col].map(_channel_label)
+        gains = df[gain_col].astype(float)
+        run_tag = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+
+        manifest = self.manifest(table)
+        date_dir = self.root / table / f"date={date}"
+        if replace and date_dir.exists():
+            # Re-processing a day replaces all of it, also channels / gains the new rows don't have
+            shutil.rmtree(date_dir)
+            manifest = {key: files for key, files in manifest.items() if not key.startswith(f"date={date}/")}
+
+        written = []
+        # dropna=False: a missing gain becomes the gain=nan partition
+        for (channel, gain), part in df.groupby([channels, gains], observed=True, dropna=False):
+            out_dir = self.partition_dir(table, date, channel, gain)
+            out_dir.mkdir(parents=True, exist_ok=True)
+
+            # The partition keys live in the path, don't store a second copy
+            part = part.drop(columns=[c for c in PARTITION_KEYS if c in part.columns])
+            out = out_dir / f"part-{run_tag}.parquet"
+            part.to_parquet(out, index=False)
+            written.append(out)
+            stat = out.stat()
+            manifest.setdefault(out_dir.relative_to(self.root / table).as_posix(), {})[out.name] = \
+                [stat.st_size, stat.st_mtime_ns]
+        self._write_manifest(table, manifest)
+
+        print(f"✅ {table}: {len(df)} rows for {date} appended to {self.root / table}")
+        return written
+
+    def dataset(self, table):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+
+        # Columns added later (e.g. Crop Off Start) are only in newer days' files, so
+        # take the union of all of them rather than the schema of the first file
+        files = sorted((self.root / table).glob('date=*/channel=*/gain=*/part-*.parquet'))
+        schema = pa.unify_schemas([pq.read_schema(f) for f in files] + [_partition_schema()]) if files else None
+        return ds.dataset(self.root / table, format='parquet', schema=schema,
+                          partitioning=ds.partitioning(_partition_schema(), flavor='hive'))
+
+    def scan(self, table, columns=None, date=None, channel=None, gain=None, date_from=None, date_to=None):
+        """Rows of a table across all stored days, filtered on the partition keys."""
+        import pyarrow.dataset as ds
+
+        if not (self.root / table).exists():
+            raise FileNotFoundError(f"❌ Nothing stored yet for table '{table}' in {self.root}")
+
+        conditions = []
+        for key, value in (('date', date), ('channel', channel), ('gain', gain)):
+            if value is not None:
+                values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+                if key == 'gain':
+                    values = [float(v) for v in values]
+                conditions.append(ds.field(key).isin(values))
+        if date_from is not None:
+            conditions.append(ds.field('date') >= str(date_from))
+        if date_to is not None:
+            conditions.append(ds.field('date') <= str(date_to))
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return self.dataset(table).to_table(columns=columns, filter=expression).to_pandas()
+
+    def partitions(self, table):
+        """(date, channel, gain) of every stored partition, from the manifest without reading any data."""
+        return [partition_keys(key) for key in sorted(self.manifest(table))]
+
+
+def partition_keys(key):
+    """(date, channel, gain) of a manifest key "date=../channel=../gain=.."."""
+    date, channel, gain = (p.split('=', 1)[1] for p in key.split('/'))
+    return date, channel, float(gain)
+
+
+# ========================================
+# Backfill / inspection from the command line
+# ========================================
+
+def ingest_days(data_dirs, store=None, **param_overrides):
+    """Run the single-channel pipeline for each day folder and store its tables."""
+    from sipm_analysis.pipeline import build_sipm_pipeline, load_params
+
+    store = store or ResultsStore()
+    pipeline = build_sipm_pipeline()
+    for data_dir in data_dirs:
+        print(f"\n=== {data_dir} ===")
+        params = load_params(None, data_dir=str(data_dir), **param_overrides)
+        outputs = pipeline.run(params, targets=['peak_table', 'slopes'])
+        date = acquisition_date(data_dir)
+        store.append('peaks', outputs['peak_table'], date)
+        store.append('slopes', outputs['slopes'][0], date)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitioned store of peak/slope/coincidence results.")
+    parser.add_argument('--store', default=str(default_store_dir))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    ingest = sub.add_parser('ingest', help="process day folders and add them to the store")
+    ingest.add_argument('data_dirs', nargs='+')
+
+    show = sub.add_parser('list', help="list stored partitions")
+    show.add_argument('table', choices=TABLES)
+
+    rescan = sub.add_parser('rescan', help="rebuild a table's manifest from the files (after copying some in)")
+    rescan.add_argument('table', choices=TABLES)
+
+    args = parser.parse_args()
+    store = ResultsStore(args.store)
+    if args.command == 'ingest':
+        ingest_days(args.data_dirs, store)
+    elif args.command == 'rescan':
+        manifest = store.rescan(args.table)
+        print(f"✅ {args.table}: manifest of {len(manifest)} partitions written")
+    else:
+        for date, channel, gain in store.partitions(args.table):
+            print(f"{date}  {channel}  {gain} V")
+
+
+if __name__ == '__main__':
+    main()
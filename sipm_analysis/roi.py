@@ -0,0 +1,98 @@
+import numpy as np
+
+from sipm_analysis.trimmed import TrimmedSpectrum
+
+# ========================================
+# Automatic crop: the region of interest of a spectrum (or a whole run)
+# ========================================
+# crop_off_start / crop_off_end were tuned by hand per dataset (100/3000,
+# 200/3250, 600/3100, ...) to skip the empty digitizer bins. Set either of
+# them to "auto" and it is taken from the spectra instead:
+#
+#   - every spectrum is averaged over ROI_WINDOW bins (all spectra in one
+#     padded 2D stack, so a whole run is one vectorized pass)
+#   - a bin is significant when that average is at least ROI_MIN_COUNTS and
+#     ROI_FRACTION of the spectrum's highest average, so lone counts far out
+#     in the tail don't stretch the range
+#   - the region starts at the first significant bin (the rising edge of the
+#     pedestal) and ends after the last one, ROI_MARGIN bins wider each side
+#
+# resolve_crop() turns "auto" into the crop_off_start / crop_off_end that keep
+# the regions of all given spectra, so every spectrum of a run is cropped the
+# same way and Peak Index means the same bin in all of them.
+
+AUTO_CROP = "auto"
+ROI_WINDOW = 15  # bins averaged before judging a bin
+ROI_MIN_COUNTS = 1.0  # averaged counts a significant bin needs at least ...
+ROI_FRACTION = 1e-3  # ... and this fraction of the spectrum's highest averaged bin
+ROI_MARGIN = 32  # bins kept beyond the first / last significant one
+
+
+def is_auto(value):
+    return isinstance(value, str) and value.strip().lower() == AUTO_CROP
+
+
+def _stack(datas):
+    """Counts of every spectrum as rows of one zero padded 2D array, plus each row's offset and full length."""
+    rows, offsets, lengths = [], [], []
+    for data in datas:
+        if isinstance(data, TrimmedSpectrum):
+            rows.append(np.asarray(data.counts, dtype=float))
+            offsets.append(data.offset)
+        else:
+            rows.append(np.asarray(data, dtype=float))
+            offsets.append(0)
+        lengths.append(len(data))
+    stack = np.zeros((len(rows), max((len(row) for row in rows), default=0)))
+    for i, row in enumerate(rows):
+        stack[i, :len(row)] = row
+    return stack, np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+
+def detect_rois(datas, window=ROI_WINDOW, min_counts=ROI_MIN_COUNTS, fraction=ROI_FRACTION, margin=ROI_MARGIN):
+    """(starts, stops): region of interest of every spectrum, bins start..stop-1 of the full spectrum.
+
+    A spectrum without a significant bin keeps all of its bins.
+    """
+    starts, stops, _ = _rois(datas, window, min_counts, fraction, margin)
+    return starts, stops
+
+
+def _rois(datas, window, min_counts, fraction, margin):
+    """detect_rois plus which spectra have a significant bin at all."""
+    from scipy.ndimage import uniform_filter1d
+
+    stack, offsets, lengths = _stack(datas)
+    if stack.size == 0:
+        return np.zeros(len(lengths), dtype=np.int64), lengths, np.zeros(len(lengths), dtype=bool)
+    averaged = uniform_filter1d(stack, window, axis=1, mode='constant')
+    level = np.maximum(min_counts, fraction * averaged.max(axis=1, keepdims=True))
+    significant = averaged >= level
+    found = significant.any(axis=1)
+    first = np.argmax(significant, axis=1)
+    last = stack.shape[1] - 1 - np.argmax(significant[:, ::-1], axis=1)
+    starts = np.where(found, np.maximum(offsets + first - margin, 0), 0)
+    stops = np.where(found, np.minimum(offsets + last + 1 + margin, lengths), lengths)
+    return starts, stops, found
+
+
+def resolve_crop(datas, crop_off_start, crop_off_end, window=ROI_WINDOW, min_counts=ROI_MIN_COUNTS,
+                 fraction=ROI_FRACTION, margin=ROI_MARGIN):
+    """(crop_off_start, crop_off_end) for peaks.crop, the "auto" ones keeping the regions of all datas.
+
+    Numbers are returned as they are. Spectra without a significant bin (e.g. an
+    empty coincidence cell) don't widen the crop; if none has one nothing is cropped.
+    """
+    if not (is_auto(crop_off_start) or is_auto(crop_off_end)):
+        return crop_off_start, crop_off_end
+    datas = list(datas)
+    starts, stops, found = _rois(datas, window, min_counts, fraction, margin)
+    if not found.any():
+        return (0 if is_auto(crop_off_start) else crop_off_start), (0 if is_auto(crop_off_end) else crop_off_end)
+    lengths = np.array([len(data) for data in datas])[found]
+    starts, stops = starts[found], stops[found]
+    if is_auto(crop_off_start):
+        crop_off_start = int(starts.min())
+    if is_auto(crop_off_end):
+        crop_off_end = int((lengths - stops).min())
+    return crop_off_start, crop_off_end
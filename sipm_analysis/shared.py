@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS
+
+# ========================================
+# Shared-memory arrays for worker pools
+# ========================================
+# A process pool pickles every argument and result, so handing it a stack of
+# spectra or a run's time tags copies all of it into every job. Here the
+# arrays live in multiprocessing.shared_memory blocks instead: a job only
+# carries the block names (SharedArray.spec) and the rows / index range to
+# work on, workers attach once (pool initializer) and get numpy views of the
+# same memory, and they write their results into output blocks the parent
+# allocated, so nothing but the names crosses the process boundary.
+#
+#   - SharedArray:     one numpy array in a shared block, create / attach / release
+#   - SpectrumStack:   spectra of different lengths as rows of one padded 2D block
+#   - share_arrays:    several arrays (e.g. CH0 / CH1 time tags) at once
+#   - analyze_spectra_parallel: peaks.analyze_spectra over a worker pool, with the
+#     smoothed spectra and peak indices written into shared output stacks
+#
+# The owner (the process that created a block) frees it with release(); use
+# the objects as context managers so that also happens on errors.
+
+
+class SharedArray:
+    """A numpy array in a shared memory block. .array is the view, .spec is what workers need to attach."""
+
+    def __init__(self, shm, shape, dtype, owner):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, shape, dtype, fill=None):
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        shared = cls(shared_memory.SharedMemory(create=True, size=size), shape, dtype, owner=True)
+        if fill is not None:
+            shared.array[...] = fill
+        return shared
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.ascontiguousarray(array)
+        shared = cls.create(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, owner=False)
+
+    @property
+    def spec(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    def release(self):
+        """Drop the view and close the block (and free it, in the owner)."""
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SpectrumStack:
+    """Spectra as rows of one shared 2D array, zero padded to the longest; row(i) is spectrum i."""
+
+    def __init__(self, values, lengths):
+        self.values = values
+        self.lengths = lengths
+
+    @classmethod
+    def create(cls, lengths, dtype=np.float64, width=None):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if width is None:
+            width = int(lengths.max()) if len(lengths) else 0
+        return cls(SharedArray.create((len(lengths), width), dtype, fill=0), SharedArray.from_array(lengths))
+
+    @classmethod
+    def from_spectra(cls, datas):
+        datas = [np.asarray(data) for data in datas]
+        dtype = np.result_type(*datas) if datas else np.float64
+        stack = cls.create([len(data) for data in datas], dtype)
+        for i, data in enumerate(datas):
+            stack.values.array[i, :len(data)] = data
+        return stack
+
+    @classmethod
+    def attach(cls, spec):
+        values, lengths = spec
+        return cls(SharedArray.attach(values), SharedArray.attach(lengths))
+
+    @property
+    def spec(self):
+        return self.values.spec, self.lengths.spec
+
+    def __len__(self):
+        return len(self.lengths.array)
+
+    def row(self, i):
+        """View (no copy) of spectrum i."""
+        return self.values.array[i, :self.lengths.array[i]]
+
+    def release(self):
+        self.values.release()
+        self.lengths.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def share_arrays(*arrays):
+    """SharedArray copies of several arrays, e.g. share_arrays(t0, t1)."""
+    return [SharedArray.from_array(array) for array in arrays]
+
+
+# Blocks a worker attached to in the pool initializer, by name, so each is attached once per process
+_attached = {}
+
+
+def attach_in_worker(specs):
+    """Pool initializer: attach every SharedArray / SpectrumStack spec in the dict specs."""
+    for key, spec in specs.items():
+        _attached[key] = (SpectrumStack if isinstance(spec[0], tuple) else SharedArray).attach(spec)
+
+
+def attached(key):
+    return _attached[key]
+
+
+def _analyze_rows(job):
+    from sipm_analysis.peaks import analyze_spectra
+
+    rows, kwargs = job
+    spectra, smoothed, peaks = attached('spectra'), attached('smoothed'), attached('peaks')
+    n_peaks = attached('n_peaks').array
+    results = analyze_spectra([spectra.row(i) for i in rows], **kwargs)
+    for i, (smooth, found) in zip(rows, results):
+        smoothed.values.array[i, :len(smooth)] = smooth
+        smoothed.lengths.array[i] = len(smooth)
+        peaks.array[i, :len(found)] = found
+        n_peaks[i] = len(found)
+
+
+def analyze_spectra_parallel(datas, crop_off_start=DEFAULT_PEAK_PARAMS["crop_off_start"],
+                             crop_off_end=DEFAULT_PEAK_PARAMS["crop_off_end"],
+                             sigma=DEFAULT_PEAK_PARAMS["sigma"],
+                             counts_threshold=DEFAULT_PEAK_PARAMS["counts_threshold"],
+                             peak_spacing_threshold=DEFAULT_PEAK_PARAMS["peak_spacing_threshold"],
+                             manual_peaks=None, method=DEFAULT_PEAK_PARAMS["peak_method"], workers=None):
+    """peaks.analyze_spectra on a process pool over shared memory. Same [(smoothed_data, peaks), ...]."""
+    from sipm_analysis.peaks import analyze_spectra
+    from sipm_analysis.roi import resolve_crop
+
+    # Resolved over all spectra here, each job would only see its own rows
+    crop_off_start, crop_off_end = resolve_crop(datas, crop_off_start, crop_off_end)
+    kwargs = dict(crop_off_start=crop_off_start, crop_off_end=crop_off_end, sigma=sigma,
+                  counts_threshold=counts_threshold, peak_spacing_threshold=peak_spacing_threshold,
+                  manual_peaks=manual_peaks, method=method)
+    workers = min(workers or os.cpu_count() or 1, len(datas))
+    if workers <= 1:
+        return analyze_spectra(datas, **kwargs)
+
+    with SpectrumStack.from_spectra(datas) as spectra:
+        # A spectrum can't have more peaks than bins, so its cropped length bounds both outputs
+        width = spectra.values.shape[1]
+        with SpectrumStack.create(np.zeros(len(datas)), spectra.values.dtype, width) as smoothed, \
+                SharedArray.create((len(datas), width), np.intp) as peaks, \
+                SharedArray.create((len(datas),), np.int64) as n_peaks:
+            specs = {'spectra': spectra.spec, 'smoothed': smoothed.spec, 'peaks': peaks.spec,
+                     'n_peaks': n_peaks.spec}
+            # Contiguous rows per job: baseline / cwt batch the spectra of one call
+            jobs = [(rows, kwargs) for rows in np.array_split(np.arange(len(datas)), workers) if len(rows)]
+            with ProcessPoolExecutor(workers, initializer=attach_in_worker, initargs=(specs,)) as pool:
+                list(pool.map(_analyze_rows, jobs))
+            return [(smoothed.row(i).copy(), peaks.array[i, :n_peaks.array[i]].copy()) for i in range(len(datas))]
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import numpy as np
+
+# ========================================
+# Peak Index vs Peak Number slope (= peak spacing) analysis
+# ========================================
+
+SUMMARY_COLUMNS = [
+    'Timestamp', 'Channel', 'Pulse Height (V)', 'Gain Voltage (V)',
+    'State', 'Num Slopes Calculated', 'Average Spacing', 'Standard Deviation',
+    'Fitted Slope', 'Source Files', 'Generated By'
+]
+DETAILED_COLUMNS = [
+    'Timestamp', 'Channel', 'Pulse Height (V)', 'Gain Voltage (V)',
+    'Peak Number', 'Peak Index', 'Peak Counts',
+    'State', 'Num Slopes Calculated', 'Average Spacing', 'Standard Deviation',
+    'Fitted Slope', 'Source File', 'Generated By'
+]
+
+
+def iter_pulse_groups(df, excluded_peaks=()):
+    """Yield (channel, gain, pulse, df_pulse) sorted the same way the plots are."""
+    for ch in df['Channel'].unique():
+        df_ch = df[df['Channel'] == ch]
+        for gain in sorted(df_ch['Voltage Gain (V)'].unique()):
+            df_gain = df_ch[df_ch['Voltage Gain (V)'] == gain]
+            for pulse_height in sorted(df_gain['Pulse Voltage (V)'].unique()):
+                df_pulse = df_gain[df_gain['Pulse Voltage (V)'] == pulse_height]
+                df_pulse = df_pulse[~df_pulse['Peak Number'].isin(excluded_peaks)]
+                yield ch, gain, pulse_height, df_pulse.sort_values('Peak Number')
+
+
+def fit_spacing(peak_numbers, peak_indices):
+    """Returns (slopes between neighbours, fitted slope, fitted intercept)."""
+    slopes = np.diff(peak_indices) / np.diff(peak_numbers)
+    fitted_slope, intercept = np.polyfit(peak_numbers, peak_indices, deg=1)
+    return slopes, fitted_slope, intercept
+
+
+def compute_slopes(df, script_name, excluded_peaks=()):
+    """Slope analysis of a combined peak table (DataFrame or PeakTable). Returns (summary_df, detailed_df)."""
+    import pandas as pd
+    from sipm_analysis.peak_table import PeakTable
+
+    # Groups are slices of one typed array instead of a filtered DataFrame each
+    table = df if isinstance(df, PeakTable) else PeakTable.from_frame(df, source_column='Source File')
+    summary_rows = []
+    detailed_rows = []
+    for ch, gain, pulse_height, group in table.groups(excluded_peaks):
+        if len(group) < 2:
+            continue
+
+        state = group.labels('state')[0] if table.has('state') else 'unknown'
+        unique_sources = (list(dict.fromkeys(s for s in group.labels('source') if s is not None))
+                          if table.has('source') else ['unknown'])
+        source_files_str = "; ".join(unique_sources)
+
+        x = group.rows['peak_number'].astype(np.int64)
+        y = group.rows['peak_index'].astype(np.int64)
+        counts = group.rows['peak_counts'].astype(np.float64)
+
+        slopes, fitted_slope, _ = fit_spacing(x, y)
+        num_slopes = len(slopes)
+        avg_slope = np.mean(slopes)
+        slope_std = np.std(slopes)
+
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        summary_rows.append([
+            timestamp, ch, pulse_height, gain,
+            state, num_slopes, avg_slope, slope_std,
+            fitted_slope, source_files_str, script_name
+        ])
+        for i in range(len(group)):
+            detailed_rows.append([
+                timestamp, ch, pulse_height, gain,
+                x[i], y[i], counts[i],
+                state, num_slopes, avg_slope, slope_std,
+                fitted_slope, source_files_str, script_name
+            ])
+
+    return (pd.DataFrame(summary_rows, columns=SUMMARY_COLUMNS),
+            pd.DataFrame(detailed_rows, columns=DETAILED_COLUMNS))
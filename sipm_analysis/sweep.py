@@ -0,0 +1,221 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS, PEAK_METHODS
+
+# ========================================
+# Peak-finder parameter sweeps over all spectra of a day
+# ========================================
+# params_config.json / the GUI run one (sigma, counts_threshold,
+# peak_spacing_threshold) at a time. This runs a whole grid of them on every
+# spectrum and tabulates what each setting finds, to pick settings that give
+# the same peaks over a range of values instead of ones that happen to work:
+#
+#   python -m sipm_analysis.sweep data-photon-counts-SiPM/20250428_more_light \
+#       --sigma 2 3 3.6 4.5 --counts-threshold 50 100 200 --peak-spacing-threshold 12 16 20
+#
+# The spectra are loaded and cropped once (crop "auto" by default, see
+# sipm_analysis.roi) and put in shared memory (sipm_analysis.shared). A job is
+# one sigma and a block of spectra: it smooths them once and then finds the
+# peaks for every (counts_threshold, peak_spacing_threshold) on the same
+# smoothed arrays. Jobs run on a process pool.
+#
+#   peak_param_sweep:          one row per setting and spectrum (number of peaks, their
+#                              indices, median spacing)
+#   peak_param_sweep_summary:  one row per setting; Spectra at Modal Count is the share
+#                              of spectra whose number of peaks is the one they get most
+#                              often over the grid (100 % = no spectrum depends on this setting)
+
+repo_root = Path(__file__).resolve().parent.parent
+
+SETTING_COLUMNS = ['Peak Method', 'Sigma', 'Counts Threshold', 'Peak Spacing Threshold']
+SWEEP_COLUMNS = SETTING_COLUMNS + [
+    'Channel', 'Voltage Gain (V)', 'Pulse Voltage (V)', 'Peaks Found', 'Median Spacing', 'Peak Indices',
+    'Source File'
+]
+SWEEP_SUMMARY_COLUMNS = SETTING_COLUMNS + [
+    'Spectra', 'Total Peaks', 'Min Peaks', 'Max Peaks', 'Spectra at Modal Count (%)', 'Median Spacing'
+]
+
+DEFAULT_SIGMAS = (2.0, 3.0, 3.6, 4.5)
+DEFAULT_COUNTS_THRESHOLDS = (50, 100, 200)
+DEFAULT_SPACING_THRESHOLDS = (12, 16, 20)
+
+
+def _sweep_block(cropped, sigma, method, grid):
+    """[(row, counts_threshold, peak_spacing_threshold, peaks), ...] of cropped spectra, smoothed once."""
+    from sipm_analysis.peaks import find_spectrum_peaks, smooth_data
+
+    # cwt works on the counts, nothing to smooth
+    smoothed = cropped if method == 'cwt' else [smooth_data(data, sigma=sigma) for data in cropped]
+    results = []
+    for counts_threshold, peak_spacing_threshold in grid:
+        if method == 'threshold':
+            found = [find_spectrum_peaks(s, counts_threshold, peak_spacing_threshold) for s in smoothed]
+        elif method == 'baseline':
+            from sipm_analysis.baseline import baseline_peaks_many
+
+            found = baseline_peaks_many(smoothed, peak_spacing_threshold, counts_threshold, sigma)
+        else:
+            from sipm_analysis.cwt import cwt_peaks_many
+
+            found = cwt_peaks_many(cropped, peak_spacing_threshold, counts_threshold)
+        results.extend((row, counts_threshold, peak_spacing_threshold, peaks)
+                       for row, peaks in enumerate(found))
+    return results
+
+
+def _sweep_job(job):
+    from sipm_analysis.shared import attached
+
+    rows, sigma, method, grid = job
+    spectra = attached('spectra')
+    results = _sweep_block([spectra.row(i) for i in rows], sigma, method, grid)
+    return [(rows[row], sigma, counts_threshold, spacing, peaks)
+            for row, counts_threshold, spacing, peaks in results]
+
+
+def sweep_peaks(cropped, sigmas, counts_thresholds, peak_spacing_thresholds, method='threshold', workers=None):
+    """Peaks of every cropped spectrum for every setting of the grid.
+
+    Returns [(spectrum index, sigma, counts_threshold, peak_spacing_threshold, peaks), ...],
+    the same peaks peaks.analyze_spectra gives for that setting.
+    """
+    if method not in PEAK_METHODS:
+        raise ValueError(f"Unknown peak_method '{method}', expected one of {PEAK_METHODS}")
+    cropped = [np.asarray(data, dtype=float) for data in cropped]
+    if method == 'cwt' and len(sigmas) > 1:
+        # The wavelets don't use sigma: one pass, the same peaks for every sigma
+        first = sweep_peaks(cropped, sigmas[:1], counts_thresholds, peak_spacing_thresholds, method, workers)
+        return [(row, sigma, counts_threshold, spacing, peaks)
+                for sigma in sigmas for row, _, counts_threshold, spacing, peaks in first]
+    grid = list(itertools.product(counts_thresholds, peak_spacing_thresholds))
+    workers = min(workers or os.cpu_count() or 1, len(sigmas) * len(cropped))
+    if workers <= 1:
+        return [(row, sigma, counts_threshold, spacing, peaks)
+                for sigma in sigmas
+                for row, counts_threshold, spacing, peaks in _sweep_block(cropped, sigma, method, grid)]
+
+    from sipm_analysis.shared import SpectrumStack, attach_in_worker
+
+    # Blocks of spectra per sigma so that a short sigma list still fills the pool. baseline
+    # shares the opening width between the spectra of one call, so it gets all of them at once
+    n_blocks = 1 if method == 'baseline' else min(-(-workers // len(sigmas)), len(cropped))
+    blocks = [rows for rows in np.array_split(np.arange(len(cropped)), n_blocks) if len(rows)]
+    jobs = [(rows, sigma, method, grid) for sigma in sigmas for rows in blocks]
+    with SpectrumStack.from_spectra(cropped) as spectra:
+        specs = {'spectra': spectra.spec}
+        with ProcessPoolExecutor(workers, initializer=attach_in_worker, initargs=(specs,)) as pool:
+            results = [result for chunk in pool.map(_sweep_job, jobs) for result in chunk]
+    # Same order as one process: sigma, then the grid, then the spectra
+    order = {sigma: i for i, sigma in enumerate(sigmas)}
+    position = {setting: i for i, setting in enumerate(grid)}
+    return sorted(results, key=lambda r: (order[r[1]], position[(r[2], r[3])], r[0]))
+
+
+def sweep_table(spectra, results, method='threshold'):
+    """SWEEP_COLUMNS DataFrame of sweep_peaks results for the loaded Spectrum list."""
+    import pandas as pd
+
+    rows = []
+    for index, sigma, counts_threshold, spacing, peaks in results:
+        spectrum = spectra[index]
+        rows.append([method, sigma, counts_threshold, spacing, spectrum.channel, spectrum.gain, spectrum.pulse,
+                     len(peaks), float(np.median(np.diff(peaks))) if len(peaks) > 1 else np.nan,
+                     ' '.join(str(int(p)) for p in peaks), spectrum.source])
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+def summarize_sweep(sweep_df):
+    """SWEEP_SUMMARY_COLUMNS: one row per setting, most stable settings first."""
+    import pandas as pd
+
+    if sweep_df.empty:
+        return pd.DataFrame(columns=SWEEP_SUMMARY_COLUMNS)
+    df = sweep_df.copy()
+    modal = df.groupby('Source File')['Peaks Found'].agg(lambda counts: counts.mode().max())
+    df['At Modal Count'] = df['Peaks Found'] == df['Source File'].map(modal)
+    summary = df.groupby(SETTING_COLUMNS, sort=False).agg(**{
+        'Spectra': ('Peaks Found', 'size'),
+        'Total Peaks': ('Peaks Found', 'sum'),
+        'Min Peaks': ('Peaks Found', 'min'),
+        'Max Peaks': ('Peaks Found', 'max'),
+        'Spectra at Modal Count (%)': ('At Modal Count', 'mean'),
+        'Median Spacing': ('Median Spacing', 'median'),
+    }).reset_index()
+    summary['Spectra at Modal Count (%)'] *= 100
+    return summary.sort_values(['Spectra at Modal Count (%)', 'Total Peaks'], ascending=False,
+                               kind='stable').reset_index(drop=True)[SWEEP_SUMMARY_COLUMNS]
+
+
+def run_sweep(data_dir, sigmas=DEFAULT_SIGMAS, counts_thresholds=DEFAULT_COUNTS_THRESHOLDS,
+              peak_spacing_thresholds=DEFAULT_SPACING_THRESHOLDS, method=DEFAULT_PEAK_PARAMS['peak_method'],
+              crop_off_start='auto', crop_off_end='auto', gain_voltages=None, pulse_voltages=None,
+              workers=None, run_metrics=None):
+    """Load, crop and sweep one day's spectra. Returns (sweep_df, summary_df)."""
+    from sipm_analysis.loaders import load_spectra
+    from sipm_analysis.metrics import RunMetrics
+    from sipm_analysis.peaks import crop
+    from sipm_analysis.roi import resolve_crop
+
+    run_metrics = run_metrics or RunMetrics('sweep.py')
+    with run_metrics.stage('load'):
+        spectra = load_spectra(data_dir, gain_voltages or [], pulse_voltages or [])
+    with run_metrics.stage('crop'):
+        crop_off_start, crop_off_end = resolve_crop([s.data for s in spectra], crop_off_start, crop_off_end)
+        cropped = [crop(s.data, crop_off_start, crop_off_end) for s in spectra]
+    print(f"[ROI] crop_off_start = {crop_off_start}, crop_off_end = {crop_off_end} for {len(spectra)} spectra")
+
+    with run_metrics.stage('sweep'):
+        results = sweep_peaks(cropped, list(sigmas), list(counts_thresholds), list(peak_spacing_thresholds),
+                              method, workers)
+    run_metrics.count('settings', len(sigmas) * len(counts_thresholds) * len(peak_spacing_thresholds))
+    run_metrics.count('spectra', len(spectra))
+    sweep_df = sweep_table(spectra, results, method)
+    return sweep_df, summarize_sweep(sweep_df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak finding for a grid of sigma / thresholds on every spectrum.")
+    parser.add_argument('data_dir', help="day folder with the CH* spectrum files")
+    parser.add_argument('--sigma', type=float, nargs='+', default=list(DEFAULT_SIGMAS))
+    parser.add_argument('--counts-threshold', type=float, nargs='+', default=list(DEFAULT_COUNTS_THRESHOLDS))
+    parser.add_argument('--peak-spacing-threshold', type=int, nargs='+', default=list(DEFAULT_SPACING_THRESHOLDS))
+    parser.add_argument('--method', choices=PEAK_METHODS, default=DEFAULT_PEAK_PARAMS['peak_method'])
+    parser.add_argument('--crop-off-start', default='auto', help="bins, or auto (default)")
+    parser.add_argument('--crop-off-end', default='auto', help="bins, or auto (default)")
+    parser.add_argument('--gain', type=float, nargs='*', default=[], help="only these gain voltages")
+    parser.add_argument('--pulse', type=float, nargs='*', default=[], help="only these pulse voltages")
+    parser.add_argument('--workers', type=int, help="processes (default: number of CPUs)")
+    parser.add_argument('--output-dir', default=str(repo_root / 'results-from-generated-data'),
+                        help="where peak_param_sweep / peak_param_sweep_summary are written")
+    parser.add_argument('--top', type=int, default=10, help="settings printed")
+    args = parser.parse_args()
+
+    from sipm_analysis.metrics import RunMetrics
+    from sipm_analysis.roi import is_auto
+    from sipm_analysis.tables import write_table
+
+    run_metrics = RunMetrics('sweep.py')
+    crop_off_start, crop_off_end = (value if is_auto(value) else int(value)
+                                    for value in (args.crop_off_start, args.crop_off_end))
+    sweep_df, summary_df = run_sweep(args.data_dir, args.sigma, args.counts_threshold, args.peak_spacing_threshold,
+                                     args.method, crop_off_start, crop_off_end, args.gain, args.pulse,
+                                     args.workers, run_metrics)
+
+    print(summary_df.head(args.top).to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+    output_dir = Path(args.output_dir)
+    with run_metrics.stage('write_table'):
+        for name, df in (('peak_param_sweep', sweep_df), ('peak_param_sweep_summary', summary_df)):
+            for out in write_table(df, output_dir / name):
+                print(f"✅ {out.name} written to {output_dir}")
+    run_metrics.print_summary()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+# ========================================
+# Result tables: Parquet / Arrow IPC with CSV as an opt-in export
+# ========================================
+# Every result table (peak tables, slope tables, processed_peak_data) goes
+# through write_table / read_table. The formats written are taken from the
+# SIPM_TABLE_FORMATS environment variable, e.g. SIPM_TABLE_FORMATS=parquet,csv
+# to keep a CSV copy for Excel. pyarrow is optional, without it everything
+# falls back to CSV.
+#
+# read_table(..., channel='CH0', gain=65.7) pushes the filter down into the
+# Parquet/Arrow scan so only the matching row groups are decoded.
+
+TABLE_SUFFIXES = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+DEFAULT_FORMATS = ('parquet',)
+
+# The scripts name the same thing differently, filters accept any of these
+FILTER_COLUMNS = {
+    'channel': ['Channel', 'channel', 'Channel (from filename)'],
+    'gain': ['Voltage Gain (V)', 'Gain Voltage (V)', 'Gain Voltage (from filename)'],
+    'pulse': ['Pulse Voltage (V)', 'Pulse Height (V)', 'Pulse Height (from filename)'],
+    'state': ['State', 'state'],
+}
+CATEGORY_COLUMNS = {'Channel', 'channel', 'State', 'state', 'structure', 'coincidence', 'correlation_time'}
+TIMESTAMP_COLUMNS = {'Timestamp', 'time_ran'}
+
+
+def have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def table_formats(formats=None):
+    if formats is None:
+        env = os.environ.get('SIPM_TABLE_FORMATS', '')
+        formats = [f.strip().lower() for f in env.split(',') if f.strip()] or list(DEFAULT_FORMATS)
+    unknown = [f for f in formats if f not in TABLE_SUFFIXES]
+    if unknown:
+        raise ValueError(f"Unknown table format(s) {unknown}, expected some of {list(TABLE_SUFFIXES)}")
+    if not have_pyarrow() and any(f != 'csv' for f in formats):
+        print("[WARNING] pyarrow is not installed, writing CSV instead of Parquet/Arrow")
+        formats = ['csv']
+    return list(dict.fromkeys(formats))
+
+
+def table_path(path, fmt):
+    """results/foo(.csv|.parquet|.arrow) -> results/foo.<fmt>. Names like *_1.6V keep their dot."""
+    path = Path(path)
+    if path.suffix in TABLE_SUFFIXES.values():
+        path = path.with_suffix('')
+    return path.parent / (path.name + TABLE_SUFFIXES[fmt])
+
+
+def typed_columns(df):
+    """Give the CSV-style object columns real types before writing a columnar file."""
+    import pandas as pd
+
+    df = df.copy()
+    for col in df.columns:
+        if col in TIMESTAMP_COLUMNS:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype(str).astype('category')
+        elif df[col].dtype == object:
+            # e.g. Index Difference is "N/A" for the first peak and ints after
+            values = df[col].replace('N/A', np.nan)
+            numeric = pd.to_numeric(values, errors='coerce')
+            if numeric.notna().sum() == values.notna().sum():
+                df[col] = numeric
+            else:
+                df[col] = df[col].astype(str)
+        elif df[col].dtype == np.float64 and col in ('Peak Counts', 'peak_value', 'total_counts'):
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def write_table(df, path, formats=None):
+    """Write df once per format. Returns the list of files written."""
+    written = []
+    for fmt in table_formats(formats):
+        out = table_path(path, fmt)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if fmt == 'csv':
+            df.to_csv(out, index=False)
+        elif fmt == 'parquet':
+            typed_columns(df).to_parquet(out, index=False)
+        else:
+            typed_columns(df).reset_index(drop=True).to_feather(out)
+        written.append(out)
+    return written
+
+
+def find_table(path):
+    """First existing Parquet, Arrow or CSV version of path, or None."""
+    for fmt in ('parquet', 'arrow', 'csv'):
+        candidate = table_path(path, fmt)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def _resolve_filters(column_names, filters):
+    resolved = {}
+    for key, value in filters.items():
+        if value is None:
+            continue
+        names = FILTER_COLUMNS.get(key, [key])
+        column = next((name for name in names if name in column_names), None)
+        if column is None:
+            raise KeyError(f"No column for filter '{key}' (looked for {names})")
+        resolved[column] = list(value) if isinstance(value, (list, tuple, set)) else [value]
+    return resolved
+
+
+def read_table(path, columns=None, channel=None, gain=None, pulse=None, state=None, **filters):
+    """Load a result table written by write_table (or an old CSV), optionally filtered."""
+    import pandas as pd
+
+    source = find_table(path)
+    if source is None:
+        raise FileNotFoundError(f"❌ No parquet/arrow/csv table found for: {path}")
+    filters = dict(filters, channel=channel, gain=gain, pulse=pulse, state=state)
+
+    if source.suffix == '.csv':
+        df = pd.read_csv(source)
+        df.columns = df.columns.str.strip()
+        for column, values in _resolve_filters(df.columns, filters).items():
+            df = df[df[column].isin(values)]
+        return df[columns] if columns else df
+
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(source, format='parquet' if source.suffix == '.parquet' else 'ipc')
+    expression = None
+    for column, values in _resolve_filters(dataset.schema.names, filters).items():
+        condition = ds.field(column).isin(values)
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -0,0 +1,277 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from sipm_analysis.accidentals import DeltaTHistogram
+from sipm_analysis.listmode import DEFAULT_BLOCK_EVENTS, DEFAULT_N_BINS
+from sipm_analysis.peak_matrix import MAX_PEAK
+from sipm_analysis.rates import PS_PER_NS
+
+# ========================================
+# CH0 - CH1 time-difference spectrum and timing resolution
+# ========================================
+# The correlation windows (50 ... 750 ns) were picked without ever looking at
+# the time difference of the coincidences themselves. This histograms
+# dt = t(CH0) - t(CH1) of every CH0/CH1 pair within +-max_dt with sub-ns bins,
+# split by the Peak Number (p.e.) of both events, and fits the prompt peak
+# with a Gaussian on a flat (accidental) background:
+#
+#   python -m sipm_analysis.timing DAQ/run/RAW/SDataR_*.csv --max-dt-ns 50 --bin-ns 0.1
+#
+#   - sigma / FWHM of the peak is the CH0 - CH1 timing resolution
+#   - its mean per CH0 (CH1) Peak Number is the time walk vs p.e.: small
+#     signals cross the threshold later
+#
+# Each file is read block by block (a run needs one block of memory), the
+# events of a block within max_dt of its end are carried to the next one so
+# no pair is lost or counted twice at a block boundary, and the files are
+# histogrammed in parallel (one process each) and summed. The Peak Numbers
+# come from each file's own ENERGY spectra (peak_matrix.peak_boundaries).
+
+repo_root = Path(__file__).resolve().parent.parent
+default_output_dir = repo_root / 'coincidence-analysis'
+TIMING_COLUMNS = [
+    'Gate', 'CH0 Peak', 'CH1 Peak', 'Pairs', 'Prompt Pairs', 'Mean (ns)', 'Mean Error (ns)',
+    'Sigma (ns)', 'Sigma Error (ns)', 'FWHM (ns)', 'Walk (ns)', 'Background per ns'
+]
+DELTA_T_COLUMNS = ['CH0 Peak', 'CH1 Peak', 'Delta t (ns)', 'Count']
+
+DEFAULT_MAX_DT_NS = 50.0
+DEFAULT_BIN_NS = 0.1
+MIN_FIT_PAIRS = 50
+FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+
+
+def _classified_times(events, ch, edges, max_peak):
+    from sipm_analysis.accidentals import channel_times
+    from sipm_analysis.peak_matrix import classify
+
+    t, energy = channel_times(events, ch)
+    return t, classify(energy, edges, max_peak)
+
+
+def stream_delta_t(blocks, edges, histogram, max_peak=MAX_PEAK, channels=(0, 1)):
+    """Add the CH0 - CH1 pairs of a stream of Events blocks (one file, in time order) to histogram.
+
+    edges: {channel: peak_boundaries edges}. Returns the number of events that came
+    before the carried-over tail of the previous block (pairs of those can be missed).
+    """
+    max_ps = int((histogram.half_bins + 0.5) * histogram.bin_ns * PS_PER_NS)
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    carry = {ch: empty for ch in channels}
+    horizon = None
+    late = 0
+    for events in blocks:
+        joined = []
+        for ch in channels:
+            t, classes = _classified_times(events, ch, edges[ch], max_peak)
+            if horizon is not None:
+                late += int(np.count_nonzero(t < horizon))
+            old_t, old_classes = carry[ch]
+            t = np.r_[old_t, t]
+            order = np.argsort(t, kind='stable')
+            new = np.r_[np.zeros(len(old_t), dtype=bool), np.ones(len(t) - len(old_t), dtype=bool)]
+            joined.append((t[order], np.r_[old_classes, classes][order], new[order]))
+        (t0, c0, new0), (t1, c1, new1) = joined
+        histogram.add(t0, t1, c0, c1, new0, new1)
+
+        # Later events are at or after the last one seen: only the last max_dt can still pair
+        last = max([t[-1] for t, _, _ in joined if len(t)], default=None)
+        if last is not None:
+            horizon = last - max_ps
+            carry = {ch: (t[t >= horizon], c[t >= horizon]) for ch, (t, c, _) in zip(channels, joined)}
+    return late
+
+
+def file_delta_t(path, max_dt_ns=DEFAULT_MAX_DT_NS, bin_ns=DEFAULT_BIN_NS, max_peak=MAX_PEAK,
+                 block_events=DEFAULT_BLOCK_EVENTS, peak_params=None, n_bins=DEFAULT_N_BINS, channels=(0, 1)):
+    """DeltaTHistogram of one list-mode file, classes = Peak Number (0 = outside the peaks)."""
+    from sipm_analysis.afterpulse import energy_spectrum
+    from sipm_analysis.listmode import iter_list_mode_blocks
+    from sipm_analysis.peak_matrix import peak_boundaries
+
+    # First pass: ENERGY spectra for the Peak Numbers, second pass: the pairs
+    spectra = energy_spectrum(iter_list_mode_blocks(path, block_events, channels), n_bins)
+    edges = {}
+    for ch in channels:
+        if ch not in spectra:
+            raise ValueError(f"no CH{ch} events in {path}")
+        _, edges[ch] = peak_boundaries(spectra[ch], peak_params)
+
+    histogram = DeltaTHistogram(max_dt_ns, bin_ns, max_peak + 1)
+    late = stream_delta_t(iter_list_mode_blocks(path, block_events, channels), edges, histogram, max_peak, channels)
+    if late:
+        print(f"[WARNING] {Path(path).name}: {late} events out of time order across blocks, "
+              f"pairs of those may be missing")
+    return histogram
+
+
+def _file_counts(args):
+    path, kwargs = args
+    histogram = file_delta_t(path, **kwargs)
+    return histogram.counts, histogram.first, histogram.last
+
+
+def delta_t_histogram(paths, max_dt_ns=DEFAULT_MAX_DT_NS, bin_ns=DEFAULT_BIN_NS, max_peak=MAX_PEAK,
+                      block_events=DEFAULT_BLOCK_EVENTS, peak_params=None, workers=None):
+    """Summed DeltaTHistogram of several list-mode files, one process per file."""
+    paths = [paths] if isinstance(paths, (str, Path)) else list(paths)
+    kwargs = {'max_dt_ns': max_dt_ns, 'bin_ns': bin_ns, 'max_peak': max_peak,
+              'block_events': block_events, 'peak_params': peak_params}
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    jobs = [(path, kwargs) for path in paths]
+    if workers <= 1:
+        results = map(_file_counts, jobs)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_file_counts, jobs))
+
+    histogram = DeltaTHistogram(max_dt_ns, bin_ns, max_peak + 1)
+    for counts, first, last in results:
+        histogram.counts += counts
+        if first is not None:
+            histogram.first = first if histogram.first is None else min(histogram.first, first)
+            histogram.last = last if histogram.last is None else max(histogram.last, last)
+    return histogram
+
+
+def gaussian_on_background(t, amplitude, mean, sigma, background):
+    return amplitude * np.exp(-0.5 * ((t - mean) / sigma) ** 2) + background
+
+
+def fit_prompt_peak(counts, centers_ns, min_pairs=MIN_FIT_PAIRS):
+    """Gaussian + constant fit of a dt histogram. Returns a dict (NaN when too few pairs or no fit)."""
+    from scipy.ndimage import gaussian_filter1d
+    from scipy.optimize import curve_fit
+
+    counts = np.asarray(counts, dtype=float)
+    bin_ns = centers_ns[1] - centers_ns[0]
+    result = {'Pairs': int(counts.sum()), 'Prompt Pairs': np.nan, 'Mean (ns)': np.nan, 'Mean Error (ns)': np.nan,
+              'Sigma (ns)': np.nan, 'Sigma Error (ns)': np.nan, 'FWHM (ns)': np.nan, 'Background per ns': np.nan}
+    if counts.sum() < min_pairs:
+        return result
+
+    # Start values from a smoothed maximum and the number of bins above half of it
+    smooth = gaussian_filter1d(counts, max(1.0, 0.5 / bin_ns))
+    background = float(np.median(smooth))
+    peak = int(np.argmax(smooth))
+    height = smooth[peak] - background
+    width = max(np.count_nonzero(smooth - background > height / 2) * bin_ns, 2 * bin_ns)
+    start = [height, centers_ns[peak], width / FWHM_PER_SIGMA, background]
+    try:
+        (amplitude, mean, sigma, background), covariance = curve_fit(
+            gaussian_on_background, centers_ns, counts, p0=start, sigma=np.sqrt(np.maximum(counts, 1)),
+            absolute_sigma=True, maxfev=10000)
+    except RuntimeError:
+        return result
+    errors = np.sqrt(np.diag(covariance))
+    sigma = abs(sigma)
+    result.update({
+        'Prompt Pairs': amplitude * sigma * np.sqrt(2 * np.pi) / bin_ns,
+        'Mean (ns)': mean, 'Mean Error (ns)': errors[1],
+        'Sigma (ns)': sigma, 'Sigma Error (ns)': errors[2], 'FWHM (ns)': sigma * FWHM_PER_SIGMA,
+        'Background per ns': background / bin_ns,
+    })
+    return result
+
+
+def timing_table(histogram, min_pairs=MIN_FIT_PAIRS):
+    """TIMING_COLUMNS: all pairs, both in a peak, then the walk per CH0 / CH1 Peak Number and per n and n."""
+    import pandas as pd
+
+    counts = histogram.counts
+    centers = histogram.centers_ns
+    n = histogram.n_classes
+    in_peaks = counts[1:, 1:]
+    gates = [('all', 'all', 'all', counts.sum(axis=(0, 1))),
+             ('both in a peak', 'any', 'any', in_peaks.sum(axis=(0, 1)))]
+    gates += [('CH0 peak', str(a), 'any', counts[a, 1:].sum(axis=0)) for a in range(1, n)]
+    gates += [('CH1 peak', 'any', str(b), counts[1:, b].sum(axis=0)) for b in range(1, n)]
+    gates += [('same peak', str(a), str(a), counts[a, a]) for a in range(1, n)]
+
+    rows = [{'Gate': gate, 'CH0 Peak': peak0, 'CH1 Peak': peak1, **fit_prompt_peak(spectrum, centers, min_pairs)}
+            for gate, peak0, peak1, spectrum in gates]
+    df = pd.DataFrame(rows)
+    # Walk: shift of each gate's prompt peak from the one of all in-peak pairs
+    df['Walk (ns)'] = df['Mean (ns)'] - df.loc[df['Gate'] == 'both in a peak', 'Mean (ns)'].iloc[0]
+    return df[TIMING_COLUMNS]
+
+
+def delta_t_table(histogram):
+    """DELTA_T_COLUMNS, non-empty bins only (peak 0 = outside the peaks)."""
+    import pandas as pd
+
+    a, b, k = np.nonzero(histogram.counts)
+    return pd.DataFrame({'CH0 Peak': a, 'CH1 Peak': b, 'Delta t (ns)': histogram.centers_ns[k],
+                         'Count': histogram.counts[a, b, k]}, columns=DELTA_T_COLUMNS)
+
+
+def plot_timing(histogram, table, path):
+    """dt spectrum of all in-peak pairs with its fit, and the walk vs Peak Number."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    centers = histogram.centers_ns
+    fig, (ax_dt, ax_walk) = plt.subplots(1, 2, figsize=(12, 5))
+    spectrum = histogram.counts[1:, 1:].sum(axis=(0, 1))
+    ax_dt.step(centers, spectrum, where='mid', label='both in a peak')
+    fit = table[table['Gate'] == 'both in a peak'].iloc[0]
+    if np.isfinite(fit['Sigma (ns)']):
+        bin_ns = histogram.bin_ns
+        amplitude = fit['Prompt Pairs'] * bin_ns / (fit['Sigma (ns)'] * np.sqrt(2 * np.pi))
+        ax_dt.plot(centers, gaussian_on_background(centers, amplitude, fit['Mean (ns)'], fit['Sigma (ns)'],
+                                                   fit['Background per ns'] * bin_ns),
+                   label=f"FWHM {fit['FWHM (ns)']:.2f} ns", color='red')
+    ax_dt.set_xlabel('t(CH0) - t(CH1) (ns)')
+    ax_dt.set_ylabel(f'Pairs per {histogram.bin_ns:g} ns')
+    ax_dt.legend()
+
+    for gate, column, marker in (('CH0 peak', 'CH0 Peak', 'o'), ('CH1 peak', 'CH1 Peak', 's')):
+        rows = table[table['Gate'] == gate]
+        ax_walk.errorbar(rows[column].astype(int), rows['Walk (ns)'], yerr=rows['Mean Error (ns)'],
+                         fmt=marker, capsize=3, label=gate)
+    ax_walk.axhline(0, color='gray', lw=0.5)
+    ax_walk.set_xlabel('Peak Number (p.e.)')
+    ax_walk.set_ylabel('Walk (ns)')
+    ax_walk.legend()
+
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CH0 - CH1 time-difference spectrum, timing resolution and walk.")
+    parser.add_argument('paths', nargs='+', help="list-mode .csv files with both channels")
+    parser.add_argument('--max-dt-ns', type=float, default=DEFAULT_MAX_DT_NS, help="histogram range +-this")
+    parser.add_argument('--bin-ns', type=float, default=DEFAULT_BIN_NS)
+    parser.add_argument('--max-peak', type=int, default=MAX_PEAK)
+    parser.add_argument('--counts-threshold', type=float, help="for the peak finder on the ENERGY spectra")
+    parser.add_argument('--block-events', type=int, default=DEFAULT_BLOCK_EVENTS)
+    parser.add_argument('--workers', type=int, help="processes (default: number of CPUs, at most one per file)")
+    parser.add_argument('--output-dir', default=str(default_output_dir))
+    args = parser.parse_args()
+
+    from sipm_analysis.tables import write_table
+
+    peak_params = {'counts_threshold': args.counts_threshold} if args.counts_threshold is not None else None
+    histogram = delta_t_histogram(args.paths, args.max_dt_ns, args.bin_ns, args.max_peak, args.block_events,
+                                  peak_params, args.workers)
+    table = timing_table(histogram)
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    write_table(table, output_dir / 'timing_resolution')
+    write_table(delta_t_table(histogram), output_dir / 'delta_t_spectrum')
+    plot = plot_timing(histogram, table, output_dir / 'timing_resolution.png')
+    print(f"✅ Timing tables and {plot.name} written to {output_dir}")
+
+
+if __name__ == '__main__':
+    main()
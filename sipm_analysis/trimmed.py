@@ -0,0 +1,173 @@
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+
+# ========================================
+# Trimmed spectra: only the populated bins, plus where they start
+# ========================================
+# CoMPASS writes every bin of the digitizer range, most of them zero, which is
+# why crop_off_end=3000 is set everywhere. A TrimmedSpectrum keeps the bins
+# from the first to the last non-zero one (plus TRIM_MARGIN zeros on each
+# side) and their offset in the full spectrum:
+#
+#   full[offset:offset + len(counts)] == counts, every other bin is 0
+#
+# It still behaves like the full array where the analysis code needs it:
+# len() is the full length, spectrum[i] / spectrum[peaks] read any bin and
+# np.asarray(spectrum) rebuilds the full array. peaks.crop / smooth_data /
+# find_spectrum_peaks work on the counts directly, so smoothing and threshold
+# peak finding cost scales with the populated bins, and they give the same
+# peaks as on the full array (the smoothing kernel only ever sees zeros past
+# the trimmed range).
+#
+# On disk a trimmed spectrum is one small .npz (offset, full length, counts
+# as int32 when they are whole numbers). Mirror a data directory once with
+#
+#   python -m sipm_analysis.trimmed data-photon-counts-SiPM/20250428_more_light trimmed/20250428_more_light
+#
+# and point data_dir at the mirror: load_spectrum reads the .npz files.
+
+TRIM_MARGIN = 64  # zero bins kept on each side of the populated range
+TRIMMED_SUFFIX = '.npz'
+
+
+def populated_range(data, margin=TRIM_MARGIN):
+    """(start, stop) of the non-zero bins of data, widened by margin, (0, 0) when all are zero."""
+    filled = np.flatnonzero(np.asarray(data))
+    if len(filled) == 0:
+        return 0, 0
+    return max(int(filled[0]) - margin, 0), min(int(filled[-1]) + 1 + margin, len(data))
+
+
+class TrimmedSpectrum:
+    """counts of bins offset .. offset + len(counts) of a spectrum of length bins, zero elsewhere."""
+
+    def __init__(self, offset, counts, length):
+        self.offset = int(offset)
+        self.counts = np.asarray(counts)
+        self.length = int(length)
+
+    @classmethod
+    def from_dense(cls, data, margin=TRIM_MARGIN):
+        data = np.asarray(data)
+        start, stop = populated_range(data, margin)
+        return cls(start, data[start:stop].copy(), len(data))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def dtype(self):
+        return self.counts.dtype
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes
+
+    @property
+    def stop(self):
+        return self.offset + len(self.counts)
+
+    def to_dense(self, dtype=None):
+        dense = np.zeros(self.length, dtype=dtype or self.counts.dtype)
+        dense[self.offset:self.stop] = self.counts
+        return dense
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype)
+
+    def __getitem__(self, index):
+        """Bins of the full spectrum: an index or index array, or a slice (returned as a full array)."""
+        if isinstance(index, slice):
+            return self.to_dense()[index]
+        index = np.asarray(index)
+        index = np.where(index < 0, index + self.length, index)
+        inside = (index >= self.offset) & (index < self.stop)
+        values = np.zeros(index.shape, dtype=self.counts.dtype)
+        values[inside] = self.counts[index[inside] - self.offset]
+        return values[()] if values.ndim == 0 else values
+
+    def crop(self, crop_off_start, crop_off_end):
+        """Same bins as peaks.crop on the full array, still trimmed."""
+        stop = self.length - crop_off_end
+        first, last = max(self.offset, crop_off_start), min(self.stop, stop)
+        counts = self.counts[first - self.offset:max(last, first) - self.offset]
+        return TrimmedSpectrum(first - crop_off_start, counts, max(stop - crop_off_start, 0))
+
+    def padded(self, bins):
+        """Same spectrum with up to bins more zeros kept on each side (never past the ends)."""
+        first, last = max(self.offset - bins, 0), min(self.stop + bins, self.length)
+        counts = np.zeros(last - first, dtype=self.counts.dtype)
+        counts[self.offset - first:self.stop - first] = self.counts
+        return TrimmedSpectrum(first, counts, self.length)
+
+    def smooth(self, sigma, truncate=4.0):
+        """gaussian_filter1d of the full spectrum, computed on the trimmed bins only."""
+        from scipy.ndimage import gaussian_filter1d
+
+        # Enough zeros that the kernel (radius truncate * sigma) never reaches past them
+        padded = self.padded(int(truncate * float(sigma) + 0.5) + 1)
+        return TrimmedSpectrum(padded.offset, gaussian_filter1d(padded.counts, sigma=sigma, truncate=truncate),
+                               self.length)
+
+
+def save_trimmed(spectrum, path):
+    """Write a TrimmedSpectrum (or a full array, trimmed first) as .npz. Returns the path."""
+    if not isinstance(spectrum, TrimmedSpectrum):
+        spectrum = TrimmedSpectrum.from_dense(spectrum)
+    counts = spectrum.counts
+    # CoMPASS counts are whole numbers: int32 on disk, back to the loaded dtype on reading
+    if counts.dtype.kind == 'f' and np.all(np.mod(counts, 1) == 0) and np.all(np.abs(counts) < 2 ** 31):
+        counts = counts.astype(np.int32)
+    path = Path(path)
+    path = path.parent / (path.name + TRIMMED_SUFFIX) if path.suffix != TRIMMED_SUFFIX else path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, offset=spectrum.offset, length=spectrum.length, counts=counts,
+                        dtype=str(spectrum.counts.dtype))
+    return path
+
+
+def load_trimmed(path):
+    with np.load(path) as stored:
+        counts = stored['counts'].astype(str(stored['dtype']))
+        return TrimmedSpectrum(int(stored['offset']), counts, int(stored['length']))
+
+
+def trim_directory(data_dir, output_dir, margin=TRIM_MARGIN):
+    """Mirror every CH* spectrum of data_dir as CH*.txt.npz under output_dir. Returns (files, bytes before, after)."""
+    from sipm_analysis.loaders import load_spectrum
+
+    data_dir, output_dir = Path(data_dir), Path(output_dir)
+    files, before, after = 0, 0, 0
+    for subdir, _, names in os.walk(data_dir):
+        for name in sorted(names):
+            if not name.startswith("CH") or name.endswith(TRIMMED_SUFFIX):
+                continue
+            path = Path(subdir) / name
+            try:
+                spectrum = TrimmedSpectrum.from_dense(load_spectrum(path), margin)
+            except ValueError as e:
+                print(f"[WARNING] Skipping {path}: {e}")
+                continue
+            out = save_trimmed(spectrum, output_dir / path.relative_to(data_dir))
+            files += 1
+            before += path.stat().st_size
+            after += out.stat().st_size
+    return files, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store CoMPASS spectra trimmed to their populated bins.")
+    parser.add_argument('data_dir', help="folder with CH*.txt spectra (searched recursively)")
+    parser.add_argument('output_dir', help="mirror of data_dir with one .npz per spectrum")
+    parser.add_argument('--margin', type=int, default=TRIM_MARGIN, help="zero bins kept on each side")
+    args = parser.parse_args()
+
+    files, before, after = trim_directory(args.data_dir, args.output_dir, args.margin)
+    print(f"✅ {files} spectra trimmed into {args.output_dir}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import threading
+import webbrowser
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from sipm_analysis.loaders import iter_spectrum_files, load_spectrum
+from sipm_analysis.peaks import DEFAULT_PEAK_PARAMS, crop_offsets
+from sipm_analysis.results_store import acquisition_date
+
+# ========================================
+# Browser viewer for many spectra (local Plotly page)
+# ========================================
+# python -m sipm_analysis.viewer data-photon-counts-SiPM/20250428_more_light data-photon-counts-SiPM/20250505_...
+#
+# Same Plotly as analysis_single_dataset/gaussian_envelope_tool.html, served
+# from a small local HTTP server instead of one matplotlib window per gain:
+#   - only the file names are scanned at start, a spectrum is read when it is
+#     first shown (and kept in a small cache)
+#   - the browser gets at most ~2 points per screen pixel: the min and max of
+#     every bucket of bins, so narrow peaks survive. Zooming asks for the
+#     visible range again at full resolution
+#   - peaks from the peak tables / results store are drawn on top and listed
+#     in a table under the plot (click a row to zoom to it)
+
+repo_root = Path(__file__).resolve().parent.parent
+default_results_dir = repo_root / 'results-from-generated-data'
+PAGE = Path(__file__).with_name('viewer.html')
+MAX_POINTS = 4000
+
+
+def minmax_decimate(y, start=0, end=None, buckets=MAX_POINTS // 2):
+    """x, y of at most 2 * buckets points that keep the min and max of every bucket of bins."""
+    y = np.asarray(y, dtype=float)
+    end = len(y) if end is None else min(int(end), len(y))
+    start = max(0, min(int(start), end))
+    segment = y[start:end]
+    if len(segment) <= 2 * buckets:
+        return np.arange(start, end), segment
+
+    size = int(np.ceil(len(segment) / buckets))
+    padded = np.pad(segment, (0, size * buckets - len(segment)), mode='edge').reshape(buckets, size)
+    lo, hi = padded.argmin(axis=1), padded.argmax(axis=1)
+    # Keep each pair in x order so the line does not zig-zag backwards
+    first, second = np.minimum(lo, hi), np.maximum(lo, hi)
+    offsets = np.arange(buckets) * size
+    x = np.stack([offsets + first, offsets + second], axis=1).ravel()
+    x = np.minimum(x, len(segment) - 1)
+    return x + start, segment[x]
+
+
+class SpectrumIndex:
+    """File names of every spectrum under the day folders, data loaded on demand."""
+
+    def __init__(self, data_dirs, include_dark=True, cache_size=256):
+        self.entries = []
+        for data_dir in data_dirs:
+            date = acquisition_date(data_dir)
+            for path, channel, gain, pulse, state in iter_spectrum_files(data_dir, include_dark):
+                self.entries.append({
+                    'id': len(self.entries), 'date': date, 'channel': channel, 'gain': gain,
+                    'pulse': pulse, 'state': state, 'file': path.name, 'path': str(path),
+                })
+        self.load = lru_cache(maxsize=cache_size)(self._load)
+
+    def _load(self, spectrum_id):
+        return load_spectrum(self.entries[spectrum_id]['path'])
+
+    def listing(self):
+        return [{key: value for key, value in entry.items() if key != 'path'} for entry in self.entries]
+
+
+class PeakSource:
+    """Peak positions for an overlay: the results store if there is one, else the last peak table."""
+
+    def __init__(self, results_dir=None, crop_off_start=None):
+        self.results_dir = Path(results_dir) if results_dir else default_results_dir
+        self.crop_off_start = self._crop_used() if crop_off_start is None else crop_off_start
+        self._lock = threading.Lock()
+        self._table = None
+
+    def _crop_used(self):
+        """crop_off_start for peaks stored without theirs: the pipeline's last one, else the default one."""
+        from sipm_analysis.pipeline import CROP_FILE
+
+        crop_file = self.results_dir / CROP_FILE
+        if crop_file.exists():
+            return int(json.loads(crop_file.read_text())['crop_off_start'])
+        return DEFAULT_PEAK_PARAMS["crop_off_start"]
+
+    def _all_peaks(self):
+        from sipm_analysis.tables import find_table, read_table
+
+        with self._lock:
+            if self._table is None:
+                source = find_table(self.results_dir / 'all_peaks_combined_sorted')
+                self._table = read_table(source) if source is not None else None
+            return self._table
+
+    def peaks(self, entry):
+        store_dir = self.results_dir / 'store' / 'peaks'
+        if store_dir.exists():
+            from sipm_analysis.results_store import ResultsStore
+
+            try:
+                df = ResultsStore(self.results_dir / 'store').scan(
+                    'peaks', date=entry['date'], channel=entry['channel'], gain=entry['gain'])
+            except Exception as e:  # e.g. no partition for this day yet
+                print(f"[WARNING] Results store not readable for {entry['file']}: {e}")
+                df = None
+        else:
+            df = self._all_peaks()
+            if df is not None:
+                df = df[(df['Channel'].astype(str) == entry['channel']) & (df['Voltage Gain (V)'] == entry['gain'])]
+
+        if df is None or df.empty:
+            return []
+        df = df[df['Pulse Voltage (V)'] == entry['pulse']]
+        columns = [c for c in ('Peak Number', 'Peak Index', 'Peak Counts', 'Peak Width') if c in df.columns]
+        # Peak Index is counted from the start of the cropped spectrum, each row with its own day's crop
+        df = df[columns].assign(x=df['Peak Index'].to_numpy(dtype=np.int64) + crop_offsets(df, self.crop_off_start))
+        rows = df.sort_values('x').to_dict(orient='records')
+        return json.loads(json.dumps(rows, default=float))
+
+
+def make_handler(index, peak_source):
+    class ViewerHandler(BaseHTTPRequestHandler):
+        def _send(self, body, content_type='application/json', status=200):
+            data = body if isinstance(body, bytes) else body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                if url.path == '/':
+                    self._send(PAGE.read_bytes(), 'text/html; charset=utf-8')
+                elif url.path == '/api/spectra':
+                    self._send(json.dumps(index.listing()))
+                elif url.path == '/api/spectrum':
+                    spectrum_id = int(query['id'])
+                    data = index.load(spectrum_id)
+                    x, y = minmax_decimate(data, query.get('start', 0), query.get('end'),
+                                           int(query.get('buckets', MAX_POINTS // 2)))
+                    self._send(json.dumps({'id': spectrum_id, 'n_bins': len(data),
+                                           'x': x.tolist(), 'y': y.tolist()}))
+                elif url.path == '/api/peaks':
+                    self._send(json.dumps(peak_source.peaks(index.entries[int(query['id'])])))
+                else:
+                    self._send('{"error": "not found"}', status=404)
+            except (KeyError, ValueError, IndexError) as e:
+                self._send(json.dumps({'error': str(e)}), status=400)
+
+        def log_message(self, format, *args):
+            pass  # keep the terminal for [LOADED]/[WARNING] lines
+
+    return ViewerHandler
+
+
+def serve(data_dirs, results_dir=None, host='127.0.0.1', port=8050, open_browser=True, crop_off_start=None):
+    index = SpectrumIndex(data_dirs)
+    server = ThreadingHTTPServer((host, port), make_handler(index, PeakSource(results_dir, crop_off_start)))
+    url = f"http://{host}:{server.server_port}/"
+    print(f"✅ {len(index.entries)} spectra indexed, viewer at {url} (Ctrl+C to stop)")
+    if open_browser:
+        webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Browse many SiPM spectra with their peaks in the browser.")
+    parser.add_argument('data_dirs', nargs='+', help="day folders with the CH* spectrum files")
+    parser.add_argument('--results-dir', default=str(default_results_dir),
+                        help="where the peak tables / results store are")
+    parser.add_argument('--crop-off-start', type=int,
+                        help="crop used for peaks stored without their Crop Off Start (Peak Index is counted "
+                             "from it), default: the one in the results dir's crop.json")
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--no-browser', action='store_true')
+    args = parser.parse_args()
+    serve(args.data_dirs, args.results_dir, port=args.port, open_browser=not args.no_browser,
+          crop_off_start=args.crop_off_start)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,16 +13,20 @@ from scipy.ndimage import gaussian_filter1d
 from datetime import datetime
 import csv
 
+from sipm_analysis.peaks import crop, manual_peaks_in_crop
+from sipm_analysis.roi import resolve_crop
+
 # =================== PARAMETERS ===================
 data_dir = 'data-photon-counts-SiPM/20250507_baseline_data_for_coic_comparison'
 gain_voltages_to_plot = [65.7]
 pulse_voltages_to_plot = [1.6]
-crop_off_start = 100
-crop_off_end = 3000
+crop_off_start = 'auto'  # or a number of bins (sipm_analysis.roi)
+crop_off_end = 'auto'
 vertical_lines = False
 counts_threshold = 100
 peak_spacing_threshold = 16
 sigma = 3.6
+peak_method = 'threshold'  # or 'baseline' / 'cwt' (see sipm_analysis/baseline.py, sipm_analysis/cwt.py)
 
 pulse_color_map = {
     1.0: 'black',
@@ -33,9 +37,10 @@ pulse_color_map = {
     2.3: 'red',
 }
 
+# Bins of the full spectrum (not counted from the crop)
 manual_peak_indices = {
-    ('CH0', 65.7, 1.6): [140, 178, 553, 590],
-    ('CH1', 65.7, 1.6): [130, 177],
+    ('CH0', 65.7, 1.6): [240, 278, 653, 690],
+    ('CH1', 65.7, 1.6): [230, 277],
 }
 
 # =================== HELPER FUNCTIONS ===================
@@ -56,18 +61,26 @@ def find_and_label_peaks(data, ax, label, crop_off_start, crop_off_end, color, s
                          vertical_lines=False, print_peaks=True,
                          channel=None, gain_voltage=None, pulse_voltage=None,
                          output_file=None, manual_peaks=None):
-    data_cropped = data[crop_off_start:-crop_off_end]
+    data_cropped = crop(data, crop_off_start, crop_off_end)
     smoothed_data = smooth_data(data_cropped)
     x = np.arange(len(smoothed_data))
 
-    peaks, _ = find_peaks(
-        smoothed_data,
-        height=counts_threshold,
-        distance=peak_spacing_threshold
-    )
+    if peak_method == 'baseline':
+        from sipm_analysis.baseline import baseline_peaks_many
+        peaks = baseline_peaks_many([smoothed_data], peak_spacing_threshold, counts_threshold, sigma)[0]
+    elif peak_method == 'cwt':
+        from sipm_analysis.cwt import cwt_peaks
+        peaks = cwt_peaks(data_cropped, peak_spacing_threshold, counts_threshold)
+    else:
+        peaks, _ = find_peaks(
+            smoothed_data,
+            height=counts_threshold,
+            distance=peak_spacing_threshold
+        )
 
+    manual_peaks = manual_peaks_in_crop(manual_peaks, crop_off_start, len(smoothed_data))
     if manual_peaks is not None:
-        peaks = np.concatenate([peaks, np.array(manual_peaks)])
+        peaks = np.concatenate([peaks, np.array(manual_peaks, dtype=peaks.dtype)])
         peaks = np.unique(peaks)
 
     ax.plot(x, smoothed_data, label=label, alpha=0.8, color=color, linestyle=style, linewidth=2)
@@ -119,6 +132,12 @@ fig, (ax0, ax1) = plt.subplots(1, 2, figsize=(16, 6), sharey=True)
 axes = [ax0, ax1]
 channels = ["CH0", "CH1"]
 
+# One crop for every plotted spectrum, so the Peak Index values of both channels line up
+crop_start, crop_end = resolve_crop([data for channel in channels
+                                     for data, pulse_v, _ in data_by_channel[channel][gain_voltage]["light"]
+                                     if pulse_v == pulse_voltage], crop_off_start, crop_off_end)
+print(f"[ROI] crop_off_start = {crop_start}, crop_off_end = {crop_end}")
+
 for ax, channel in zip(axes, channels):
     try:
         data_list = data_by_channel[channel][gain_voltage]["light"]
@@ -138,8 +157,8 @@ for ax, channel in zip(axes, channels):
             data=data,
             ax=ax,
             label=label,
-            crop_off_start=crop_off_start,
-            crop_off_end=crop_off_end,
+            crop_off_start=crop_start,
+            crop_off_end=crop_end,
             color=color,
             style='solid',
             print_peaks=True,
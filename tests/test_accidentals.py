@@ -0,0 +1,32 @@
+import numpy as np
+
+from sipm_analysis.accidentals import accidental_sweep
+from sipm_analysis.addback import pair_events
+from sipm_analysis.listmode import Events
+
+
+def correlated_run(n_events=20_000, n_partners=5_000, seed=0):
+    """CH0 / CH1 events, 10 us apart on average: n_partners CH1 events follow a CH0 one within 5 ns."""
+    rng = np.random.default_rng(seed)
+    span = n_events * 10_000_000
+    t0 = np.sort(rng.integers(0, span, n_events))
+    partners = rng.choice(t0, n_partners, replace=False) + rng.integers(-5_000, 5_000, n_partners)
+    t1 = np.sort(np.r_[partners, rng.integers(0, span, n_events - n_partners)])
+    channel = np.repeat(np.array([0, 1]), n_events)
+    energy = rng.integers(0, 4096, 2 * n_events)
+    events = Events(channel, np.r_[t0, t1].astype(np.int64), energy, np.zeros(2 * n_events, dtype=np.int64))
+    return events, t0.astype(np.int64), t1.astype(np.int64)
+
+
+def test_true_pairs_are_the_correlated_pairs():
+    events, t0, t1 = correlated_run()
+    windows = (50.0, 250.0, 750.0)
+    table, _ = accidental_sweep(events, windows)
+
+    # Accidentals grow with the window, the true pairs don't
+    accidental = table['Accidental Pairs'].to_numpy()
+    assert np.all(np.diff(accidental) > 0)
+    assert np.all(np.abs(table['True Pairs'].to_numpy() - 5_000) < 4 * table['True Error'].to_numpy())
+    # AddBack Pairs is the one-to-one pairing of addback
+    for window, n_addback in zip(windows, table['AddBack Pairs']):
+        assert n_addback == len(pair_events(t0, t1, int(window * 1000))[0])
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from sipm_analysis.drift import RUN_COLUMNS, DriftMonitor
+from sipm_analysis.results_store import ResultsStore
+
+RUNS = [f"202504{day:02d}" for day in range(1, 13)]
+
+
+def drift_records(runs=RUNS, seed=0):
+    """RUN_COLUMNS records of two channels, a slow spacing drift plus noise, one NaN width."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i, run in enumerate(runs):
+        for ch in ('CH0', 'CH1'):
+            width = np.nan if (i, ch) == (5, 'CH1') else 8.0 + rng.normal(0, 0.3)
+            rows.append([run, ch, 65.7, 38.0 * (1 + 0.004 * i) + rng.normal(0, 0.1), 260 + rng.normal(0, 1), width])
+    return pd.DataFrame(rows, columns=RUN_COLUMNS)
+
+
+def test_backfilled_runs_give_the_in_order_series(tmp_path):
+    records = drift_records()
+    in_order = DriftMonitor(tmp_path / 'in_order.json', window=3, reference_runs=3)
+    trend = pd.concat([in_order.update(records[records['run'] == run])[0] for run in RUNS], ignore_index=True)
+
+    backfilled = DriftMonitor(tmp_path / 'backfilled.json', window=3, reference_runs=3)
+    late = ['20250402', '20250407']
+    backfilled.update(records[~records['run'].isin(late)])
+    backfilled.update(records[records['run'] == late[1]])
+    replayed, _ = backfilled.update(records[records['run'] == late[0]])
+
+    assert backfilled.state['series'] == in_order.state['series']
+    # Only the backfilled run and the ones after it are replayed
+    assert sorted(set(replayed['run'])) == RUNS[1:]
+    pd.testing.assert_frame_equal(replayed, trend[trend['run'] >= late[0]].reset_index(drop=True))
+
+
+def peak_rows(date, shift=0.0):
+    """Peak table of one day: 5 peaks per channel, spacing 38 bins (+ shift)."""
+    rows = []
+    for ch in ('CH0', 'CH1'):
+        for number in range(1, 6):
+            rows.append({'Timestamp': f'{date} 10:00:00', 'Channel': ch, 'Voltage Gain (V)': 65.7,
+                         'Pulse Voltage (V)': 6.5, 'Peak Number': number,
+                         'Peak Index': 160 + (38.0 + shift) * number, 'Peak Counts': 500.0,
+                         'Index Difference': 38, 'Peak Width': 8.0, 'Crop Off Start': 100})
+    return pd.DataFrame(rows)
+
+
+def test_update_from_store_reads_only_changed_days(tmp_path, monkeypatch):
+    store = ResultsStore(tmp_path / 'store')
+    for date in RUNS[:4]:
+        store.append('peaks', peak_rows(date), date)
+    monitor = DriftMonitor(tmp_path / 'drift_state.json', window=2, reference_runs=2)
+    trend, _ = monitor.update_from_store(store)
+    assert sorted(set(trend['run'])) == RUNS[:4]
+    assert len(monitor.state['partitions']) == 8
+
+    # Nothing changed: only the manifest is read, no file listed
+    def listed_again(self, table):
+        raise AssertionError("the store was listed again")
+
+    monkeypatch.setattr(ResultsStore, 'rescan', listed_again)
+    trend, _ = monitor.update_from_store(store)
+    assert trend.empty
+
+    # A re-processed day replays from that day on
+    store.append('peaks', peak_rows(RUNS[2], shift=2.0), RUNS[2])
+    trend, alerts = monitor.update_from_store(store)
+    assert sorted(set(trend['run'])) == RUNS[2:4]
+    assert any(RUNS[2] in alert and 'spacing' in alert for alert in alerts)
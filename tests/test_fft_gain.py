@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from sipm_analysis.fft_gain import cepstrum_spacing, power_spectrum_spacing
+
+
+def finger_spectra(n_spectra=50, spacing=38.0, width=4.5, amplitude=3000, decay=0.3, n_bins=1200, seed=0):
+    """Poisson counts of 14 Gaussian fingers on a flat background, pedestal and width jittered per spectrum."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_bins)
+    rows = []
+    for _ in range(n_spectra):
+        pedestal, sigma = 300 + rng.uniform(-30, 30), width * rng.uniform(0.8, 1.2)
+        mean = sum(amplitude * np.exp(-decay * k) * np.exp(-0.5 * ((x - pedestal - spacing * k) / sigma) ** 2)
+                   for k in range(14))
+        rows.append(rng.poisson(mean + 5).astype(float))
+    return np.stack(rows)
+
+
+@pytest.mark.parametrize('case', [{}, dict(width=7.0), dict(amplitude=300), dict(decay=0.6), dict(width=3.0)])
+def test_cepstrum_spacing_finds_the_first_rahmonic(case):
+    spectra = finger_spectra(**case)
+
+    spacing = cepstrum_spacing(spectra)
+
+    assert np.mean(np.abs(spacing - 38.0) <= 1.0) >= 0.9
+    assert abs(np.nanmedian(spacing) - np.nanmedian(power_spectrum_spacing(spectra))) < 0.5
+
+
+def test_cepstrum_spacing_of_one_spectrum():
+    assert abs(cepstrum_spacing(finger_spectra(1, spacing=60.0)[0]) - 60.0) <= 1.0
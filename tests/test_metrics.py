@@ -0,0 +1,35 @@
+import tracemalloc
+
+import numpy as np
+
+from sipm_analysis.metrics import RunMetrics
+
+MB = 1 << 20
+
+
+def test_nested_stage_keeps_the_outer_peak(tmp_path):
+    metrics = RunMetrics('test_metrics.py', profile=False, trace_memory=True)
+    try:
+        with metrics.stage('outer'):
+            big = np.ones(8 * MB, dtype=np.uint8)
+            del big
+            with metrics.stage('inner'):
+                small = np.ones(MB, dtype=np.uint8)
+                del small
+        assert metrics.stages['outer']['peak_memory_bytes'] >= 8 * MB
+        assert metrics.stages['inner']['peak_memory_bytes'] < 8 * MB
+    finally:
+        metrics.write_json(tmp_path)
+    assert not tracemalloc.is_tracing()
+
+
+def test_write_json_leaves_tracing_started_elsewhere(tmp_path):
+    tracemalloc.start()
+    try:
+        metrics = RunMetrics('test_metrics.py', profile=False, trace_memory=True)
+        with metrics.stage('load'):
+            pass
+        metrics.write_json(tmp_path)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,45 @@
+import numpy as np
+
+from sipm_analysis import parallel_pairs
+from sipm_analysis.accidentals import DeltaTHistogram
+from sipm_analysis.addback import pair_events
+from sipm_analysis.parallel_pairs import add_delta_t_parallel, pair_events_parallel
+
+
+def two_channel_run(n_events=20_000, seed=0):
+    """Sorted CH0 / CH1 time tags (ps): half of CH1 follows CH0 within a few ns, the rest is random."""
+    rng = np.random.default_rng(seed)
+    t0 = np.sort(rng.integers(0, n_events * 50_000, n_events))
+    partners = rng.choice(t0, n_events // 2, replace=False) + rng.integers(-5_000, 5_000, n_events // 2)
+    t1 = np.sort(np.r_[partners, rng.integers(0, n_events * 50_000, n_events // 2)])
+    return t0.astype(np.int64), t1.astype(np.int64)
+
+
+def test_pair_events_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(parallel_pairs, 'MIN_CHUNK_EVENTS', 1_000)
+    t0, t1 = two_channel_run()
+    window_ps = 40_000  # wide enough that CH0 events compete for CH1 events across chunk boundaries
+    assert parallel_pairs.n_workers(2, len(t0)) == 2
+
+    serial = pair_events(t0, t1, window_ps)
+    parallel = pair_events_parallel(t0, t1, window_ps, workers=2)
+
+    assert len(serial[0]) > 0
+    np.testing.assert_array_equal(parallel[0], serial[0])
+    np.testing.assert_array_equal(parallel[1], serial[1])
+
+
+def test_add_delta_t_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(parallel_pairs, 'MIN_CHUNK_EVENTS', 1_000)
+    t0, t1 = two_channel_run(seed=1)
+    rng = np.random.default_rng(2)
+    classes0, classes1 = rng.integers(0, 3, len(t0)), rng.integers(0, 3, len(t1))
+
+    serial = DeltaTHistogram(500, 4, n_classes=3)
+    serial.add(t0, t1, classes0, classes1)
+    serial.extend_span(t0, t1)
+    parallel = add_delta_t_parallel(DeltaTHistogram(500, 4, n_classes=3), t0, t1, classes0, classes1, workers=2)
+
+    assert serial.counts.sum() > 0
+    np.testing.assert_array_equal(parallel.counts, serial.counts)
+    assert (parallel.first, parallel.last) == (serial.first, serial.last)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from sipm_analysis.peak_table import PeakTable
+from sipm_analysis.slopes import iter_pulse_groups
+
+
+def peak_frame(channels=('CH0', 'CH1'), gains=(1.6, 1.4), pulses=(6.5, 7.0), n_peaks=4, with_state=False):
+    """PEAK_TABLE_COLUMNS DataFrame: n_peaks peaks per channel, gain and pulse, 'N/A' on each first peak."""
+    rows = []
+    for ch in channels:
+        for gain in gains:
+            for pulse in pulses:
+                for number in range(1, n_peaks + 1):
+                    rows.append({
+                        'Timestamp': '2025-03-14 10:20:30', 'Channel': ch,
+                        'Voltage Gain (V)': gain, 'Pulse Voltage (V)': pulse,
+                        'Peak Number': number, 'Peak Index': 40 * number, 'Peak Counts': 100.5 * number,
+                        'Index Difference': "N/A" if number == 1 else 40, 'Peak Width': 8.25,
+                    })
+    df = pd.DataFrame(rows)
+    if with_state:
+        df['State'] = np.where(df['Peak Number'] % 2, 'built', None)
+        df['SourceFile'] = [None if i % 3 == 0 else f'run_{i % 2}.csv' for i in range(len(df))]
+    return df
+
+
+def test_from_frame_to_frame_round_trips():
+    for df in (peak_frame(), peak_frame(with_state=True)):
+        back = PeakTable.from_frame(df).to_frame()
+        assert list(back.columns) == list(df.columns)
+        pd.testing.assert_frame_equal(back, df, check_dtype=False)
+
+
+def test_concat_remaps_channel_codes():
+    first = PeakTable.from_frame(peak_frame(channels=('CH1',)))
+    second = PeakTable.from_frame(peak_frame(channels=('CH0', 'CH2')))
+    assert first.rows['channel'][0] == second.rows['channel'][0] == 0  # 'CH1' and 'CH0' both code 0
+
+    combined = PeakTable.concat([first, second])
+    assert list(combined.categories['channel']) == ['CH0', 'CH1', 'CH2']
+    expected = np.r_[first.labels('channel'), second.labels('channel')]
+    np.testing.assert_array_equal(combined.labels('channel'), expected)
+    pd.testing.assert_frame_equal(
+        combined.to_frame(), pd.concat([first.to_frame(), second.to_frame()], ignore_index=True))
+
+
+def test_groups_match_iter_pulse_groups():
+    # Channels out of name order and rows shuffled, so the order of first appearance matters
+    df = peak_frame(channels=('CH1', 'CH0')).sample(frac=1.0, random_state=0).reset_index(drop=True)
+    excluded = (2,)
+
+    expected = [(ch, gain, pulse, group) for ch, gain, pulse, group in iter_pulse_groups(df, excluded)
+                if len(group)]
+    groups = list(PeakTable.from_frame(df).groups(excluded))
+
+    assert [(ch, gain, pulse) for ch, gain, pulse, _ in groups] == \
+        [(ch, gain, pulse) for ch, gain, pulse, _ in expected]
+    for (_, _, _, table), (_, _, _, group) in zip(groups, expected):
+        pd.testing.assert_frame_equal(table.to_frame(), group.reset_index(drop=True), check_dtype=False)
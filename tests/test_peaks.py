@@ -0,0 +1,23 @@
+import numpy as np
+
+from sipm_analysis.peaks import manual_peaks_in_crop
+
+
+def test_manual_peaks_are_moved_to_the_crop():
+    assert manual_peaks_in_crop([240, 278, 653], 100) == [140, 178, 553]
+    assert manual_peaks_in_crop([240, 278, 653], 250) == [28, 403]
+    assert manual_peaks_in_crop([240, 278, 653], 100, n_bins=500) == [140, 178]
+    assert manual_peaks_in_crop([], 100) is None
+    assert manual_peaks_in_crop(None, 100) is None
+
+
+def test_manual_peaks_follow_an_auto_crop():
+    from sipm_analysis.peaks import analyze_spectra
+    from sipm_analysis.roi import resolve_crop
+
+    spectrum = np.zeros(4096)
+    spectrum[300:700] = 50.0
+    crop_off_start, crop_off_end = resolve_crop([spectrum], 'auto', 'auto')
+    manual = manual_peaks_in_crop([500], crop_off_start, len(spectrum) - crop_off_start - crop_off_end)
+    (_, peaks), = analyze_spectra([spectrum], crop_off_start, crop_off_end, counts_threshold=1e9, manual_peaks=manual)
+    np.testing.assert_array_equal(peaks + crop_off_start, [500])
@@ -0,0 +1,43 @@
+import numpy as np
+
+from sipm_analysis.roi import ROI_MARGIN, ROI_WINDOW, resolve_crop
+from sipm_analysis.trimmed import TrimmedSpectrum
+
+N_BINS = 4096
+
+
+def block_spectrum(start, stop, counts=50.0):
+    """Flat counts in bins start..stop-1, empty edges like the digitizer range."""
+    spectrum = np.zeros(N_BINS)
+    spectrum[start:stop] = counts
+    return spectrum
+
+
+def auto_region(start, stop):
+    """Crop of block_spectrum(start, stop): the averaging window and the margin past the filled bins."""
+    reach = ROI_WINDOW // 2 + ROI_MARGIN
+    return start - reach, N_BINS - (stop + reach)
+
+
+def test_auto_crop_keeps_the_filled_bins():
+    spectrum = block_spectrum(300, 700)
+    assert resolve_crop([spectrum], 'auto', 'auto') == auto_region(300, 700)
+    assert resolve_crop([TrimmedSpectrum.from_dense(spectrum)], 'auto', 'auto') == auto_region(300, 700)
+    # One crop for all spectra of a run; empty ones don't widen it
+    spectra = [block_spectrum(300, 700), block_spectrum(250, 600), np.zeros(N_BINS)]
+    assert resolve_crop(spectra, 'auto', 'auto') == (auto_region(250, 600)[0], auto_region(300, 700)[1])
+    assert resolve_crop([np.zeros(N_BINS)], 'auto', 'auto') == (0, 0)
+
+
+def test_numeric_crop_is_unchanged():
+    spectrum = block_spectrum(300, 700)
+    assert resolve_crop([spectrum], 100, 3000) == (100, 3000)
+    assert resolve_crop([spectrum], 0, 0) == (0, 0)
+
+
+def test_mixed_numeric_and_auto_crop():
+    spectrum = block_spectrum(300, 700)
+    start, end = auto_region(300, 700)
+    assert resolve_crop([spectrum], 100, 'auto') == (100, end)
+    assert resolve_crop([spectrum], 'AUTO', 3000) == (start, 3000)
+    assert resolve_crop([np.zeros(N_BINS)], 100, 'auto') == (100, 0)
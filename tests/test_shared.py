@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from sipm_analysis.peaks import analyze_spectra
+from sipm_analysis.shared import analyze_spectra_parallel
+
+
+def finger_spectra(n_spectra=5, n_bins=4096, seed=0):
+    """SiPM-like spectra: Poisson counts of a dozen Gaussian fingers on a pedestal that moves per spectrum."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_bins)
+    spectra = []
+    for i in range(n_spectra):
+        pedestal, spacing = 250 + 20 * i, 38 + i
+        mean = sum(4000 * np.exp(-0.35 * n) * np.exp(-0.5 * ((x - pedestal - spacing * n) / 4.5) ** 2)
+                   for n in range(12))
+        spectra.append(rng.poisson(mean).astype(float))
+    return spectra
+
+
+@pytest.mark.parametrize('method', ['threshold', 'baseline', 'cwt'])
+def test_analyze_spectra_parallel_matches_serial(method):
+    spectra = finger_spectra()
+    kwargs = dict(crop_off_start='auto', crop_off_end='auto', counts_threshold=20, method=method)
+
+    serial = analyze_spectra(spectra, **kwargs)
+    parallel = analyze_spectra_parallel(spectra, workers=2, **kwargs)
+
+    assert len(parallel) == len(serial)
+    for (smoothed, peaks), (serial_smoothed, serial_peaks) in zip(parallel, serial):
+        assert len(serial_peaks) > 0
+        np.testing.assert_array_equal(smoothed, serial_smoothed)
+        np.testing.assert_array_equal(peaks, serial_peaks)
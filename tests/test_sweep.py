@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from sipm_analysis.peaks import crop
+from sipm_analysis.roi import resolve_crop
+from sipm_analysis.sweep import sweep_peaks
+
+
+def cropped_spectra(n_spectra=4, n_bins=4096, seed=0):
+    """Cropped (auto) SiPM-like spectra: Poisson counts of Gaussian fingers, a different gain per spectrum."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_bins)
+    spectra = []
+    for i in range(n_spectra):
+        mean = sum(3000 * np.exp(-0.3 * n) * np.exp(-0.5 * ((x - 300 - (35 + 3 * i) * n) / 4) ** 2)
+                   for n in range(12))
+        spectra.append(rng.poisson(mean).astype(float))
+    crop_off_start, crop_off_end = resolve_crop(spectra, 'auto', 'auto')
+    return [crop(data, crop_off_start, crop_off_end) for data in spectra]
+
+
+@pytest.mark.parametrize('method', ['threshold', 'baseline', 'cwt'])
+def test_sweep_peaks_parallel_matches_serial(method):
+    spectra = cropped_spectra()
+    grid = dict(sigmas=[2.0, 3.6], counts_thresholds=[20, 100], peak_spacing_thresholds=[10, 16], method=method)
+
+    serial = sweep_peaks(spectra, workers=1, **grid)
+    parallel = sweep_peaks(spectra, workers=3, **grid)
+
+    assert len(serial) == len(spectra) * 2 * 2 * 2
+    assert [r[:4] for r in parallel] == [r[:4] for r in serial]
+    assert any(len(r[4]) for r in serial)
+    for r, s in zip(parallel, serial):
+        np.testing.assert_array_equal(r[4], s[4])
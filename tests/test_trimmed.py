@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from sipm_analysis.peaks import analyze_spectra, crop, find_spectrum_peaks, smooth_data
+from sipm_analysis.trimmed import TrimmedSpectrum
+
+
+def finger_spectrum(n_bins=4096, pedestal=260, spacing=38, n_fingers=9, seed=0):
+    """Poisson counts of Gaussian fingers on a pedestal, zero outside the populated range (like CoMPASS)."""
+    rng = np.random.default_rng(seed)
+    bins = np.arange(n_bins)
+    shape = sum(800 * np.exp(-0.35 * k) * np.exp(-0.5 * ((bins - pedestal - k * spacing) / 6.0) ** 2)
+                for k in range(n_fingers))
+    return rng.poisson(shape).astype(np.int64)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('crop_off', [(100, 3000), (300, 3400), ('auto', 'auto')])
+def test_trimmed_threshold_peaks_match_dense(seed, crop_off):
+    dense = finger_spectrum(seed=seed)
+    trimmed = TrimmedSpectrum.from_dense(dense)
+
+    smoothed_dense = smooth_data(crop(dense, *crop_off), sigma=4)
+    smoothed_trimmed = smooth_data(crop(trimmed, *crop_off), sigma=4)
+    np.testing.assert_allclose(np.asarray(smoothed_trimmed), smoothed_dense)
+
+    for kwargs in ({}, {'prominence': 5.0}, {'prominence': np.full(len(smoothed_dense), 5.0)},
+                   {'manual_peaks': [3, 150]}):
+        expected = find_spectrum_peaks(smoothed_dense, 10, 10, **kwargs)
+        assert len(expected) > 0
+        np.testing.assert_array_equal(find_spectrum_peaks(smoothed_trimmed, 10, 10, **kwargs), expected)
+
+
+def test_trimmed_analyze_spectra_match_dense():
+    dense = [finger_spectrum(seed=seed) for seed in range(4)]
+    trimmed = [TrimmedSpectrum.from_dense(data) for data in dense]
+
+    for (s_dense, p_dense), (s_trimmed, p_trimmed) in zip(analyze_spectra(dense, 'auto', 'auto'),
+                                                          analyze_spectra(trimmed, 'auto', 'auto')):
+        np.testing.assert_array_equal(p_trimmed, p_dense)
+        np.testing.assert_allclose(np.asarray(s_trimmed), s_dense)